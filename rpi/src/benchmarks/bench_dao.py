@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""bench_dao.py: Compare SensorDAO storage backends.
+
+Usage (from rpi/src)::
+
+    PYTHONPATH=. python benchmarks/bench_dao.py -sensors 200 -writes 20000 -reads 20000
+"""
+import argparse
+import datetime
+import random
+import tempfile
+import time
+
+from sensotrack.dao import SensorDAO
+from sensotrack.dao.cache import reset_cache
+
+
+def _sensor(sid, value):
+    return {
+        "sensorId": sid,
+        "value": str(value),
+        "measurementDate": datetime.datetime.now(datetime.timezone.utc).isoformat()
+    }
+
+
+def bench(backend, sensors, writes, reads):
+    """Run ingest and read benchmark for a backend.
+
+    :return: (ingest readings/s, read mean latency in µs)
+    :rtype: tuple
+    """
+    reset_cache()
+    with tempfile.TemporaryDirectory() as datadir:
+        conf = {
+            "datadir": datadir,
+            # Measure storage, not the cache
+            "dao": {"backend": backend, "cache": {"size": 0}}
+        }
+        dao = SensorDAO(conf)
+        sids = [f"sensor-{i}" for i in range(sensors)]
+
+        start = time.perf_counter()
+        for i in range(writes):
+            dao.upsert(_sensor(sids[i % sensors], i))
+        dao.storage.flush()
+        ingest = writes / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for _ in range(reads):
+            dao.get(random.choice(sids))
+        read_us = (time.perf_counter() - start) / reads * 1e6
+
+        SensorDAO.close_storages()
+    return ingest, read_us
+
+
+def main():
+    """Benchmark launcher."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-sensors", type=int, default=200)
+    parser.add_argument("-writes", type=int, default=20000)
+    parser.add_argument("-reads", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'backend':<8} {'ingest (readings/s)':>20} {'read (µs)':>10}")
+    for backend in SensorDAO.BACKENDS:
+        ingest, read_us = bench(backend, args.sensors, args.writes, args.reads)
+        print(f"{backend:<8} {ingest:>20.0f} {read_us:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""bench_envelope.py: Compare one publish per reading and readings envelopes.
+
+Readings are published through the broker to a subscriber decoding them,
+one text message per reading on ``sensors/data/<sid>`` (batch 1) or in
+envelopes of ``batch`` readings on ``BATCH_TOPIC``. For each mode the
+broker messages/s, readings/s and MQTT bytes (PUBLISH packet) per
+reading are printed.
+
+Requires a broker (default localhost:1883).
+
+Usage (from rpi/src)::
+
+    PYTHONPATH=. python benchmarks/bench_envelope.py -readings 50000 -batch 1 64 256
+"""
+import argparse
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+from sensotrack import settings
+from sensotrack.services import envelope
+
+
+def _packet_size(topic, payload):
+    """MQTT 3.1.1 QoS 0 PUBLISH packet size."""
+    remaining = 2 + len(topic.encode("utf-8")) + len(payload)
+    length_bytes = 1
+    while remaining >= 128 ** length_bytes:
+        length_bytes += 1
+    return 1 + length_bytes + remaining
+
+
+def _messages(readings, batch):
+    """Build (topic, payload) messages."""
+    if batch == 1:
+        return [(f"sensors/data/{sid}", value.encode("utf-8")) for sid, _, value in readings]
+    window = envelope.BatchWindow(batch, 1 << 30, 3600)
+    messages = []
+    for sid, ts, value in readings:
+        window.add(sid, ts, value)
+        if window.due():
+            messages.append((f"{settings.BATCH_TOPIC}/bench", envelope.encode(window.take())))
+    if len(window):
+        messages.append((f"{settings.BATCH_TOPIC}/bench", envelope.encode(window.take())))
+    return messages
+
+
+def bench(host, port, readings, batch, timeout):
+    """Publish readings and wait for the subscriber.
+
+    :return: messages count, received readings, elapsed seconds, bytes per reading
+    :rtype: tuple
+    """
+    messages = _messages(readings, batch)
+    received = [0]
+    done = threading.Event()
+
+    def on_message(client, userdata, msg):  # pylint: disable=unused-argument
+        if msg.topic.startswith(settings.BATCH_TOPIC):
+            received[0] += len(envelope.decode(msg.payload))
+        else:
+            received[0] += 1
+        if received[0] >= len(readings):
+            done.set()
+
+    subscribed = threading.Event()
+    subscriber = mqtt.Client(f"bench.sub.{time.time()}", True)
+    subscriber.on_message = on_message
+    subscriber.on_subscribe = lambda *_: subscribed.set()
+    subscriber.connect(host, port)
+    subscriber.subscribe([("sensors/data/#", 0), (f"{settings.BATCH_TOPIC}/#", 0)])
+    subscriber.loop_start()
+    subscribed.wait(5)
+
+    publisher = mqtt.Client(f"bench.pub.{time.time()}", True)
+    publisher.connect(host, port)
+    publisher.loop_start()
+    start = time.perf_counter()
+    for topic, payload in messages:
+        publisher.publish(topic, payload)
+    done.wait(timeout)
+    elapsed = time.perf_counter() - start
+    publisher.disconnect()
+    publisher.loop_stop()
+    subscriber.disconnect()
+    subscriber.loop_stop()
+    size = sum(_packet_size(topic, payload) for topic, payload in messages)
+    return len(messages), received[0], elapsed, size / len(readings)
+
+
+def main():
+    """Benchmark launcher."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-host", default="localhost")
+    parser.add_argument("-port", type=int, default=1883)
+    parser.add_argument("-sensors", type=int, default=100)
+    parser.add_argument("-readings", type=int, default=50000)
+    parser.add_argument("-batch", type=int, nargs="+", default=[1, 64, 256])
+    parser.add_argument("-timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    now = time.time()
+    readings = [
+        (f"sensor-{i % args.sensors}", now + i / 1000, f"{20 + (i % 100) / 10}")
+        for i in range(args.readings)
+    ]
+    print(f"{'batch':>5} {'msgs':>7} {'msgs/s':>8} {'readings/s':>10} "
+          f"{'bytes/reading':>13} {'received':>8}")
+    for batch in args.batch:
+        msgs, received, elapsed, per_reading = bench(
+            args.host, args.port, readings, batch, args.timeout
+        )
+        print(f"{batch:>5} {msgs:>7} {msgs / elapsed:>8.0f} {received / elapsed:>10.0f} "
+              f"{per_reading:>13.1f} {received:>8}")
+
+
+if __name__ == "__main__":
+    main()
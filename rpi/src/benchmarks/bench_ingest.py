@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""bench_ingest.py: Compare per message and micro-batched ingest.
+
+Readings are handed to the bus Receiver the way dispatch workers do (no
+broker involved), with the selected backend and history enabled. Time
+includes the wait for the storage to commit everything.
+
+Usage (from rpi/src)::
+
+    PYTHONPATH=. python benchmarks/bench_ingest.py -backend sqlite -readings 50000
+"""
+import argparse
+import tempfile
+import time
+
+from sensotrack.dao import SensorDAO
+from sensotrack.dao.cache import reset_cache
+from sensotrack.services.bus import Receiver
+from sensotrack.services.catalog import SensorCatalog
+from sensotrack.services.retention import RetentionService
+from sensotrack.utils.metrics import REGISTRY
+
+
+class _Message:  # pylint: disable=too-few-public-methods
+    """MQTT message."""
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+def bench(conf, msgs, batch):
+    """Ingest messages.
+
+    :return: readings/s, average SQLite commit size
+    :rtype: tuple
+    """
+    receiver = Receiver(conf)
+    commits = REGISTRY.summary("dao.sqlite.batch_size").snapshot()
+    start = time.perf_counter()
+    if batch > 1:
+        for index in range(0, len(msgs), batch):
+            receiver.process_messages(msgs[index:index + batch])
+    else:
+        for msg in msgs:
+            receiver.process_message(msg)
+    SensorDAO(conf).storage.flush()
+    elapsed = time.perf_counter() - start
+    after = REGISTRY.summary("dao.sqlite.batch_size").snapshot()
+    count = after["count"] - commits["count"]
+    return len(msgs) / elapsed, (after["sum"] - commits["sum"]) / count if count else 0
+
+
+def main():
+    """Benchmark launcher."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-backend", choices=["json", "sqlite"], default="sqlite")
+    parser.add_argument("-sensors", type=int, default=100)
+    parser.add_argument("-readings", type=int, default=50000)
+    parser.add_argument("-batch", type=int, nargs="+", default=[1, 64, 256])
+    args = parser.parse_args()
+
+    msgs = [
+        _Message(f"sensors/data/sensor-{i % args.sensors}", str(i).encode("utf8"))
+        for i in range(args.readings)
+    ]
+    print(f"{'batch':>5} {'readings/s':>10} {'commit_batch_avg':>16}")
+    for batch in args.batch:
+        reset_cache()
+        SensorCatalog.reset()
+        RetentionService.reset()
+        with tempfile.TemporaryDirectory() as datadir:
+            conf = {
+                "datadir": datadir,
+                "mqtt": {"host": "localhost", "port": 1883},
+                "dao": {"backend": args.backend, "writer": {"enabled": True}},
+                "history": {"enabled": True}
+            }
+            rate, commit_batch = bench(conf, msgs, batch)
+            print(f"{batch:>5} {rate:>10.0f} {commit_batch:>16.1f}")
+            SensorDAO.close_storages()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""bench_last.py: Compare GET /last marshalling and pre-rendered paths.
+
+Requests are served by the Flask test client (no network) so the
+measure is the request handling cost.
+
+Usage (from rpi/src)::
+
+    PYTHONPATH=. python benchmarks/bench_last.py -sensors 100 -requests 20000
+"""
+import argparse
+import datetime
+import json
+import random
+import tempfile
+import time
+
+from flask import Flask
+from flask_restx import Api, Resource, fields, marshal_with
+
+from sensotrack.dao import SensorDAO, render_sensor
+from sensotrack.dao.cache import reset_cache
+
+
+def _app(dao):
+    app = Flask(__name__)
+    api = Api(app)
+    model = api.model('SensorValue', {
+        "sensorId": fields.String(),
+        "value": fields.String(),
+        "measurementDate": fields.String()
+    })
+
+    @api.route("/marshal/<sid>")
+    class Marshalled(Resource):  # pylint: disable=unused-variable
+        """Former /last implementation."""
+
+        @marshal_with(model)
+        def get(self, sid):
+            """Get marshalled value."""
+            return dao.get(sid)
+
+    @api.route("/rendered/<sid>")
+    class Rendered(Resource):  # pylint: disable=unused-variable
+        """Current /last implementation."""
+
+        def get(self, sid):
+            """Get pre-rendered value."""
+            return app.response_class(dao.get_rendered(sid), mimetype="application/json")
+
+    return app
+
+
+def bench(client, path, sids, requests):
+    """Run requests on a path.
+
+    :return: requests/s
+    :rtype: float
+    """
+    start = time.perf_counter()
+    for _ in range(requests):
+        resp = client.get(f"/{path}/{random.choice(sids)}")
+        assert resp.status_code == 200
+    return requests / (time.perf_counter() - start)
+
+
+def main():
+    """Benchmark launcher."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-sensors", type=int, default=100)
+    parser.add_argument("-requests", type=int, default=20000)
+    args = parser.parse_args()
+
+    reset_cache()
+    with tempfile.TemporaryDirectory() as datadir:
+        dao = SensorDAO({"datadir": datadir})
+        sids = [f"sensor-{i}" for i in range(args.sensors)]
+        for sid in sids:
+            dao.upsert({
+                "sensorId": sid,
+                "value": str(random.random()),
+                "measurementDate": datetime.datetime.now(datetime.timezone.utc).isoformat()
+            })
+        client = _app(dao).test_client()
+        assert json.loads(client.get(f"/marshal/{sids[0]}").data) \
+            == json.loads(render_sensor(dao.get(sids[0])))
+
+        print(f"{'path':<9} {'requests/s':>10}")
+        for path in ("marshal", "rendered"):
+            print(f"{path:<9} {bench(client, path, sids, args.requests):>10.0f}")
+        SensorDAO.close_storages()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""bench_longpoll.py: Compare POST /last long polling capacity of serving modes.
+
+N clients wait for a new value of their own sensor at the same time, then
+all values are notified. For each mode the number of threads of the
+process while clients wait and the time to answer all of them is printed.
+
+Requires uvicorn (``pip install sensotrack[asgi]``). Raise the open files
+limit for large client counts (``ulimit -n``).
+
+Usage (from rpi/src)::
+
+    PYTHONPATH=. python benchmarks/bench_longpoll.py -clients 100 1000
+"""
+import argparse
+import asyncio
+import logging
+import tempfile
+import threading
+import time
+
+import mock
+import uvicorn
+from werkzeug.serving import make_server
+
+from sensotrack import settings
+from sensotrack.app import APP, initialize_app
+from sensotrack.asgi import AsgiApp
+from sensotrack.services.notifier import ValueNotifier
+from sensotrack.utils.metrics import REGISTRY
+
+WSGI_PORT = 8081
+ASGI_PORT = 8082
+
+
+def _start_wsgi():
+    server = make_server("127.0.0.1", WSGI_PORT, APP, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.shutdown
+
+
+def _start_asgi():
+    server = uvicorn.Server(uvicorn.Config(
+        AsgiApp(APP), host="127.0.0.1", port=ASGI_PORT,
+        lifespan="off", log_level="warning", backlog=4096
+    ))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+
+    def stop():
+        server.should_exit = True
+        thread.join()
+    return stop
+
+
+async def _client(port, sid):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write((
+        f"POST /v1/sensors/{sid}/last HTTP/1.1\r\nHost: localhost\r\n"
+        "Accept: application/json\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+    ).encode())
+    await writer.drain()
+    status = (await reader.readline()).split()[1]
+    await reader.read()
+    writer.close()
+    return status == b"200"
+
+
+async def _bench(port, clients):
+    waiters = REGISTRY.gauge("notifier.waiters")
+    tasks = [asyncio.ensure_future(_client(port, f"s{i}")) for i in range(clients)]
+    while waiters.value < clients:
+        await asyncio.sleep(0.01)
+    threads = threading.active_count()
+    start = time.perf_counter()
+    notifier = ValueNotifier()
+    for i in range(clients):
+        notifier.notify(f"s{i}", {
+            "sensorId": f"s{i}", "value": "1", "measurementDate": "2023-10-03T05:27:40+00:00"
+        })
+    answered = sum(await asyncio.gather(*tasks))
+    return threads, answered, time.perf_counter() - start
+
+
+def main():
+    """Benchmark launcher."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-clients", type=int, nargs="+", default=[100, 1000])
+    args = parser.parse_args()
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as datadir, \
+            mock.patch("sensotrack.services.sensors.SensorService.send_command"):
+        settings.conf = {
+            "datadir": datadir,
+            "notifications": {"timeout_s": 60}
+        }
+        initialize_app(APP)
+        print(f"{'mode':<5} {'clients':>7} {'threads':>7} {'answered':>8} {'answer_s':>8}")
+        for mode, start_server, port in (
+            ("wsgi", _start_wsgi, WSGI_PORT), ("asgi", _start_asgi, ASGI_PORT)
+        ):
+            stop = start_server()
+            for clients in args.clients:
+                threads, answered, elapsed = asyncio.run(_bench(port, clients))
+                print(f"{mode:<5} {clients:>7} {threads:>7} {answered:>8} {elapsed:>8.3f}")
+            stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -6,5 +6,9 @@ import sensotrack.app
 gunicorn.SERVER_SOFTWARE = ''
 
 def post_fork(server, worker):  # pylint: disable=unused-argument
-    """Triggered by master after a worker has been spawned."""
+    """Triggered by master after a worker has been spawned.
+
+    Worker roles come from SENSOTRACK_ROLES (set by ``webapi -role api``),
+    else from configuration.
+    """
     sensotrack.app.load_config()
@@ -0,0 +1,74 @@
+# -*- coding: UTF-8 -*-
+"""HTTP conditional requests (ETag / Last-Modified) support."""
+import functools
+import hashlib
+
+from flask import Response, request
+from flask_restx.utils import unpack
+from werkzeug.http import http_date
+
+from sensotrack import settings
+from sensotrack.utils.metrics import REGISTRY
+
+
+def version_tag(*parts):
+    """Build an entity tag from values identifying a representation.
+
+    :return: tag (not quoted)
+    :rtype: str
+    """
+    return hashlib.sha1(
+        "\x00".join(str(part) for part in parts).encode("utf-8")
+    ).hexdigest()[:20]
+
+
+def _not_modified(etag, last_modified):
+    # If-None-Match takes precedence over If-Modified-Since (RFC 9110)
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since:
+        # Last-Modified has a one second precision: a sub-second date is
+        # never matched, as a later change in the same second would be missed
+        return last_modified <= request.if_modified_since.timestamp()
+    return False
+
+
+def conditional(validators):
+    """Decorate a GET resource method to support conditional requests.
+
+    ``validators`` gets the method arguments and returns the ``(etag,
+    last modified epoch timestamp)`` of the resource, or None if the
+    resource doesn't exist. It must be cheap: a ``304 Not Modified`` is
+    returned without calling the method if the request validators match.
+    Otherwise ``ETag``, ``Last-Modified`` and ``Cache-Control`` headers are
+    added to the method response.
+
+    :param validators: validators getter
+    :type validators: callable
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            res = validators(*args, **kwargs)
+            if res is None:
+                return func(*args, **kwargs)
+            etag, last_modified = res
+            headers = {
+                "ETag": f'"{etag}"',
+                "Last-Modified": http_date(int(last_modified)),
+                "Cache-Control": settings.conf.get("http", settings.http).get(
+                    "cache_control", settings.http["cache_control"]
+                )
+            }
+            if _not_modified(etag, last_modified):
+                REGISTRY.counter("http.not_modified").inc()
+                return Response(status=304, headers=headers)
+            resp = func(*args, **kwargs)
+            if isinstance(resp, Response):
+                resp.headers.update(headers)
+                return resp
+            data, code, resp_headers = unpack(resp)
+            resp_headers.update(headers)
+            return data, code, resp_headers
+        return wrapper
+    return decorator
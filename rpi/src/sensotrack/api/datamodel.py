@@ -51,9 +51,168 @@ SENSOR_VALUE =  API.model('SensorValue', {
         description="Measurement date using ISO format"
     )
 })
+SENSORS_VALUES = API.model('SensorsValues', {
+    "values": fields.List(
+        fields.Nested(SENSOR_VALUE),
+        required=True,
+        description="Found sensors last values"
+    ),
+    "missing": fields.List(
+        fields.String,
+        required=True,
+        description="Requested sensors without value"
+    )
+})
+SENSORS_IDS = API.model('SensorsIds', {
+    "ids": fields.List(
+        fields.String,
+        required=False,
+        description="Sensors identifiers"
+    ),
+    "all": fields.Boolean(
+        required=False,
+        default=False,
+        description="Request all sensors (ids is ignored)"
+    )
+})
+SENSOR_INFO = API.model('SensorInfo', {
+    "sensorId": fields.String(
+        required=True,
+        description="Sensor Identifier"
+    ),
+    "connector": fields.String(
+        required=False,
+        description="Connector handling the sensor (if known)"
+    ),
+    "device": fields.String(
+        required=False,
+        description="Device the sensor is attached to (if known)"
+    ),
+    "firstSeen": fields.String(
+        required=True,
+        description="First seen date using ISO format"
+    ),
+    "lastSeen": fields.String(
+        required=False,
+        description="Last reading date using ISO format"
+    ),
+    "readings": fields.Integer(
+        required=True,
+        description="Number of readings received"
+    ),
+    "valueType": fields.String(
+        required=False,
+        description="Type of last value (number or string)"
+    )
+})
+SENSORS_LIST = API.model('SensorsList', {
+    "total": fields.Integer(
+        required=True,
+        description="Number of sensors matching filters"
+    ),
+    "offset": fields.Integer(required=True, description="Page offset"),
+    "limit": fields.Integer(required=True, description="Page size"),
+    "sensors": fields.List(
+        fields.Nested(SENSOR_INFO),
+        required=True,
+        description="Page of sensors sorted by identifier"
+    )
+})
+SENSOR_HISTORY = API.model('SensorHistory', {
+    "sensorId": fields.String(
+        required=True,
+        description="Sensor Identifier"
+    ),
+    "values": fields.List(
+        fields.Nested(SENSOR_VALUE),
+        required=True,
+        description="Sensor values sorted by measurement date"
+    )
+})
+ROLLUP_BUCKET = API.model('RollupBucket', {
+    "start": fields.String(
+        required=True,
+        description="Bucket start date using ISO format"
+    ),
+    "min": fields.Float(required=True, description="Min value"),
+    "max": fields.Float(required=True, description="Max value"),
+    "avg": fields.Float(required=True, description="Average value"),
+    "count": fields.Integer(required=True, description="Number of values")
+})
+SENSOR_ROLLUP = API.model('SensorRollup', {
+    "sensorId": fields.String(
+        required=True,
+        description="Sensor Identifier"
+    ),
+    "resolution": fields.String(
+        required=True,
+        description="Buckets resolution",
+        example="1h"
+    ),
+    "buckets": fields.List(
+        fields.Nested(ROLLUP_BUCKET),
+        required=True,
+        description="Buckets sorted by start date"
+    )
+})
 SENSOR_COMMAND = API.model('SensorCommand', {
     "command": fields.String(
         required=True,
         description="Command to send to sensor"
     )
 })
+
+SENSOR_COMMAND_ITEM = API.model('SensorCommandItem', {
+    "sid": fields.String(
+        required=True,
+        description="Sensor Identifier"
+    ),
+    "command": fields.String(
+        required=True,
+        description="Command to send to sensor"
+    )
+})
+
+SENSORS_SELECTOR = API.model('SensorsSelector', {
+    "prefix": fields.String(
+        description="Sensor identifier prefix"
+    ),
+    "connector": fields.String(
+        description="Owning connector class name"
+    )
+})
+
+SENSORS_COMMANDS = API.model('SensorsCommands', {
+    "commands": fields.List(
+        fields.Nested(SENSOR_COMMAND_ITEM),
+        description="Commands to send (exclusive with selector)"
+    ),
+    "selector": fields.Nested(
+        SENSORS_SELECTOR,
+        description="Catalog sensors to send command to (prefix or connector required)"
+    ),
+    "command": fields.String(
+        description="Command to send to selected sensors"
+    )
+})
+
+SENSOR_COMMAND_STATUS = API.model('SensorCommandStatus', {
+    "sensorId": fields.String(
+        required=True,
+        description="Sensor Identifier"
+    ),
+    "status": fields.String(
+        required=True,
+        description="Dispatch status (dispatched, not_found or failed)"
+    ),
+    "message": fields.String(
+        description="Error message"
+    )
+})
+
+SENSORS_COMMANDS_STATUS = API.model('SensorsCommandsStatus', {
+    "results": fields.List(
+        fields.Nested(SENSOR_COMMAND_STATUS),
+        description="Dispatch status by sensor"
+    )
+})
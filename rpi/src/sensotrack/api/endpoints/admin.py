@@ -7,6 +7,7 @@ from flask_restx import Resource
 from sensotrack import settings
 from sensotrack.api.datamodel import API_STATUS
 from sensotrack.api.restx import API
+from sensotrack.utils.metrics import REGISTRY
 
 NS = API.namespace(
     name='Admin',
@@ -39,3 +40,21 @@ class Ping(Resource):
         status = 200
 
         return res, status
+
+
+@NS.route(F'{settings.RESTX_BASE_URL_CURRENT}/metrics')
+class Metrics(Resource):
+    """Internal metrics class."""
+
+    logger = None
+
+    # pylint: disable=keyword-arg-before-vararg
+    def __init__(self, api=None, *args, **kwargs):
+        Resource.__init__(self, api, kwargs)
+        self.logger = logging.getLogger(__name__)
+
+    def get(self):
+        """Return internal metrics (caches, queues, latencies...)."""
+
+        self.logger.debug("Admin.metrics")
+        return REGISTRY.snapshot(), 200
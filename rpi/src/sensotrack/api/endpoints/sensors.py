@@ -1,14 +1,22 @@
 # -*- coding: utf-8 -*-
 """Sensors endpoints."""
+import datetime
 import logging
 
-from flask import request
-from flask_restx import Resource
+from flask import Response, g, request, stream_with_context
+from flask_restx import Resource, inputs, reqparse
 
 from sensotrack import settings
-from sensotrack.api.datamodel import SENSOR_VALUE, SENSOR_COMMAND
+from sensotrack.api.conditional import conditional, version_tag
+from sensotrack.api.datamodel import (
+    SENSOR_VALUE, SENSOR_COMMAND, SENSOR_HISTORY, SENSOR_ROLLUP,
+    SENSORS_COMMANDS, SENSORS_COMMANDS_STATUS, SENSORS_IDS, SENSORS_VALUES,
+    SENSORS_LIST
+)
 from sensotrack.api.restx import API
+from sensotrack.dao.history import HistoryDAO
 from sensotrack.services.sensors import SensorService
+from sensotrack.services.stream import StreamHub
 from sensotrack.utils.exceptions import STException
 
 NS = API.namespace(
@@ -17,6 +25,325 @@ NS = API.namespace(
     description='Sensorts resources'
 )
 
+MAX_HISTORY_LIMIT = 10000
+MAX_BULK_IDS = 10000
+MAX_PAGE_SIZE = 1000
+
+
+def _iso_date(value):
+    """Parse ISO date query parameter to epoch timestamp (UTC if no TZ)."""
+    try:
+        date = datetime.datetime.fromisoformat(value)
+    except ValueError as exc:
+        raise ValueError(f"{value} is not an ISO date") from exc
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return date.timestamp()
+
+
+HISTORY_ARGS = reqparse.RequestParser()
+HISTORY_ARGS.add_argument(
+    "from", type=_iso_date, location="args", dest="from_ts",
+    help="Range start (ISO date, included)"
+)
+HISTORY_ARGS.add_argument(
+    "to", type=_iso_date, location="args", dest="to_ts",
+    help="Range end (ISO date, included)"
+)
+HISTORY_ARGS.add_argument(
+    "min", type=float, location="args", dest="min_value",
+    help="Only return numeric values greater or equal to min"
+)
+HISTORY_ARGS.add_argument(
+    "max", type=float, location="args", dest="max_value",
+    help="Only return numeric values lower or equal to max"
+)
+HISTORY_ARGS.add_argument(
+    "limit", type=int, location="args", default=1000,
+    help=f"Max number of values (max {MAX_HISTORY_LIMIT})"
+)
+
+ROLLUP_ARGS = reqparse.RequestParser()
+ROLLUP_ARGS.add_argument(
+    "resolution", type=str, location="args", required=True,
+    help="Buckets resolution (e.g. 1m, 1h, 1d)"
+)
+ROLLUP_ARGS.add_argument(
+    "from", type=_iso_date, location="args", dest="from_ts",
+    help="Range start (ISO date, included)"
+)
+ROLLUP_ARGS.add_argument(
+    "to", type=_iso_date, location="args", dest="to_ts",
+    help="Range end (ISO date, included)"
+)
+
+BULK_ARGS = reqparse.RequestParser()
+BULK_ARGS.add_argument(
+    "ids", type=str, location="args",
+    help="Comma separated sensors identifiers"
+)
+BULK_ARGS.add_argument(
+    "all", type=inputs.boolean, location="args", default=False,
+    help="Request all sensors (ids is ignored)"
+)
+
+LIST_ARGS = reqparse.RequestParser()
+LIST_ARGS.add_argument(
+    "prefix", type=str, location="args",
+    help="Sensor identifier prefix"
+)
+LIST_ARGS.add_argument(
+    "connector", type=str, location="args",
+    help="Owning connector class name"
+)
+LIST_ARGS.add_argument(
+    "stale_for", type=float, location="args",
+    help="Only sensors without reading for this number of seconds"
+)
+LIST_ARGS.add_argument(
+    "offset", type=int, location="args", default=0,
+    help="Number of sensors to skip"
+)
+LIST_ARGS.add_argument(
+    "limit", type=int, location="args", default=100,
+    help=f"Page size (max {MAX_PAGE_SIZE})"
+)
+
+WINDOW_ARGS = reqparse.RequestParser()
+WINDOW_ARGS.add_argument(
+    "count", type=int, location="args", default=100,
+    help=f"Number of last values (max {MAX_HISTORY_LIMIT})"
+)
+
+STREAM_ARGS = reqparse.RequestParser()
+STREAM_ARGS.add_argument(
+    "ids", type=str, location="args",
+    help="Comma separated sensors identifiers"
+)
+STREAM_ARGS.add_argument(
+    "prefix", type=str, location="args",
+    help="Sensor identifier prefix"
+)
+STREAM_ARGS.add_argument(
+    "Last-Event-ID", type=int, location="headers", dest="last_event_id",
+    help="Resume stream after this event"
+)
+
+
+def _split_ids(ids):
+    return [sid for sid in (ids or "").split(",") if sid]
+
+
+def _last_validators(_resource, sid):
+    last_ts = SensorService(settings.conf).get_dates([sid]).get(sid)
+    if last_ts is None:
+        return None
+    return version_tag(sid, last_ts), last_ts
+
+
+def _bulk_validators(_resource):
+    args = BULK_ARGS.parse_args()
+    ids = None if args["all"] else _split_ids(args["ids"])
+    if ids is not None and (not ids or len(ids) > MAX_BULK_IDS):
+        return None
+    dates = SensorService(settings.conf).get_dates(ids)
+    if ids is None:
+        # Reused by the handler to not list all sensors twice
+        g.all_sensor_ids = sorted(dates)
+    if not dates:
+        return None
+    return (
+        version_tag(*(f"{sid}={dates.get(sid)}" for sid in ids or sorted(dates))),
+        max(dates.values())
+    )
+
+
+def _history_validators(_resource, sid):
+    if not HistoryDAO.enabled(settings.conf):
+        return None
+    last_ts = SensorService(settings.conf).get_dates([sid]).get(sid)
+    if last_ts is None:
+        return None
+    # Result only changes when sensor gets a new value
+    return version_tag(sid, last_ts, request.query_string), last_ts
+
+
+@NS.route(F'{settings.RESTX_BASE_URL_CURRENT}/sensors')
+class Sensors(Resource):
+    """Sensors catalog endpoint class."""
+
+    logger = None
+
+    # pylint: disable=keyword-arg-before-vararg
+    def __init__(self, api=None, *args, **kwargs):
+        Resource.__init__(self, api, kwargs)
+        self.logger = logging.getLogger(__name__)
+
+    @API.marshal_with(SENSORS_LIST)
+    @NS.expect(LIST_ARGS)
+    @NS.response(400, "Invalid pagination")
+    def get(self):
+        """List known sensors."""
+
+        args = LIST_ARGS.parse_args()
+        self.logger.info("GET sensors list")
+        if args["offset"] < 0 or args["limit"] <= 0 or args["limit"] > MAX_PAGE_SIZE:
+            raise STException(
+                f"offset must be positive and limit in [1, {MAX_PAGE_SIZE}]",
+                400
+            )
+
+        svc = SensorService(settings.conf)
+        total, sensors = svc.search(
+            args["prefix"], args["connector"], args["stale_for"],
+            args["offset"], args["limit"]
+        )
+        return {
+            "total": total,
+            "offset": args["offset"],
+            "limit": args["limit"],
+            "sensors": sensors
+        }
+
+
+def _bulk_last(ids, all_sensors):
+    if all_sensors:
+        # Already listed sensors ids if any
+        ids = ids or None
+    elif not ids:
+        raise STException("ids or all is required", 400)
+    elif len(ids) > MAX_BULK_IDS:
+        raise STException(f"Too many ids (max {MAX_BULK_IDS})", 400)
+    else:
+        # Remove duplicates, keep order
+        ids = list(dict.fromkeys(ids))
+
+    svc = SensorService(settings.conf)
+    values, missing = svc.get_many(ids)
+    return {
+        "values": values,
+        "missing": missing
+    }
+
+
+@NS.route(F'{settings.RESTX_BASE_URL_CURRENT}/sensors/last')
+class SensorsLast(Resource):
+    """Multiple sensors last value endpoint class."""
+
+    logger = None
+
+    # pylint: disable=keyword-arg-before-vararg
+    def __init__(self, api=None, *args, **kwargs):
+        Resource.__init__(self, api, kwargs)
+        self.logger = logging.getLogger(__name__)
+
+    @NS.expect(BULK_ARGS)
+    @NS.response(304, "Not modified")
+    @NS.response(400, "No sensor requested")
+    @conditional(_bulk_validators)
+    @API.marshal_with(SENSORS_VALUES)
+    def get(self):
+        """Return last record value for several sensors."""
+
+        args = BULK_ARGS.parse_args()
+        if args["all"]:
+            ids = g.pop("all_sensor_ids", [])
+        else:
+            ids = _split_ids(args["ids"])
+        self.logger.info("GET last value from %d sensors", len(ids))
+        return _bulk_last(ids, args["all"])
+
+    @API.marshal_with(SENSORS_VALUES)
+    @NS.expect(SENSORS_IDS)
+    @NS.response(400, "No sensor requested")
+    def post(self):
+        """Return last record value for several sensors (long ids lists)."""
+
+        body = request.json or {}
+        ids = body.get("ids") or []
+        self.logger.info("POST last value from %d sensors", len(ids))
+        return _bulk_last(ids, body.get("all", False))
+
+
+@NS.route(F'{settings.RESTX_BASE_URL_CURRENT}/sensors/stream')
+class SensorsStream(Resource):
+    """Sensors values live stream endpoint class."""
+
+    logger = None
+
+    # pylint: disable=keyword-arg-before-vararg
+    def __init__(self, api=None, *args, **kwargs):
+        Resource.__init__(self, api, kwargs)
+        self.logger = logging.getLogger(__name__)
+
+    @NS.expect(STREAM_ARGS)
+    @NS.produces(["text/event-stream"])
+    @NS.response(200, "Stream of 'value' events holding sensor values")
+    def get(self):
+        """Stream new values of sensors (Server-Sent Events).
+
+        Without ids nor prefix all sensors are streamed.
+        """
+
+        args = STREAM_ARGS.parse_args()
+        ids = {sid for sid in (args["ids"] or "").split(",") if sid} or None
+        self.logger.info("GET sensors stream (ids=%s, prefix=%s)", ids, args["prefix"])
+        hub = StreamHub(settings.conf)
+        sub = hub.subscribe(ids, args["prefix"], args["last_event_id"])
+        return Response(
+            stream_with_context(hub.events(sub)),
+            mimetype="text/event-stream",
+            headers={
+                "Cache-Control": "no-cache",
+                "X-Accel-Buffering": "no"
+            }
+        )
+
+
+@NS.route(F'{settings.RESTX_BASE_URL_CURRENT}/sensors/commands')
+class SensorsCommands(Resource):
+    """Multiple sensors commands endpoint class."""
+
+    logger = None
+
+    # pylint: disable=keyword-arg-before-vararg
+    def __init__(self, api=None, *args, **kwargs):
+        Resource.__init__(self, api, kwargs)
+        self.logger = logging.getLogger(__name__)
+
+    @API.marshal_with(SENSORS_COMMANDS_STATUS)
+    @NS.expect(SENSORS_COMMANDS)
+    @NS.response(400, "Invalid commands or selector")
+    def post(self):
+        """Send commands to several sensors.
+
+        Either a list of commands or a selector of catalog sensors and the
+        command to send to them.
+        """
+
+        body = request.json or {}
+        svc = SensorService(settings.conf)
+        if body.get("commands"):
+            commands = [(item["sid"], item["command"]) for item in body["commands"]]
+        elif body.get("selector") is not None and body.get("command") is not None:
+            selector = body["selector"]
+            if not (selector.get("prefix") or selector.get("connector")):
+                # Don't send a command to every sensor by mistake
+                raise STException("selector requires a non empty prefix or connector", 400)
+            commands = [
+                (sid, body["command"])
+                for sid in svc.select_sensors(selector.get("prefix"), selector.get("connector"))
+            ]
+        else:
+            raise STException("commands or selector and command are required", 400)
+        if len(commands) > MAX_BULK_IDS:
+            raise STException(f"Too many sensors (max {MAX_BULK_IDS})", 400)
+
+        self.logger.info("POST commands to %d sensors", len(commands))
+        return {
+            "results": svc.send_commands(commands) if commands else []
+        }
+
 
 @NS.route(F'{settings.RESTX_BASE_URL_CURRENT}/sensors/<sid>/last')
 class OneSensorLast(Resource):
@@ -29,18 +356,21 @@ class OneSensorLast(Resource):
         Resource.__init__(self, api, kwargs)
         self.logger = logging.getLogger(__name__)
 
-    @API.marshal_with(SENSOR_VALUE)
+    @NS.response(200, "Success", SENSOR_VALUE)
+    @NS.response(304, "Not modified")
     @NS.response(404, "Sensor or value not found")
+    @conditional(_last_validators)
     def get(self, sid):
         """Return last record value for sensor ID."""
 
         self.logger.info("GET last value from %s", sid)
         svc = SensorService(settings.conf)
-        res = svc.get(sid)
+        # Served as rendered at ingest, no marshalling
+        res = svc.get_rendered(sid)
         if not res:
             raise STException("Sensor value not found", 404)
 
-        return res
+        return Response(res, mimetype="application/json")
 
     @API.marshal_with(SENSOR_VALUE)
     @NS.response(404, "Sensor or value not found")
@@ -73,3 +403,120 @@ class OneSensor(Resource):
         self.logger.debug(request.json)
         svc = SensorService(settings.conf)
         svc.send_command(sid, request.json["command"])
+
+
+@NS.route(F'{settings.RESTX_BASE_URL_CURRENT}/sensors/<sid>/history')
+class OneSensorHistory(Resource):
+    """Single sensor history endpoint class."""
+
+    logger = None
+
+    # pylint: disable=keyword-arg-before-vararg
+    def __init__(self, api=None, *args, **kwargs):
+        Resource.__init__(self, api, kwargs)
+        self.logger = logging.getLogger(__name__)
+
+    @NS.expect(HISTORY_ARGS)
+    @NS.response(304, "Not modified")
+    @NS.response(400, "Invalid range")
+    @NS.response(404, "History is not enabled")
+    @conditional(_history_validators)
+    @API.marshal_with(SENSOR_HISTORY)
+    def get(self, sid):
+        """Return sensor values in a time range."""
+
+        args = HISTORY_ARGS.parse_args()
+        self.logger.info(
+            "GET history from %s (%s - %s)", sid, args["from_ts"], args["to_ts"]
+        )
+        if args["limit"] <= 0 or args["limit"] > MAX_HISTORY_LIMIT:
+            raise STException(f"limit must be in [1, {MAX_HISTORY_LIMIT}]", 400)
+        if args["from_ts"] is not None and args["to_ts"] is not None \
+            and args["from_ts"] > args["to_ts"]:
+            raise STException("from must be before to", 400)
+
+        svc = SensorService(settings.conf)
+        values = svc.get_history(
+            sid, args["from_ts"], args["to_ts"], args["limit"],
+            args["min_value"], args["max_value"]
+        )
+        if values is None:
+            raise STException("Sensors history is not enabled", 404)
+
+        return {
+            "sensorId": sid,
+            "values": values
+        }
+
+
+@NS.route(F'{settings.RESTX_BASE_URL_CURRENT}/sensors/<sid>/window')
+class OneSensorWindow(Resource):
+    """Single sensor last numeric values endpoint class."""
+
+    logger = None
+
+    # pylint: disable=keyword-arg-before-vararg
+    def __init__(self, api=None, *args, **kwargs):
+        Resource.__init__(self, api, kwargs)
+        self.logger = logging.getLogger(__name__)
+
+    @API.marshal_with(SENSOR_HISTORY)
+    @NS.expect(WINDOW_ARGS)
+    @NS.response(400, "Invalid count")
+    @NS.response(404, "Ring storage is not enabled or sensor has no ring")
+    def get(self, sid):
+        """Return sensor last numeric values from its ring buffer."""
+
+        args = WINDOW_ARGS.parse_args()
+        self.logger.info("GET window from %s (%d)", sid, args["count"])
+        if args["count"] <= 0 or args["count"] > MAX_HISTORY_LIMIT:
+            raise STException(f"count must be in [1, {MAX_HISTORY_LIMIT}]", 400)
+
+        svc = SensorService(settings.conf)
+        values = svc.get_window(sid, args["count"])
+        if values is None:
+            raise STException("No ring buffer for sensor", 404)
+
+        return {
+            "sensorId": sid,
+            "values": values
+        }
+
+
+@NS.route(F'{settings.RESTX_BASE_URL_CURRENT}/sensors/<sid>/rollup')
+class OneSensorRollup(Resource):
+    """Single sensor aggregated values endpoint class."""
+
+    logger = None
+
+    # pylint: disable=keyword-arg-before-vararg
+    def __init__(self, api=None, *args, **kwargs):
+        Resource.__init__(self, api, kwargs)
+        self.logger = logging.getLogger(__name__)
+
+    @API.marshal_with(SENSOR_ROLLUP)
+    @NS.expect(ROLLUP_ARGS)
+    @NS.response(400, "Invalid range or resolution")
+    @NS.response(404, "Rollups are not enabled")
+    def get(self, sid):
+        """Return sensor min/max/avg/count buckets in a time range."""
+
+        args = ROLLUP_ARGS.parse_args()
+        self.logger.info(
+            "GET rollup %s from %s (%s - %s)",
+            args["resolution"], sid, args["from_ts"], args["to_ts"]
+        )
+        if args["from_ts"] is not None and args["to_ts"] is not None \
+            and args["from_ts"] > args["to_ts"]:
+            raise STException("from must be before to", 400)
+
+        svc = SensorService(settings.conf)
+        buckets = svc.get_rollup(sid, args["resolution"], args["from_ts"], args["to_ts"])
+        if buckets is None:
+            raise STException("Rollups are not enabled", 404)
+
+        return {
+            "sensorId": sid,
+            "resolution": args["resolution"],
+            "buckets": buckets
+        }
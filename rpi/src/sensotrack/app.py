@@ -14,13 +14,18 @@
 import argparse
 import json
 import logging
+import os
 
 import flask_restx.apidoc
 import flask
 from flask import Blueprint, Flask, request
 from werkzeug.exceptions import NotAcceptable, HTTPException, UnsupportedMediaType
 
-from sensotrack.services.bus import Receiver
+from sensotrack.dao.shm import create_shared_table, shared_table_enabled
+from sensotrack.services.aiobus import AsyncIngestedReceiver, AsyncReceiver, asyncio_client
+from sensotrack.services.bus import IngestedReceiver, Receiver
+from sensotrack.services.catalog import SensorCatalog
+from sensotrack.services.rollups import RollupService
 from sensotrack.services.sensors import SensorService
 from sensotrack import settings, __version__
 from sensotrack.services.connectors import ConnectorsManager
@@ -110,44 +115,54 @@ def handle_exception(exc):
     response.content_type = "application/json"
     return response
 
+CORS_HEADERS = [
+    ('Access-Control-Allow-Origin', '*'),
+    ('Access-Control-Allow-Headers', 'Content-Type,Authorization'),
+    ('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE'),
+    ("X-Clacks-Overhead", "GNU Terry Pratchett")
+]
+
+
+def check_content_negotiation(accept, content_type):
+    """Check a REST request content negociation headers.
+
+    :param accept: Accept header (None if missing)
+    :type accept: str
+    :param content_type: Content-Type header (None if missing)
+    :type content_type: str
+    :raises NotAcceptable: if response can't match Accept
+    :raises UnsupportedMediaType: if request body is not JSON
+    """
+    if accept is not None \
+        and not (
+            "json" in accept \
+            or "*/*" in accept \
+            or "text/event-stream" in accept
+        ):
+        raise NotAcceptable(
+            "The Accept incoming header does not match any available content-type."
+        )
+    if content_type is not None and "json" not in content_type:
+        raise  UnsupportedMediaType(
+            "The format of the posted body is not supported by the endpoint."
+        )
+
 @APP.before_request
 def before_request():
     """Execute actions before each HTTP requests."""
     # Content negociation control
     if _is_restx_resource(request.full_path):
-        if "Accept" in request.headers \
-            and not (
-                "json" in request.headers["Accept"] \
-                or "*/*" in request.headers["Accept"]
-            ):
-            raise NotAcceptable(
-                "The Accept incoming header does not match any available content-type."
-            )
-        if "Content-Type" in request.headers and "json" not in request.headers["Content-Type"]:
-            raise  UnsupportedMediaType(
-                "The format of the posted body is not supported by the endpoint."
-            )
+        check_content_negotiation(
+            request.headers.get("Accept"),
+            request.headers.get("Content-Type")
+        )
 
 @APP.after_request
 def after_request(response: flask.Response):
     """Add CORS Headers and log execution."""
 
-    response.headers.add(
-        'Access-Control-Allow-Origin',
-        '*'
-    )
-    response.headers.add(
-        'Access-Control-Allow-Headers',
-        'Content-Type,Authorization'
-    )
-    response.headers.add(
-        'Access-Control-Allow-Methods',
-        'GET,PUT,POST,DELETE'
-    )
-    response.headers.add(
-        "X-Clacks-Overhead",
-        "GNU Terry Pratchett"
-    )
+    for name, value in CORS_HEADERS:
+        response.headers.add(name, value)
     return response
 
 
@@ -161,6 +176,12 @@ def main():
         default=False,
         help="display version and exit"
     )
+    parser.add_argument(
+        '-role',
+        action="append",
+        choices=[settings.ROLE_INGEST, settings.ROLE_API],
+        help="process role (repeat for several roles, default from configuration)"
+    )
     args = parser.parse_args()
 
     if args.version:
@@ -168,7 +189,12 @@ def main():
         return
 
 
-    load_config()
+    load_config(args.role)
+    if settings.ROLE_API not in settings.conf["roles"]:
+        # pylint: disable=import-outside-toplevel
+        from sensotrack.ingest import wait_for_termination
+        wait_for_termination()
+        return
     server_binding = settings.RESTX["binding"].split(':')
     APP.run(
         debug=settings.FLASK_DEBUG,
@@ -178,13 +204,47 @@ def main():
     )
 
 
-def load_config():
-    """Load application config and init."""
+def _resolve_roles(roles):
+    if roles:
+        return list(roles)
+    if os.environ.get(settings.ROLES_ENV):
+        return [role.strip() for role in os.environ[settings.ROLES_ENV].split(",") if role.strip()]
+    return list(settings.conf.get("roles", settings.roles))
+
+
+def load_config(roles=None):
+    """Load application config and init.
+
+    Only components of process roles are started: ``ingest`` (bus
+    reception, connectors, background maintenance) and/or ``api`` (REST
+    API). Roles are taken from ``roles``, else ``SENSOTRACK_ROLES``
+    environment variable (comma separated), else ``roles`` configuration.
+
+    :param roles: process roles
+    :type roles: list[str]
+    """
 
 
     settings.conf = load_conf(settings.CONFIG_FILES["app"])
+    settings.conf["roles"] = _resolve_roles(roles)
     if 'dataCleaning' not in settings.conf:
         settings.conf["dataCleaning"] = settings.data_cleaning
+    if 'notifications' not in settings.conf:
+        settings.conf["notifications"] = settings.notifications
+    if 'stream' not in settings.conf:
+        settings.conf["stream"] = settings.stream
+    if 'http' not in settings.conf:
+        settings.conf["http"] = settings.http
+    if 'dao' not in settings.conf:
+        settings.conf["dao"] = settings.dao
+    if 'history' not in settings.conf:
+        settings.conf["history"] = settings.history
+    if 'ring' not in settings.conf:
+        settings.conf["ring"] = settings.ring
+    if 'rollups' not in settings.conf:
+        settings.conf["rollups"] = settings.rollups
+    if 'catalog' not in settings.conf:
+        settings.conf["catalog"] = settings.catalog
 
     LoggingConfig.configure_logging(
         settings.conf,
@@ -195,16 +255,39 @@ def load_config():
     logger = logging.getLogger(__name__)
     logger.debug("APP Is configured")
 
-    bus_receiver = Receiver(settings.conf)
-    bus_receiver.start()
+    logger.info("Starting roles %s", settings.conf["roles"])
+    ingest = settings.ROLE_INGEST in settings.conf["roles"]
+    api = settings.ROLE_API in settings.conf["roles"]
+
+    if ingest:
+        if shared_table_enabled(settings.conf):
+            # Ingest is the writer of API workers last values
+            create_shared_table(settings.conf)
+
+        SensorCatalog(settings.conf).start_snapshots()
+
+        # Other processes API workers are fed through the bus
+        receiver_class = AsyncReceiver if asyncio_client(settings.conf) else Receiver
+        bus_receiver = receiver_class(settings.conf, announce=not api)
+        bus_receiver.start()
+
+        connector_manager = ConnectorsManager(settings.conf)
+        connector_manager.start_connectors()
 
-    connector_manager = ConnectorsManager(settings.conf)
-    connector_manager.start_connectors()
+        sensor_svc = SensorService(settings.conf)
+        sensor_svc.start_data_cleaner()
+        sensor_svc.start_compactor()
 
-    sensor_svc = SensorService(settings.conf)
-    sensor_svc.start_data_cleaner()
+        if RollupService.enabled(settings.conf):
+            RollupService(settings.conf).start_flusher()
 
-    initialize_app(APP)
+    if api:
+        if not ingest:
+            if asyncio_client(settings.conf):
+                AsyncIngestedReceiver(settings.conf).start()
+            else:
+                IngestedReceiver(settings.conf).start()
+        initialize_app(APP)
 
 
 
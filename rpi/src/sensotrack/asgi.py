@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""asgi.py: ASGI serving mode of the REST API.
+
+Requests waiting for the bus (new value long polling and values stream)
+are served by coroutines, so that a waiting client costs a future instead
+of a thread. All other requests are forwarded to the Flask application run
+in the event loop default executor.
+
+Serve with an ASGI server, for instance::
+
+    uvicorn sensotrack.asgi:APP
+"""
+import asyncio
+import io
+import json
+import logging
+import re
+import sys
+from urllib.parse import parse_qs
+
+from werkzeug.exceptions import HTTPException
+
+from sensotrack import settings
+from sensotrack.app import APP as FLASK_APP, CORS_HEADERS, check_content_negotiation, load_config
+from sensotrack.dao import render_sensor
+from sensotrack.services.sensors import SensorService
+from sensotrack.services.stream import StreamHub
+from sensotrack.utils.exceptions import STException
+
+_END = object()
+
+
+def _error_body(code, message, description):
+    return json.dumps({
+        "message": message,
+        "description": description,
+        "code": code
+    }).encode("utf-8")
+
+
+class AsgiApp:
+    """ASGI application.
+
+    :param flask_app: Flask application serving non native routes
+    :type flask_app: Flask
+    :param startup: called at lifespan startup (None for nothing)
+    :type startup: callable
+    """
+
+    def __init__(self, flask_app, startup=None) -> None:
+        self._flask_app = flask_app
+        self._startup = startup
+        self._logger = logging.getLogger(__name__)
+        base = settings.RESTX["base_url"].rstrip("/") + settings.RESTX_BASE_URL_CURRENT
+        self._routes = [
+            ("POST", re.compile(f"^{base}/sensors/(?P<sid>[^/]+)/last$"), self._post_last),
+            ("GET", re.compile(f"^{base}/sensors/stream$"), self._get_stream),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            for method, path, handler in self._routes:
+                match = path.match(scope["path"])
+                if match and scope["method"] == method:
+                    await self._native(handler, match.groupdict(), scope, receive, send)
+                    return
+            await self._wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    if self._startup is not None:
+                        self._startup()
+                except Exception as exc:  # pylint: disable=broad-except
+                    self._logger.exception("Startup failed")
+                    await send({"type": "lifespan.startup.failed", "message": str(exc)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    @staticmethod
+    async def _start(send, status, headers):
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (name.lower().encode("latin-1"), value.encode("latin-1"))
+                for name, value in headers + CORS_HEADERS
+            ]
+        })
+
+    async def _respond(self, send, status, body):
+        await self._start(send, status, [("Content-Type", "application/json")])
+        await send({"type": "http.response.body", "body": body})
+
+    async def _native(self, handler, params, scope, receive, send):
+        headers = {}
+        for name, value in scope["headers"]:
+            headers[name.decode("latin-1").lower()] = value.decode("latin-1")
+        try:
+            check_content_negotiation(headers.get("accept"), headers.get("content-type"))
+            await handler(params, scope, headers, receive, send)
+        except HTTPException as exc:
+            await self._respond(send, exc.code, _error_body(exc.code, exc.name, exc.description))
+        except STException as exc:
+            self._logger.exception(str(exc))
+            await self._respond(
+                send, exc.http_status, _error_body(exc.http_status, str(exc), str(exc))
+            )
+
+    async def _post_last(self, params, _scope, _headers, _receive, send):
+        sid = params["sid"]
+        self._logger.info("GET last value from %s", sid)
+        res = await SensorService(settings.conf).get_new_value_async(sid)
+        if not res:
+            raise STException("Sensor value not found", 404)
+        await self._respond(send, 200, render_sensor(res))
+
+    async def _get_stream(self, _params, scope, headers, receive, send):
+        query = parse_qs(scope["query_string"].decode("latin-1"))
+        ids = {sid for sid in query.get("ids", [""])[-1].split(",") if sid} or None
+        prefix = query.get("prefix", [None])[-1]
+        last_event_id = headers.get("last-event-id")
+        if last_event_id is not None:
+            try:
+                last_event_id = int(last_event_id)
+            except ValueError as exc:
+                raise STException("Invalid Last-Event-ID", 400) from exc
+        self._logger.info("GET sensors stream (ids=%s, prefix=%s)", ids, prefix)
+        hub = StreamHub(settings.conf)
+        sub = hub.subscribe(ids, prefix, last_event_id, asynchronous=True)
+
+        async def stream():
+            await self._start(send, 200, [
+                ("Content-Type", "text/event-stream"),
+                ("Cache-Control", "no-cache"),
+                ("X-Accel-Buffering", "no")
+            ])
+            async for chunk in hub.events_async(sub):
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+
+        async def disconnected():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+
+        # Stop streaming as soon as the client leaves
+        tasks = [asyncio.ensure_future(stream()), asyncio.ensure_future(disconnected())]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            hub.unsubscribe(sub)
+
+    async def _wsgi(self, scope, receive, send):
+        body = io.BytesIO()
+        more_body = True
+        while more_body:
+            message = await receive()
+            body.write(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        body.seek(0)
+
+        environ = self._environ(scope, body)
+        response = {}
+
+        def start_response(status, headers, exc_info=None):  # pylint: disable=unused-argument
+            response["status"] = int(status.split(" ", 1)[0])
+            response["headers"] = headers
+
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(None, self._flask_app, environ, start_response)
+        chunks = iter(result)
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": response["status"],
+                "headers": [
+                    (name.lower().encode("latin-1"), value.encode("latin-1"))
+                    for name, value in response["headers"]
+                ]
+            })
+            # Chunks are pulled from executor too, Flask may produce them lazily
+            while True:
+                chunk = await loop.run_in_executor(None, next, chunks, _END)
+                if chunk is _END:
+                    break
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            if hasattr(result, "close"):
+                await loop.run_in_executor(None, result.close)
+
+    @staticmethod
+    def _environ(scope, body):
+        server = scope.get("server") or ("localhost", 80)
+        client = scope.get("client") or ("", 0)
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+            "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+            "QUERY_STRING": scope["query_string"].decode("latin-1"),
+            "SERVER_NAME": server[0],
+            "SERVER_PORT": str(server[1]),
+            "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+            "REMOTE_ADDR": client[0],
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": body,
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": True,
+            "wsgi.run_once": False,
+        }
+        for name, value in scope["headers"]:
+            name = name.decode("latin-1").upper().replace("-", "_")
+            value = value.decode("latin-1")
+            if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+                name = "HTTP_" + name
+            if name in environ:
+                value = environ[name] + "," + value
+            environ[name] = value
+        return environ
+
+
+APP = AsgiApp(FLASK_APP, startup=load_config)
@@ -1,14 +1,39 @@
 """Data access layer"""
 
+import datetime
+import importlib
 import logging
 import json
 import os
+import threading
+
+from sensotrack import settings
+from sensotrack.dao.cache import get_cache
+from sensotrack.dao.shm import get_shared_table
+from sensotrack.dao.writer import GroupCommitWriter
+
+
+class JSONFileStorage:
+    """Last values storage using one JSON file per sensor.
+
+    If ``dao.writer.enabled`` is set, writes are delegated to a group commit
+    writer thread.
+
+    Only regular ``<sid>.json`` files of ``datadir`` are sensors, other
+    components keep their files in sub directories.
+    """
+
+    # Files of previous versions which are not sensors
+    NON_SENSOR_FILES = frozenset(("catalog.json",))
 
-class SensorDAO:
-    """DAO for sensors."""
     def __init__(self, conf) -> None:
         self._conf = conf
         self._logger = logging.getLogger(__name__)
+        self._writer = None
+        if conf.get("dao", settings.dao).get(
+            "writer", settings.dao["writer"]
+        ).get("enabled", False):
+            self._writer = GroupCommitWriter(conf)
 
     def get(self, sid):
         """Get a sensor by id
@@ -19,6 +44,11 @@ class SensorDAO:
         :rtype: dict
         """
 
+        if self._writer:
+            res = self._writer.pending(sid)
+            if res is not None:
+                return res
+
         res = None
         data_file_name = f'{self._conf["datadir"]}/{sid}.json'
         if os.path.exists(data_file_name):
@@ -27,6 +57,58 @@ class SensorDAO:
 
         return res
 
+    def get_many(self, sids):
+        """Get sensors by ids
+
+        :param sids: sensors ids
+        :type sids: list[str]
+        :return: found sensors data by id
+        :rtype: dict
+        """
+        res = {}
+        for sid in sids:
+            sensor = self.get(sid)
+            if sensor is not None:
+                res[sid] = sensor
+        return res
+
+    def get_dates(self, sids):
+        """Get sensors measurement dates.
+
+        :param sids: sensors ids
+        :type sids: list[str]
+        :return: found sensors ISO measurement date by id
+        :rtype: dict
+        """
+        # Files hold the whole record
+        return {
+            sid: sensor["measurementDate"] for sid, sensor in self.get_many(sids).items()
+        }
+
+    def _sensor_files(self):
+        """Iterate over sensors files of datadir.
+
+        :rtype: iterator[os.DirEntry]
+        """
+        with os.scandir(self._conf["datadir"]) as entries:
+            for entry in entries:
+                if (
+                    entry.name.endswith(".json")
+                    and entry.name not in self.NON_SENSOR_FILES
+                    and entry.is_file()
+                ):
+                    yield entry
+
+    def list_ids(self):
+        """List stored sensors ids.
+
+        :rtype: list[str]
+        """
+        res = {entry.name[:-len(".json")] for entry in self._sensor_files()}
+        if self._writer:
+            res.update(self._writer.pending_ids())
+        return sorted(res)
+
     def upsert(self, sensor):
         """Persist sensor
 
@@ -34,16 +116,291 @@ class SensorDAO:
         :type sensor: dict
         """
 
+        if self._writer:
+            self._writer.submit(sensor)
+            return
+
         data_file_name = f'{self._conf["datadir"]}/{sensor["sensorId"]}.json'
         with open(data_file_name, "w", encoding="utf-8") as data_file:
             data_file.write(f'{json.dumps(sensor)}')
 
+    def upsert_many(self, sensors):
+        """Persist sensors
+
+        Only the last value of each sensor is written.
+
+        :param sensors: sensors to persist
+        :type sensors: list[dict]
+        """
+        for sensor in {sensor["sensorId"]: sensor for sensor in sensors}.values():
+            self.upsert(sensor)
+
     def delete(self, sid):
         """Delet sensor data
 
         :param sid: sensor identifier
         :type sid: str
         """
+        if self._writer:
+            self._writer.forget(sid)
         data_file_name = f'{self._conf["datadir"]}/{sid}.json'
         if os.path.exists(data_file_name):
             os.remove(data_file_name)
+
+    def flush(self):
+        """Wait until queued writes are done."""
+        if self._writer:
+            self._writer.flush()
+
+    def close(self):
+        """Write queued values and stop writer."""
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+
+
+def render_sensor(sensor):
+    """Render a sensor value as served by the API.
+
+    Output is the same as ``SensorValue`` model marshalling.
+
+    :param sensor: sensor data
+    :type sensor: dict
+    :return: JSON document
+    :rtype: bytes
+    """
+    return (json.dumps({
+        key: None if sensor.get(key) is None else str(sensor[key])
+        for key in ("sensorId", "value", "measurementDate")
+    }) + "\n").encode("utf-8")
+
+
+class SensorDAO:
+    """DAO for sensors.
+
+    Values are persisted by the storage backend selected with
+    ``dao.backend`` (``json`` or ``sqlite``). Reads go through a process
+    wide last value cache, storage is only read on cache misses.
+
+    With ``dao.shm.enabled`` the ingest process also writes last values to
+    a shared memory table (see sensotrack.dao.shm) that is read first by
+    all processes.
+    """
+
+    BACKENDS = {
+        "json": "sensotrack.dao.JSONFileStorage",
+        "sqlite": "sensotrack.dao.sqlite.SQLiteStorage",
+    }
+
+    # Storages are shared by all DAO of the process
+    _storages = {}
+    _storages_lock = threading.Lock()
+
+    def __init__(self, conf) -> None:
+        self._conf = conf
+        self._logger = logging.getLogger(__name__)
+        self._cache = get_cache(conf)
+        self._storage = self._get_storage(conf)
+
+    @classmethod
+    def _get_storage(cls, conf):
+        backend = conf.get("dao", settings.dao).get("backend", "json")
+        if backend not in cls.BACKENDS:
+            raise ValueError(f"Unsupported DAO backend {backend}")
+
+        key = (backend, conf.get("datadir"))
+        with cls._storages_lock:
+            if key not in cls._storages:
+                mod_name, class_name = cls.BACKENDS[backend].rsplit(".", 1)
+                klass = getattr(importlib.import_module(mod_name), class_name)
+                cls._storages[key] = klass(conf)
+            return cls._storages[key]
+
+    @classmethod
+    def close_storages(cls):
+        """Close shared storages (flush pending writes)."""
+        with cls._storages_lock:
+            for storage in cls._storages.values():
+                storage.close()
+            cls._storages.clear()
+
+    @property
+    def storage(self):
+        """Storage backend."""
+        return self._storage
+
+    def get(self, sid):
+        """Get a sensor by id
+
+        :param sid: sensor id
+        :type sid: str
+        :return: sensor data if found None else.
+        :rtype: dict
+        """
+
+        table = get_shared_table(self._conf)
+        if table is not None:
+            shared = table.get(sid)
+            if shared is not None:
+                return shared[0]
+
+        res = self._cache.get(sid)
+        if res is not None:
+            return res
+
+        res = self._storage.get(sid)
+        if res is not None:
+            self._cache.put(sid, res)
+
+        return res
+
+    def get_rendered(self, sid):
+        """Get a sensor value JSON rendering (see render_sensor()).
+
+        Rendering is done once per value and kept in cache.
+
+        :param sid: sensor id
+        :type sid: str
+        :return: JSON document if found None else.
+        :rtype: bytes
+        """
+        table = get_shared_table(self._conf)
+        if table is not None:
+            shared = table.lookup(sid)
+            if shared is not None:
+                return shared[1]
+
+        res = self._cache.get_rendered(sid)
+        if res is not None:
+            return res
+
+        sensor = self.get(sid)
+        if sensor is None:
+            return None
+        res = render_sensor(sensor)
+        self._cache.put(sid, sensor, res)
+        return res
+
+    def get_many(self, sids):
+        """Get sensors by ids with a single storage lookup for cache misses.
+
+        :param sids: sensors ids
+        :type sids: list[str]
+        :return: found sensors data by id
+        :rtype: dict
+        """
+        res = {}
+        missing = []
+        table = get_shared_table(self._conf)
+        for sid in sids:
+            shared = table.get(sid) if table is not None else None
+            sensor = shared[0] if shared is not None else self._cache.get(sid)
+            if sensor is None:
+                missing.append(sid)
+            else:
+                res[sid] = sensor
+        if missing:
+            found = self._storage.get_many(missing)
+            for sid, sensor in found.items():
+                self._cache.put(sid, sensor)
+            res.update(found)
+        return res
+
+    def get_dates(self, sids):
+        """Get sensors measurement dates without reading cached records.
+
+        :param sids: sensors ids
+        :type sids: list[str]
+        :return: found sensors ISO measurement date by id
+        :rtype: dict
+        """
+        res = {}
+        missing = []
+        table = get_shared_table(self._conf)
+        for sid in sids:
+            date = table.get_date(sid) if table is not None else None
+            if date is not None:
+                res[sid] = date
+                continue
+            sensor = self._cache.get(sid)
+            if sensor is None:
+                missing.append(sid)
+            else:
+                res[sid] = sensor["measurementDate"]
+        if missing:
+            res.update(self._storage.get_dates(missing))
+        return res
+
+    def list_ids(self):
+        """List stored sensors ids.
+
+        :rtype: list[str]
+        """
+        return self._storage.list_ids()
+
+    def upsert(self, sensor):
+        """Persist sensor
+
+        :param sensor: sensor to persist
+        :type sensor: dict
+        """
+
+        self._storage.upsert(sensor)
+        self._share_values([sensor])
+
+    def upsert_many(self, sensors):
+        """Persist sensors values in a single storage operation
+
+        :param sensors: sensors to persist (in measurement order)
+        :type sensors: list[dict]
+        """
+
+        self._storage.upsert_many(sensors)
+        self._share_values(sensors)
+
+    def _share_values(self, sensors):
+        table = get_shared_table(self._conf)
+        shared = table is not None and table.writable
+        if not (self._cache.enabled or shared):
+            return
+        for sensor in sensors:
+            # Render once at ingest for API reads
+            rendered = render_sensor(sensor)
+            self._cache.put(sensor["sensorId"], sensor, rendered)
+            if shared:
+                table.put(
+                    sensor["sensorId"],
+                    datetime.datetime.fromisoformat(sensor["measurementDate"]).timestamp(),
+                    rendered
+                )
+
+    def refresh_cache(self, sensor):
+        """Cache a sensor value stored by another process.
+
+        Older values than the cached one are ignored (values may be
+        delivered out of order).
+
+        :param sensor: stored sensor
+        :type sensor: dict
+        """
+        if not self._cache.enabled:
+            return
+        cached = self._cache.get(sensor["sensorId"])
+        # Same format ISO dates compare as strings
+        if cached is None or cached["measurementDate"] <= sensor["measurementDate"]:
+            self._cache.put(sensor["sensorId"], sensor, render_sensor(sensor))
+
+    def delete(self, sid):
+        """Delet sensor data
+
+        :param sid: sensor identifier
+        :type sid: str
+        """
+        self._cache.invalidate(sid)
+        self._remove_shared(sid)
+        self._storage.delete(sid)
+
+    def _remove_shared(self, sid):
+        table = get_shared_table(self._conf)
+        if table is not None and table.writable:
+            table.remove(sid)
@@ -0,0 +1,366 @@
+"""Compressed columnar archive of sensors history.
+
+An archive file holds a sequence of blocks, each one starting with a fixed
+size header (time range, value range, count, payload size) followed by two
+bit packed columns:
+
+* timestamps (in µs) encoded as delta-of-delta,
+* values XOR encoded against the previous value (Gorilla style) when
+  values are all floats or all integers (exact as float64), zlib
+  compressed JSON lines otherwise.
+
+Readers only decode blocks overlapping the requested time range and
+value predicate.
+"""
+
+import json
+import math
+import struct
+import zlib
+
+MAGIC = b"STBK"
+VERSION = 1
+
+KIND_FLOAT = 1       # JSON floats
+KIND_FLOAT_TEXT = 2  # Strings holding a float (repr round trip)
+KIND_RAW = 3         # Anything else
+KIND_INT = 4         # JSON integers
+
+# Integers exactly represented by a float64
+_MAX_EXACT_INT = 1 << 53
+
+BLOCK_HEADER = struct.Struct("<4sBBIqqddI")
+F64 = struct.Struct("<d")
+U32 = struct.Struct("<I")
+U64 = struct.Struct("<Q")
+
+# (prefix, prefix bit count, value bit count) for timestamps delta-of-delta
+_DOD_BUCKETS = (
+    (0b10, 2, 7),
+    (0b110, 3, 9),
+    (0b1110, 4, 12),
+    (0b11110, 5, 20),
+)
+_DOD_LARGE_PREFIX = (0b11111, 5)
+
+
+class BitWriter:
+    """Append bits to a byte buffer."""
+
+    def __init__(self) -> None:
+        self._buffer = bytearray()
+        self._acc = 0
+        self._count = 0
+
+    def write(self, value, nbits):
+        """Append the nbits lower bits of value."""
+        self._acc = (self._acc << nbits) | (value & ((1 << nbits) - 1))
+        self._count += nbits
+        while self._count >= 8:
+            self._count -= 8
+            self._buffer.append((self._acc >> self._count) & 0xFF)
+        self._acc &= (1 << self._count) - 1
+
+    def getvalue(self):
+        """Get bytes (last byte is zero padded)."""
+        if self._count:
+            return bytes(self._buffer) + bytes([(self._acc << (8 - self._count)) & 0xFF])
+        return bytes(self._buffer)
+
+
+class BitReader:
+    """Read bits from a byte buffer."""
+
+    def __init__(self, data) -> None:
+        self._data = data
+        self._pos = 0
+
+    def read(self, nbits):
+        """Read nbits as unsigned integer."""
+        start = self._pos >> 3
+        end = (self._pos + nbits + 7) >> 3
+        chunk = int.from_bytes(self._data[start:end], "big")
+        shift = (end << 3) - self._pos - nbits
+        self._pos += nbits
+        return (chunk >> shift) & ((1 << nbits) - 1)
+
+
+def _signed(value, nbits):
+    if value >= 1 << (nbits - 1):
+        value -= 1 << nbits
+    return value
+
+
+def _encode_timestamps(bits, timestamps):
+    prev = timestamps[0]
+    bits.write(prev, 64)
+    prev_delta = 0
+    for ts in timestamps[1:]:
+        delta = ts - prev
+        dod = delta - prev_delta
+        if dod == 0:
+            bits.write(0, 1)
+        else:
+            for prefix, prefix_bits, value_bits in _DOD_BUCKETS:
+                if -(1 << (value_bits - 1)) <= dod < 1 << (value_bits - 1):
+                    bits.write(prefix, prefix_bits)
+                    bits.write(dod, value_bits)
+                    break
+            else:
+                bits.write(*_DOD_LARGE_PREFIX)
+                bits.write(dod, 64)
+        prev_delta = delta
+        prev = ts
+
+
+def _decode_timestamps(bits, count):
+    prev = _signed(bits.read(64), 64)
+    res = [prev]
+    prev_delta = 0
+    for _ in range(count - 1):
+        prefix_bits = 0
+        while prefix_bits < 5 and bits.read(1):
+            prefix_bits += 1
+        if prefix_bits == 0:
+            dod = 0
+        elif prefix_bits < 5:
+            value_bits = _DOD_BUCKETS[prefix_bits - 1][2]
+            dod = _signed(bits.read(value_bits), value_bits)
+        else:
+            dod = _signed(bits.read(64), 64)
+        prev_delta += dod
+        prev += prev_delta
+        res.append(prev)
+    return res
+
+
+def _encode_floats(bits, values):
+    prev = U64.unpack(F64.pack(values[0]))[0]
+    bits.write(prev, 64)
+    prev_leading, prev_trailing = 65, 0
+    for value in values[1:]:
+        cur = U64.unpack(F64.pack(value))[0]
+        xor = cur ^ prev
+        if xor == 0:
+            bits.write(0, 1)
+        else:
+            leading = min(64 - xor.bit_length(), 31)
+            trailing = (xor & -xor).bit_length() - 1
+            if leading >= prev_leading and trailing >= prev_trailing:
+                bits.write(0b10, 2)
+                bits.write(xor >> prev_trailing, 64 - prev_leading - prev_trailing)
+            else:
+                meaningful = 64 - leading - trailing
+                bits.write(0b11, 2)
+                bits.write(leading, 5)
+                bits.write(meaningful - 1, 6)
+                bits.write(xor >> trailing, meaningful)
+                prev_leading, prev_trailing = leading, trailing
+        prev = cur
+
+
+def _decode_floats(bits, count):
+    prev = bits.read(64)
+    res = [F64.unpack(U64.pack(prev))[0]]
+    prev_leading, prev_trailing = 0, 0
+    for _ in range(count - 1):
+        if bits.read(1):
+            if bits.read(1):
+                prev_leading = bits.read(5)
+                meaningful = bits.read(6) + 1
+                prev_trailing = 64 - prev_leading - meaningful
+            prev ^= bits.read(64 - prev_leading - prev_trailing) << prev_trailing
+        res.append(F64.unpack(U64.pack(prev))[0])
+    return res
+
+
+def _as_number(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(number) else number
+
+
+def _values_kind(values):
+    if all(isinstance(value, float) for value in values):
+        return KIND_FLOAT
+    if all(
+        isinstance(value, int) and not isinstance(value, bool)
+        and -_MAX_EXACT_INT <= value <= _MAX_EXACT_INT
+        for value in values
+    ):
+        return KIND_INT
+    try:
+        if all(isinstance(value, str) and repr(float(value)) == value for value in values):
+            return KIND_FLOAT_TEXT
+    except ValueError:
+        pass
+    return KIND_RAW
+
+
+def encode_block(readings):
+    """Encode readings to a block.
+
+    :param readings: (timestamp, value) sorted by timestamp
+    :type readings: list[tuple]
+    :return: encoded block (header and payload)
+    :rtype: bytes
+    """
+    timestamps = [round(ts * 1e6) for ts, _ in readings]
+    values = [value for _, value in readings]
+    kind = _values_kind(values)
+
+    bits = BitWriter()
+    _encode_timestamps(bits, timestamps)
+    if kind == KIND_RAW:
+        # Raw values follow the byte aligned timestamps column
+        ts_column = bits.getvalue()
+        payload = U32.pack(len(ts_column)) + ts_column + zlib.compress(
+            "\n".join(json.dumps(value) for value in values).encode("utf-8")
+        )
+        numbers = [
+            number for number in (_as_number(value) for value in values)
+            if number is not None
+        ]
+        min_value = min(numbers) if numbers else math.nan
+        max_value = max(numbers) if numbers else math.nan
+    else:
+        floats = [float(value) for value in values]
+        _encode_floats(bits, floats)
+        payload = bits.getvalue()
+        min_value, max_value = min(floats), max(floats)
+
+    return BLOCK_HEADER.pack(
+        MAGIC, VERSION, kind, len(readings),
+        timestamps[0], timestamps[-1], min_value, max_value, len(payload)
+    ) + payload
+
+
+def _decode_payload(kind, count, payload):
+    if kind == KIND_RAW:
+        ts_len = U32.unpack_from(payload)[0]
+        bits = BitReader(payload[U32.size:U32.size + ts_len])
+        values = [
+            json.loads(line)
+            for line in zlib.decompress(
+                payload[U32.size + ts_len:]
+            ).decode("utf-8").split("\n")
+        ]
+        timestamps = _decode_timestamps(bits, count)
+    else:
+        bits = BitReader(payload)
+        timestamps = _decode_timestamps(bits, count)
+        values = _decode_floats(bits, count)
+        if kind == KIND_FLOAT_TEXT:
+            values = [repr(value) for value in values]
+        elif kind == KIND_INT:
+            values = [int(value) for value in values]
+    return [(ts / 1e6, value) for ts, value in zip(timestamps, values)]
+
+
+class BlockHeader:  # pylint: disable=too-few-public-methods
+    """Decoded block header."""
+
+    def __init__(self, data) -> None:
+        (
+            magic, version, self.kind, self.count,
+            min_ts, max_ts, self.min_value, self.max_value, self.size
+        ) = BLOCK_HEADER.unpack(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a supported archive block")
+        self.min_ts = min_ts / 1e6
+        self.max_ts = max_ts / 1e6
+
+    def may_match(self, from_ts, to_ts, min_value=None, max_value=None):
+        """Tell if block may hold readings matching range and predicate."""
+        if self.max_ts < from_ts or self.min_ts > to_ts:
+            return False
+        if min_value is None and max_value is None:
+            return True
+        if math.isnan(self.min_value):
+            # No numeric values
+            return False
+        if min_value is not None and self.max_value < min_value:
+            return False
+        if max_value is not None and self.min_value > max_value:
+            return False
+        return True
+
+
+def write_archive(file_name, readings, block_size=1024):
+    """Write an archive file.
+
+    :param file_name: archive file name
+    :type file_name: str
+    :param readings: (timestamp, value) sorted by timestamp
+    :type readings: list[tuple]
+    :param block_size: readings per block
+    :type block_size: int
+    """
+    with open(file_name, "wb") as archive_file:
+        for pos in range(0, len(readings), block_size):
+            archive_file.write(encode_block(readings[pos:pos + block_size]))
+
+
+def value_matches(value, min_value=None, max_value=None):
+    """Tell if a reading value matches a value predicate.
+
+    :param value: reading value
+    :param min_value: lower bound (included), None for no bound
+    :type min_value: float
+    :param max_value: upper bound (included), None for no bound
+    :type max_value: float
+    :rtype: bool
+    """
+    if min_value is None and max_value is None:
+        return True
+    value = _as_number(value)
+    if value is None:
+        return False
+    if min_value is not None and value < min_value:
+        return False
+    if max_value is not None and value > max_value:
+        return False
+    return True
+
+
+def read_archive(file_name, from_ts, to_ts, limit, min_value=None, max_value=None):
+    """Read readings from an archive file.
+
+    Blocks outside the time range or the value predicate are skipped
+    without being decoded.
+
+    :param file_name: archive file name
+    :type file_name: str
+    :param from_ts: range start epoch timestamp (included)
+    :type from_ts: float
+    :param to_ts: range end epoch timestamp (included)
+    :type to_ts: float
+    :param limit: max number of readings
+    :type limit: int
+    :param min_value: value lower bound (included), None for no bound
+    :type min_value: float
+    :param max_value: value upper bound (included), None for no bound
+    :type max_value: float
+    :return: list of (timestamp, value) sorted by timestamp
+    :rtype: list[tuple]
+    """
+    res = []
+    with open(file_name, "rb") as archive_file:
+        while len(res) < limit:
+            data = archive_file.read(BLOCK_HEADER.size)
+            if len(data) < BLOCK_HEADER.size:
+                break
+            header = BlockHeader(data)
+            if header.min_ts > to_ts:
+                break
+            if not header.may_match(from_ts, to_ts, min_value, max_value):
+                archive_file.seek(header.size, 1)
+                continue
+            for ts, value in _decode_payload(
+                    header.kind, header.count, archive_file.read(header.size)
+                ):
+                if from_ts <= ts <= to_ts and value_matches(value, min_value, max_value):
+                    res.append((ts, value))
+    return res[:limit]
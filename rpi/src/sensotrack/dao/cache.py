@@ -0,0 +1,145 @@
+"""In memory last value cache."""
+
+from collections import OrderedDict
+import copy
+import threading
+import time
+
+from sensotrack import settings
+from sensotrack.utils.metrics import REGISTRY
+
+
+class LastValueCache:
+    """LRU cache of sensors last values with TTL eviction."""
+
+    def __init__(self, size=1024, ttl_s=60) -> None:
+        """Create a cache.
+
+        :param size: max number of sensors kept in cache (0 disable cache)
+        :type size: int
+        :param ttl_s: entries time to live in seconds (0 for no expiry)
+        :type ttl_s: float
+        """
+        self._size = size
+        self._ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._hits = REGISTRY.counter("dao.cache.hits")
+        self._misses = REGISTRY.counter("dao.cache.misses")
+        self._evictions = REGISTRY.counter("dao.cache.evictions")
+
+    @property
+    def enabled(self):
+        """True if cache may hold values."""
+        return self._size > 0
+
+    def _get_entry(self, sid):
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is not None:
+                if entry[1] and entry[1] < time.monotonic():
+                    del self._entries[sid]
+                    self._evictions.inc()
+                else:
+                    self._entries.move_to_end(sid)
+                    return entry
+        return None
+
+    def get(self, sid):
+        """Get a sensor value from cache.
+
+        :param sid: sensor id
+        :type sid: str
+        :return: copy of cached sensor data (a structured value is shared
+            with the cache and must not be modified) or None on miss
+        :rtype: dict
+        """
+        entry = self._get_entry(sid)
+        if entry is None:
+            self._misses.inc()
+            return None
+        self._hits.inc()
+        return copy.copy(entry[0])
+
+    def get_rendered(self, sid):
+        """Get a sensor value JSON rendering from cache.
+
+        :param sid: sensor id
+        :type sid: str
+        :return: cached rendering or None if value or its rendering is not
+            in cache
+        :rtype: bytes
+        """
+        entry = self._get_entry(sid)
+        if entry is None or entry[2] is None:
+            self._misses.inc()
+            return None
+        self._hits.inc()
+        return entry[2]
+
+    def put(self, sid, value, rendered=None):
+        """Store a sensor value.
+
+        :param sid: sensor id
+        :type sid: str
+        :param value: sensor data (copied)
+        :type value: dict
+        :param rendered: value JSON rendering
+        :type rendered: bytes
+        """
+        if not self.enabled:
+            return
+        expires_at = time.monotonic() + self._ttl_s if self._ttl_s else 0
+        with self._lock:
+            self._entries[sid] = (copy.copy(value), expires_at, rendered)
+            self._entries.move_to_end(sid)
+            while len(self._entries) > self._size:
+                self._entries.popitem(last=False)
+                self._evictions.inc()
+
+    def invalidate(self, sid):
+        """Remove a sensor from cache."""
+        with self._lock:
+            self._entries.pop(sid, None)
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_cache(conf):
+    """Return process wide last value cache, create it on first call.
+
+    :param conf: runtime configuration (uses ``dao.cache`` section)
+    :type conf: dict
+    :return: shared cache
+    :rtype: LastValueCache
+    """
+    global _CACHE  # pylint: disable=global-statement
+    if _CACHE is None:
+        with _CACHE_LOCK:
+            if _CACHE is None:
+                cache_conf = conf.get("dao", settings.dao).get(
+                    "cache",
+                    settings.dao["cache"]
+                )
+                _CACHE = LastValueCache(
+                    cache_conf.get("size", settings.dao["cache"]["size"]),
+                    cache_conf.get("ttl_s", settings.dao["cache"]["ttl_s"])
+                )
+    return _CACHE
+
+
+def reset_cache():
+    """Drop process wide cache (next get_cache() call creates a new one)."""
+    global _CACHE  # pylint: disable=global-statement
+    with _CACHE_LOCK:
+        _CACHE = None
@@ -0,0 +1,419 @@
+"""Append only per sensor history store.
+
+Each sensor gets a directory holding time partitioned segment files::
+
+    <dir>/<sid>/<segment start epoch>.log   one "<ts>\\t<json value>" line per reading
+    <dir>/<sid>/<segment start epoch>.idx   sparse "<ts>\\t<offset>" index
+
+A segment index gets a ``*`` line if a reading older than the previous one
+was appended to the segment, range reads then scan the whole segment
+instead of seeking.
+
+Sealed segments (whose time window is over) can be compacted to a
+``<segment start epoch>.blk`` archive (see ``sensotrack.dao.archive``),
+queries transparently read both formats.
+"""
+
+from collections import OrderedDict
+import bisect
+import datetime
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+
+from sensotrack import settings
+from sensotrack.dao.archive import read_archive, value_matches, write_archive
+
+UNSORTED_MARK = "*"
+
+
+def ts_to_iso(ts):
+    """Convert epoch timestamp to ISO date string (UTC).
+
+    :param ts: epoch timestamp
+    :type ts: float
+    :return: ISO formated date
+    :rtype: str
+    """
+    return datetime.datetime.fromtimestamp(
+        ts,
+        datetime.timezone.utc
+    ).isoformat()
+
+
+class _OpenSegment:
+    """Append state of a segment."""
+
+    def __init__(self, path, start):
+        self.start = start
+        self.data = open(f"{path}.log", "ab")  # pylint: disable=consider-using-with
+        self.index = open(f"{path}.idx", "a", encoding="utf-8")  # pylint: disable=consider-using-with
+        self.count = 0
+        self.last_ts = self._read_last_ts(f"{path}.log")
+
+    @staticmethod
+    def _read_last_ts(file_name):
+        size = os.path.getsize(file_name)
+        if not size:
+            return None
+        with open(file_name, "rb") as data_file:
+            data_file.seek(max(0, size - 512))
+            lines = data_file.read().splitlines()
+        for line in reversed(lines):
+            try:
+                return float(line.split(b"\t", 1)[0])
+            except ValueError:
+                continue
+        return None
+
+    def close(self):
+        """Close segment files."""
+        self.data.close()
+        self.index.close()
+
+
+class HistoryDAO:
+    """Append only segmented history of sensors values."""
+
+    MAX_OPEN_SEGMENTS = 64
+
+    # Append state is shared by all instances of the process
+    _lock = threading.Lock()
+    _open_segments = OrderedDict()
+
+    def __init__(self, conf) -> None:
+        self._conf = conf
+        self._logger = logging.getLogger(__name__)
+        history_conf = conf.get("history", settings.history)
+        self._dir = history_conf.get("dir") or os.path.join(
+            conf["datadir"], "history"
+        )
+        self._segment_s = history_conf.get(
+            "segment_s", settings.history["segment_s"]
+        )
+        self._index_every = history_conf.get(
+            "index_every", settings.history["index_every"]
+        )
+        self._block_size = history_conf.get(
+            "archive", settings.history["archive"]
+        ).get("block_size", settings.history["archive"]["block_size"])
+
+    @staticmethod
+    def enabled(conf):
+        """Tell if history is enabled in configuration.
+
+        :param conf: runtime configuration
+        :type conf: dict
+        :rtype: bool
+        """
+        return conf.get("history", settings.history).get("enabled", False)
+
+    @property
+    def segment_s(self):
+        """Segments duration in seconds."""
+        return self._segment_s
+
+    def _sensor_dir(self, sid):
+        return os.path.join(self._dir, sid)
+
+    def segment_start(self, ts):
+        """Get start of the segment holding a timestamp.
+
+        :param ts: epoch timestamp
+        :type ts: float
+        :rtype: int
+        """
+        return int(ts // self._segment_s * self._segment_s)
+
+    def _get_open_segment(self, sid, start):
+        key = (self._dir, sid)
+        segment = self._open_segments.get(key)
+        if segment is not None and segment.start == start:
+            self._open_segments.move_to_end(key)
+            return segment
+        if segment is not None:
+            segment.close()
+            del self._open_segments[key]
+
+        os.makedirs(self._sensor_dir(sid), exist_ok=True)
+        segment = _OpenSegment(
+            os.path.join(self._sensor_dir(sid), str(start)),
+            start
+        )
+        self._open_segments[key] = segment
+        while len(self._open_segments) > self.MAX_OPEN_SEGMENTS:
+            self._open_segments.popitem(last=False)[1].close()
+        return segment
+
+    def _write(self, sid, ts, value):
+        line = f"{ts:.6f}\t{json.dumps(value)}\n".encode("utf-8")
+        segment = self._get_open_segment(sid, self.segment_start(ts))
+        if segment.last_ts is not None and ts < segment.last_ts:
+            segment.index.write(f"{UNSORTED_MARK}\n")
+        if segment.count % self._index_every == 0:
+            segment.index.write(f"{ts:.6f}\t{segment.data.tell()}\n")
+            segment.index.flush()
+        segment.data.write(line)
+        segment.count += 1
+        if segment.last_ts is None or ts > segment.last_ts:
+            segment.last_ts = ts
+        return segment
+
+    def append(self, sid, ts, value):
+        """Append a reading to sensor history.
+
+        :param sid: sensor identifier
+        :type sid: str
+        :param ts: measurement epoch timestamp
+        :type ts: float
+        :param value: sensor value
+        :type value: str
+        """
+        with self._lock:
+            self._write(sid, ts, value).data.flush()
+
+    def append_many(self, readings):
+        """Append readings to sensors history (segments are flushed once).
+
+        :param readings: (sensor identifier, epoch timestamp, value) list
+        :type readings: list[tuple]
+        """
+        with self._lock:
+            touched = {}
+            # Grouped by sensor (keeping sensor order) to open each segment once
+            for sid, ts, value in sorted(readings, key=lambda reading: reading[0]):
+                segment = self._write(sid, ts, value)
+                touched[id(segment)] = segment
+            for segment in touched.values():
+                # Segments evicted during the batch were flushed on close
+                if not segment.data.closed:
+                    segment.data.flush()
+
+    def segments(self, sid):
+        """List sensor segments (hot or archived).
+
+        :param sid: sensor identifier
+        :type sid: str
+        :return: sorted list of segments start epoch
+        :rtype: list[int]
+        """
+        try:
+            names = os.listdir(self._sensor_dir(sid))
+        except FileNotFoundError:
+            return []
+        return sorted({
+            int(name[:-len(".log")]) for name in names
+            if name.endswith(".log") or name.endswith(".blk")
+        })
+
+    @staticmethod
+    def _load_index(index_file_name):
+        keys = []
+        offsets = []
+        ordered = True
+        try:
+            with open(index_file_name, encoding="utf-8") as index_file:
+                for line in index_file:
+                    if line.startswith(UNSORTED_MARK):
+                        ordered = False
+                        continue
+                    ts, offset = line.split("\t")
+                    keys.append(float(ts))
+                    offsets.append(int(offset))
+        except FileNotFoundError:
+            ordered = False
+        return keys, offsets, ordered
+
+    def _read_log(self, path, from_ts, to_ts, limit, min_value, max_value):
+        keys, offsets, ordered = self._load_index(f"{path}.idx")
+        offset = 0
+        if ordered and keys:
+            pos = bisect.bisect_left(keys, from_ts) - 1
+            if pos >= 0:
+                offset = offsets[pos]
+
+        res = []
+        with open(f"{path}.log", "rb") as data_file:
+            data_file.seek(offset)
+            for line in data_file:
+                if not line.endswith(b"\n"):
+                    # Reading is being written
+                    break
+                ts_part, value_part = line.split(b"\t", 1)
+                ts = float(ts_part)
+                if ts < from_ts:
+                    continue
+                if ts > to_ts:
+                    if ordered:
+                        break
+                    continue
+                value = json.loads(value_part)
+                if not value_matches(value, min_value, max_value):
+                    continue
+                res.append((ts, value))
+                if ordered and len(res) >= limit:
+                    break
+        if not ordered:
+            res.sort(key=lambda item: item[0])
+        return res[:limit]
+
+    @staticmethod
+    def _archive_version(file_name):
+        try:
+            stat = os.stat(file_name)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _read_segment(self, sid, start, from_ts, to_ts, limit, min_value=None, max_value=None):
+        path = os.path.join(self._sensor_dir(sid), str(start))
+        res = []
+        archive = self._archive_version(f"{path}.blk")
+        if archive is not None:
+            res = read_archive(f"{path}.blk", from_ts, to_ts, limit, min_value, max_value)
+        try:
+            log = self._read_log(path, from_ts, to_ts, limit, min_value, max_value)
+        except FileNotFoundError:
+            log = []
+            if self._archive_version(f"{path}.blk") != archive:
+                # Segment was compacted meanwhile
+                return self._read_segment(
+                    sid, start, from_ts, to_ts, limit, min_value, max_value
+                )
+        if res and log:
+            # Late readings appended after compaction, readings of a log
+            # being compacted (possibly by another process) are already in
+            # the archive
+            archived = {(round(ts * 1e6), json.dumps(value)) for ts, value in res}
+            res = sorted(
+                res + [
+                    (ts, value) for ts, value in log
+                    if (round(ts * 1e6), json.dumps(value)) not in archived
+                ],
+                key=lambda item: item[0]
+            )
+        else:
+            res = res or log
+        return res[:limit]
+
+    def query(self, sid, from_ts=None, to_ts=None, limit=1000, min_value=None, max_value=None):
+        """Get sensor readings in a time range.
+
+        :param sid: sensor identifier
+        :type sid: str
+        :param from_ts: range start epoch timestamp (included), None for no lower bound
+        :type from_ts: float
+        :param to_ts: range end epoch timestamp (included), None for no upper bound
+        :type to_ts: float
+        :param limit: max number of readings to return
+        :type limit: int
+        :param min_value: only return numeric values >= min_value
+        :type min_value: float
+        :param max_value: only return numeric values <= max_value
+        :type max_value: float
+        :return: list of (timestamp, value) sorted by timestamp
+        :rtype: list[tuple]
+        """
+        from_ts = from_ts if from_ts is not None else 0.0
+        to_ts = to_ts if to_ts is not None else float("inf")
+        res = []
+        for start in self.segments(sid):
+            if start + self._segment_s <= from_ts:
+                continue
+            if start > to_ts or len(res) >= limit:
+                break
+            res += self._read_segment(
+                sid, start, from_ts, to_ts, limit - len(res), min_value, max_value
+            )
+        return res
+
+    def compact(self, sid, sealed_before):
+        """Compact sealed hot segments of a sensor to archives.
+
+        :param sid: sensor identifier
+        :type sid: str
+        :param sealed_before: only segments ending before this epoch timestamp are compacted
+        :type sealed_before: float
+        :return: number of compacted segments
+        :rtype: int
+        """
+        count = 0
+        for start in self.segments(sid):
+            if start + self._segment_s > sealed_before:
+                break
+            path = os.path.join(self._sensor_dir(sid), str(start))
+            if not os.path.exists(f"{path}.log"):
+                continue
+            with self._lock:
+                segment = self._open_segments.get((self._dir, sid))
+                if segment is not None and segment.start == start:
+                    self._close_segments(sid)
+                readings = self._read_segment(
+                    sid, start, 0.0, float("inf"), sys.maxsize
+                )
+                if readings:
+                    write_archive(f"{path}.blk.tmp", readings, self._block_size)
+                    os.replace(f"{path}.blk.tmp", f"{path}.blk")
+                for ext in (".log", ".idx"):
+                    if os.path.exists(f"{path}{ext}"):
+                        os.remove(f"{path}{ext}")
+            count += 1
+        return count
+
+    def compact_all(self, sealed_before):
+        """Compact sealed hot segments of all sensors.
+
+        :param sealed_before: only segments ending before this epoch timestamp are compacted
+        :type sealed_before: float
+        :return: number of compacted segments
+        :rtype: int
+        """
+        try:
+            sids = os.listdir(self._dir)
+        except FileNotFoundError:
+            return 0
+        return sum(self.compact(sid, sealed_before) for sid in sids)
+
+    def _close_segments(self, sid):
+        key = (self._dir, sid)
+        segment = self._open_segments.pop(key, None)
+        if segment is not None:
+            segment.close()
+
+    def drop_segments(self, sid, before_ts):
+        """Remove sensor segments entirely older than a timestamp.
+
+        :param sid: sensor identifier
+        :type sid: str
+        :param before_ts: epoch timestamp
+        :type before_ts: float
+        :return: number of removed segments
+        :rtype: int
+        """
+        count = 0
+        with self._lock:
+            for start in self.segments(sid):
+                if start + self._segment_s > before_ts:
+                    break
+                segment = self._open_segments.get((self._dir, sid))
+                if segment is not None and segment.start == start:
+                    self._close_segments(sid)
+                path = os.path.join(self._sensor_dir(sid), str(start))
+                for ext in (".log", ".idx", ".blk"):
+                    if os.path.exists(f"{path}{ext}"):
+                        os.remove(f"{path}{ext}")
+                count += 1
+        return count
+
+    def delete(self, sid):
+        """Remove all sensor history.
+
+        :param sid: sensor identifier
+        :type sid: str
+        """
+        with self._lock:
+            self._close_segments(sid)
+            shutil.rmtree(self._sensor_dir(sid), ignore_errors=True)
@@ -0,0 +1,330 @@
+"""Memory mapped fixed size ring buffers for numeric sensors values.
+
+Each sensor gets a preallocated ``<dir>/<sid>.ring`` file::
+
+    header  (64 bytes)  magic, version, record size, capacity, head, seq, deleted
+    records (capacity * 24 bytes)  epoch timestamp (f64), value (f64), flags (u64)
+
+``head`` is the total number of records ever written, the next record goes
+to slot ``head % capacity``. Writers update ``seq`` as a seqlock (odd while a
+write is in progress) so readers from any process can copy a consistent
+window without any lock. ``deleted`` is set before a ring file is removed
+so that processes having it mapped open the new file, without checking the
+file on each access.
+"""
+
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+from sensotrack import settings
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+MAGIC = b"STRING\x00\x00"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQQQ")
+HEADER_SIZE = 64
+HEAD_OFFSET = 24
+SEQ_OFFSET = 32
+DELETED_OFFSET = 40
+RECORD = struct.Struct("<ddQ")
+U64 = struct.Struct("<Q")
+
+FLAG_VALID = 0x1
+
+MAX_READ_RETRY = 100
+# Wait before retrying a read racing with a writer (lets it finish)
+READ_RETRY_SLEEP_S = 0.0001
+
+
+class RingBuffer:
+    """Fixed size ring of (timestamp, value, flags) records over a mmap file."""
+
+    def __init__(self, path, capacity=None, writable=False) -> None:
+        """Open (and create if writable) a ring file.
+
+        :param path: ring file name
+        :type path: str
+        :param capacity: number of records, used when creating the file
+        :type capacity: int
+        :param writable: open for writing
+        :type writable: bool
+        """
+        self._path = path
+        self._lock = threading.Lock()
+        if writable and not os.path.exists(path):
+            self._create(path, capacity)
+
+        with open(path, "r+b" if writable else "rb") as ring_file:
+            self._mmap = mmap.mmap(
+                ring_file.fileno(),
+                0,
+                access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ
+            )
+        magic, version, record_size, self._capacity, _, _ = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            self._mmap.close()
+            raise ValueError(f"{path} is not a supported ring file")
+
+    @staticmethod
+    def _create(path, capacity):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as ring_file:
+            ring_file.write(
+                HEADER.pack(MAGIC, VERSION, RECORD.size, capacity, 0, 0).ljust(
+                    HEADER_SIZE, b"\0"
+                )
+            )
+            ring_file.truncate(HEADER_SIZE + capacity * RECORD.size)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def remove(path):
+        """Mark a ring file deleted for processes mapping it, then remove it.
+
+        :param path: ring file name
+        :type path: str
+        """
+        try:
+            ring_fd = os.open(path, os.O_RDWR)
+        except FileNotFoundError:
+            return
+        try:
+            # Written through the page cache shared with mappings
+            os.pwrite(ring_fd, U64.pack(1), DELETED_OFFSET)
+        finally:
+            os.close(ring_fd)
+        os.remove(path)
+
+    @property
+    def deleted(self):
+        """True if the mapped file was removed (see remove())."""
+        return U64.unpack_from(self._mmap, DELETED_OFFSET)[0] != 0
+
+    @property
+    def capacity(self):
+        """Max number of records."""
+        return self._capacity
+
+    @property
+    def head(self):
+        """Total number of records written."""
+        return U64.unpack_from(self._mmap, HEAD_OFFSET)[0]
+
+    def append(self, ts, value, flags=FLAG_VALID):
+        """Append a record (O(1), oldest record is overwritten when full).
+
+        :param ts: epoch timestamp
+        :type ts: float
+        :param value: sensor value
+        :type value: float
+        :param flags: record flags
+        :type flags: int
+        """
+        with self._lock:
+            seq = U64.unpack_from(self._mmap, SEQ_OFFSET)[0]
+            head = U64.unpack_from(self._mmap, HEAD_OFFSET)[0]
+            U64.pack_into(self._mmap, SEQ_OFFSET, seq + 1)
+            RECORD.pack_into(
+                self._mmap,
+                HEADER_SIZE + (head % self._capacity) * RECORD.size,
+                ts, value, flags
+            )
+            U64.pack_into(self._mmap, HEAD_OFFSET, head + 1)
+            U64.pack_into(self._mmap, SEQ_OFFSET, seq + 2)
+
+    def _read_consistent(self, reader):
+        for attempt in range(MAX_READ_RETRY):
+            if attempt:
+                time.sleep(READ_RETRY_SLEEP_S)
+            seq = U64.unpack_from(self._mmap, SEQ_OFFSET)[0]
+            if seq % 2:
+                continue
+            res = reader(U64.unpack_from(self._mmap, HEAD_OFFSET)[0])
+            if U64.unpack_from(self._mmap, SEQ_OFFSET)[0] == seq:
+                return res
+        raise TimeoutError(f"Unable to get a consistent read of {self._path}")
+
+    def _slots(self, head, count):
+        count = min(count, head, self._capacity)
+        first = head - count
+        start = first % self._capacity
+        end = start + count
+        if end <= self._capacity:
+            return [(start, end)]
+        return [(start, self._capacity), (0, end - self._capacity)]
+
+    def window(self, count):
+        """Get last records.
+
+        :param count: max number of records
+        :type count: int
+        :return: list of (timestamp, value, flags) from oldest to newest
+        :rtype: list[tuple]
+        """
+        def _reader(head):
+            res = []
+            for start, end in self._slots(head, count):
+                res += RECORD.iter_unpack(
+                    self._mmap[
+                        HEADER_SIZE + start * RECORD.size:HEADER_SIZE + end * RECORD.size
+                    ]
+                )
+            return res
+        return self._read_consistent(_reader)
+
+    def as_numpy(self, count):
+        """Get last records as a NumPy structured array.
+
+        The array is a view over the mapped file (no copy) unless the
+        window wraps around the end of the ring, a view keeps following the
+        file so its oldest records get overwritten once the ring wraps.
+
+        :param count: max number of records
+        :type count: int
+        :return: array with ``ts``, ``value`` and ``flags`` fields
+        :rtype: numpy.ndarray
+        """
+        if numpy is None:
+            raise RuntimeError("NumPy is not installed")
+        dtype = numpy.dtype([("ts", "<f8"), ("value", "<f8"), ("flags", "<u8")])
+
+        def _reader(head):
+            parts = [
+                numpy.frombuffer(
+                    self._mmap, dtype=dtype, count=end - start,
+                    offset=HEADER_SIZE + start * RECORD.size
+                )
+                for start, end in self._slots(head, count)
+            ]
+            if len(parts) == 1:
+                return parts[0]
+            return numpy.concatenate(parts)
+        return self._read_consistent(_reader)
+
+    def close(self):
+        """Unmap ring file."""
+        self._mmap.close()
+
+
+class RingDAO:
+    """Ring buffers of sensors numeric values."""
+
+    # Mapped rings are shared by all instances of the process
+    _lock = threading.Lock()
+    _rings = {}
+
+    def __init__(self, conf) -> None:
+        self._conf = conf
+        self._logger = logging.getLogger(__name__)
+        ring_conf = conf.get("ring", settings.ring)
+        self._dir = ring_conf.get("dir") or os.path.join(conf["datadir"], "ring")
+        self._capacity = ring_conf.get("capacity", settings.ring["capacity"])
+
+    @staticmethod
+    def enabled(conf):
+        """Tell if ring storage is enabled in configuration.
+
+        :param conf: runtime configuration
+        :type conf: dict
+        :rtype: bool
+        """
+        return conf.get("ring", settings.ring).get("enabled", False)
+
+    def _path(self, sid):
+        return os.path.join(self._dir, f"{sid}.ring")
+
+    def _get_ring(self, sid, writable):
+        key = (self._path(sid), writable)
+        ring = self._rings.get(key)
+        # Ring may have been removed (and created again) by another process
+        if ring is not None and not ring.deleted:
+            return ring
+        with self._lock:
+            ring = self._rings.get(key)
+            if ring is not None and ring.deleted:
+                self._close(sid, self._rings.pop(key))
+                ring = None
+            if ring is None:
+                if writable:
+                    os.makedirs(self._dir, exist_ok=True)
+                elif not os.path.exists(key[0]):
+                    return None
+                ring = self._rings[key] = RingBuffer(key[0], self._capacity, writable)
+            return ring
+
+    def _close(self, sid, ring):
+        try:
+            ring.close()
+        except BufferError:
+            # NumPy views are still alive, let GC unmap it
+            self._logger.debug("Ring of %s is still in use", sid)
+
+    def append(self, sid, ts, value):
+        """Append a value to sensor ring if it's numeric.
+
+        :param sid: sensor identifier
+        :type sid: str
+        :param ts: measurement epoch timestamp
+        :type ts: float
+        :param value: sensor value
+        :type value: str|float
+        :return: True if value was stored
+        :rtype: bool
+        """
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return False
+        self._get_ring(sid, True).append(ts, value)
+        return True
+
+    def window(self, sid, count):
+        """Get sensor last values.
+
+        :param sid: sensor identifier
+        :type sid: str
+        :param count: max number of values
+        :type count: int
+        :return: list of (timestamp, value) from oldest to newest, None if no ring
+        :rtype: list[tuple]
+        """
+        ring = self._get_ring(sid, False)
+        if ring is None:
+            return None
+        return [
+            (ts, value)
+            for ts, value, flags in ring.window(count)
+            if flags & FLAG_VALID
+        ]
+
+    def as_numpy(self, sid, count):
+        """Get sensor last values as NumPy array (see RingBuffer.as_numpy()).
+
+        :return: array or None if no ring
+        :rtype: numpy.ndarray
+        """
+        ring = self._get_ring(sid, False)
+        if ring is None:
+            return None
+        return ring.as_numpy(count)
+
+    def delete(self, sid):
+        """Remove sensor ring.
+
+        :param sid: sensor identifier
+        :type sid: str
+        """
+        with self._lock:
+            for writable in (True, False):
+                ring = self._rings.pop((self._path(sid), writable), None)
+                if ring is not None:
+                    self._close(sid, ring)
+            RingBuffer.remove(self._path(sid))
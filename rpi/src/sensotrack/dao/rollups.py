@@ -0,0 +1,100 @@
+"""Rollups (aggregated buckets) storage."""
+
+import logging
+import os
+import sqlite3
+import threading
+
+from sensotrack import settings
+
+_CREATE = (
+    "CREATE TABLE IF NOT EXISTS rollups ("
+    "sid TEXT NOT NULL, resolution INTEGER NOT NULL, start INTEGER NOT NULL, "
+    "min REAL NOT NULL, max REAL NOT NULL, sum REAL NOT NULL, count INTEGER NOT NULL, "
+    "PRIMARY KEY (sid, resolution, start)"
+    ") WITHOUT ROWID"
+)
+_MERGE = (
+    "INSERT INTO rollups (sid, resolution, start, min, max, sum, count) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (sid, resolution, start) DO UPDATE SET "
+    "min = min(rollups.min, excluded.min), max = max(rollups.max, excluded.max), "
+    "sum = rollups.sum + excluded.sum, count = rollups.count + excluded.count"
+)
+_SELECT = (
+    "SELECT start, min, max, sum, count FROM rollups "
+    "WHERE sid = ? AND resolution = ? AND start >= ? AND start <= ? "
+    "ORDER BY start"
+)
+_DELETE_SENSOR = "DELETE FROM rollups WHERE sid = ?"
+_DELETE_BEFORE = "DELETE FROM rollups WHERE sid = ? AND start + resolution <= ?"
+
+
+class RollupDAO:
+    """SQLite storage of rollups buckets."""
+
+    def __init__(self, conf) -> None:
+        self._conf = conf
+        self._logger = logging.getLogger(__name__)
+        rollups_conf = conf.get("rollups", settings.rollups)
+        self._path = rollups_conf.get("path") or os.path.join(
+            conf["datadir"], "rollups.db"
+        )
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._path, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(_CREATE)
+            self._local.conn = conn
+        return conn
+
+    def merge(self, buckets):
+        """Merge buckets deltas into stored buckets (one transaction).
+
+        :param buckets: list of (sid, resolution, start, min, max, sum, count)
+        :type buckets: list[tuple]
+        """
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(_MERGE, buckets)
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+
+    def query(self, sid, resolution, from_ts, to_ts):
+        """Get sensor buckets in a time range.
+
+        :param sid: sensor identifier
+        :type sid: str
+        :param resolution: buckets duration in seconds
+        :type resolution: int
+        :param from_ts: range start epoch timestamp
+        :type from_ts: float
+        :param to_ts: range end epoch timestamp
+        :type to_ts: float
+        :return: list of (start, min, max, sum, count) sorted by start
+        :rtype: list[tuple]
+        """
+        return self._conn().execute(
+            _SELECT,
+            (sid, resolution, int(from_ts // resolution * resolution), to_ts)
+        ).fetchall()
+
+    def delete(self, sid, before_ts=None):
+        """Remove sensor buckets.
+
+        :param sid: sensor identifier
+        :type sid: str
+        :param before_ts: only remove buckets ended before this epoch timestamp
+        :type before_ts: float
+        """
+        if before_ts is None:
+            self._conn().execute(_DELETE_SENSOR, (sid,))
+        else:
+            self._conn().execute(_DELETE_BEFORE, (sid, before_ts))
@@ -0,0 +1,401 @@
+"""Shared memory last value table.
+
+The ingest process writes last values to a shared memory segment, API
+workers read them with no lock nor system call.
+
+Layout: a header (magic, layout version, closed flag, number of slots,
+slot size, sid area size) followed by fixed size slots forming an open addressing
+hash table (linear probing on the sensor id CRC32). Each slot holds::
+
+    seq (u64) | ts (f64) | sid length (u16) | JSON length (u16) | crc32 (u32)
+    sid bytes (sid_max) | rendered JSON (value_max)
+
+Slots are protected by a seqlock: the single writer makes ``seq`` odd
+while updating the slot and even again when done, readers retry while
+``seq`` is odd or changed during their copy. Python can't issue memory
+barriers and stores may become visible out of order on weakly ordered
+CPUs (the Pi ARM cores), so readers also check the slot CRC32 (of ts,
+lengths, sid and JSON) and retry on mismatch.
+
+A deleted value is a tombstone (slot keeping its sid with an empty JSON)
+so that probe chains stay valid. Tombstones are reused for new sensors,
+and the table is rebuilt when they exceed half of the slots so that
+lookups of missing sensors still end on a free slot.
+"""
+import datetime
+import json
+import logging
+import struct
+import threading
+import time
+import zlib
+from multiprocessing import resource_tracker, shared_memory
+
+from sensotrack import settings
+from sensotrack.utils.metrics import REGISTRY
+
+MAGIC = b"STLV"
+LAYOUT_VERSION = 2
+
+_HEADER = struct.Struct("<4sHHIII")
+_SLOT = struct.Struct("<QdHHI")
+# Slot fields covered by the CRC
+_SLOT_FIELDS = struct.Struct("<dHH")
+_SEQ = struct.Struct("<Q")
+_CLOSED_OFFSET = 6
+
+# Reader gives up (and falls back to storage) after this number of retries
+MAX_RETRIES = 100
+# Table is rebuilt when this ratio of slots are tombstones
+MAX_TOMBSTONES_RATIO = 0.5
+
+
+def _ts_to_iso(ts):
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).isoformat()
+
+
+class SharedLastValues:
+    """Last values table in a shared memory segment.
+
+    Use ``create()`` in the (single) writer process and ``attach()`` in
+    readers.
+    """
+
+    def __init__(self, shm, writable) -> None:
+        self._shm = shm
+        self._buf = shm.buf
+        self.writable = writable
+        _, _, _, self._slots, self._slot_size, self._sid_max = _HEADER.unpack_from(
+            self._buf, 0
+        )
+        # Rendered JSON area ends the slot
+        self._value_max = self._slot_size - _SLOT.size - self._sid_max
+        # Writer only: slot index by sensor id, tombstones slots
+        self._index = {}
+        self._tombstones = set()
+        self._write_lock = threading.Lock()
+        self._logger = logging.getLogger(__name__)
+        self._hits = REGISTRY.counter("dao.shm.hits")
+        self._misses = REGISTRY.counter("dao.shm.misses")
+        self._retries = REGISTRY.counter("dao.shm.retries")
+        self._rejected = REGISTRY.counter("dao.shm.rejected")
+        self._rebuilds = REGISTRY.counter("dao.shm.rebuilds")
+
+    @classmethod
+    def create(cls, name, slots, sid_max, value_max):
+        """Create the table (replacing a previous segment of same name).
+
+        :param name: shared memory segment name
+        :type name: str
+        :param slots: number of slots (max number of sensors)
+        :type slots: int
+        :param sid_max: max sensor id length (bytes)
+        :type sid_max: int
+        :param value_max: max rendered JSON length (bytes)
+        :type value_max: int
+        :rtype: SharedLastValues
+        """
+        try:
+            # Tell readers of a former writer to attach again
+            old = shared_memory.SharedMemory(name)
+            old.buf[_CLOSED_OFFSET] = 1
+            old.close()
+            old.unlink()
+        except FileNotFoundError:
+            pass
+        slot_size = (_SLOT.size + sid_max + value_max + 7) // 8 * 8
+        shm = shared_memory.SharedMemory(
+            name, create=True, size=_HEADER.size + slots * slot_size
+        )
+        _HEADER.pack_into(shm.buf, 0, MAGIC, LAYOUT_VERSION, 0, slots, slot_size, sid_max)
+        return cls(shm, True)
+
+    @classmethod
+    def attach(cls, name):
+        """Attach to the table created by the writer.
+
+        :param name: shared memory segment name
+        :type name: str
+        :return: table, None if it doesn't exist (yet)
+        :rtype: SharedLastValues
+        """
+        try:
+            shm = shared_memory.SharedMemory(name)
+        except FileNotFoundError:
+            return None
+        # Readers must not unlink the segment on exit
+        resource_tracker.unregister(shm._name, "shared_memory")  # pylint: disable=protected-access
+        magic, version = _HEADER.unpack_from(shm.buf, 0)[:2]
+        if magic != MAGIC or version != LAYOUT_VERSION:
+            shm.close()
+            return None
+        return cls(shm, False)
+
+    @property
+    def closed(self):
+        """True if writer replaced or dropped the table."""
+        return self._buf is None or self._buf[_CLOSED_OFFSET] != 0
+
+    def _offset(self, index):
+        return _HEADER.size + index * self._slot_size
+
+    def _read_slot(self, offset):
+        """Consistent copy of a slot.
+
+        :return: (sid, ts, JSON), None if writer kept it busy
+        :rtype: tuple
+        """
+        buf = self._buf
+        for _ in range(MAX_RETRIES):
+            seq, ts, sid_len, data_len, crc = _SLOT.unpack_from(buf, offset)
+            if not seq & 1:
+                start = offset + _SLOT.size
+                sid = bytes(buf[start:start + sid_len])
+                start += self._sid_max
+                data = bytes(buf[start:start + data_len])
+                if (
+                    _SEQ.unpack_from(buf, offset)[0] == seq
+                    and self._crc(ts, sid, data) == crc
+                ):
+                    return sid, ts, data
+            self._retries.inc()
+        return None
+
+    @staticmethod
+    def _crc(ts, sid, data):
+        return zlib.crc32(_SLOT_FIELDS.pack(ts, len(sid), len(data)) + sid + data)
+
+    def lookup(self, sid):
+        """Get a sensor last value.
+
+        :param sid: sensor identifier
+        :type sid: str
+        :return: (epoch timestamp, rendered JSON), None if not in table
+        :rtype: tuple
+        """
+        key = sid.encode("utf-8")
+        index = zlib.crc32(key) % self._slots
+        for _ in range(self._slots):
+            slot = self._read_slot(self._offset(index))
+            if slot is None or not slot[0]:
+                # Busy or free slot: sensor is not (reliably) in table
+                break
+            if slot[0] == key:
+                if not slot[2]:
+                    break
+                self._hits.inc()
+                return slot[1], slot[2]
+            index = (index + 1) % self._slots
+        self._misses.inc()
+        return None
+
+    def get(self, sid):
+        """Get a sensor last value as a sensor dict.
+
+        :param sid: sensor identifier
+        :type sid: str
+        :return: (sensor data, rendered JSON), None if not in table
+        :rtype: tuple
+        """
+        res = self.lookup(sid)
+        if res is None:
+            return None
+        return json.loads(res[1]), res[1]
+
+    def get_date(self, sid):
+        """Get a sensor last measurement ISO date.
+
+        :param sid: sensor identifier
+        :type sid: str
+        :rtype: str
+        """
+        res = self.lookup(sid)
+        return None if res is None else _ts_to_iso(res[0])
+
+    def _find_slot(self, key):
+        """First free slot or tombstone of the sensor probe chain."""
+        index = zlib.crc32(key) % self._slots
+        for _ in range(self._slots):
+            if index in self._tombstones:
+                self._tombstones.discard(index)
+                return index
+            if not _SLOT.unpack_from(self._buf, self._offset(index))[2]:
+                return index
+            index = (index + 1) % self._slots
+        return None
+
+    def _write(self, index, key, ts, data):
+        buf = self._buf
+        offset = self._offset(index)
+        seq = _SEQ.unpack_from(buf, offset)[0]
+        _SEQ.pack_into(buf, offset, seq + 1)
+        start = offset + _SLOT.size
+        buf[start:start + len(key)] = key
+        start += self._sid_max
+        buf[start:start + len(data)] = data
+        _SLOT.pack_into(
+            buf, offset, seq + 1, ts, len(key), len(data), self._crc(ts, key, data)
+        )
+        _SEQ.pack_into(buf, offset, seq + 2)
+
+    def _delete(self, sid):
+        """Make sensor slot a tombstone (called holding the write lock)."""
+        index = self._index.pop(sid, None)
+        if index is None:
+            return
+        self._write(index, sid.encode("utf-8"), 0, b"")
+        self._tombstones.add(index)
+        if len(self._tombstones) > self._slots * MAX_TOMBSTONES_RATIO:
+            self._rebuild()
+
+    def _rebuild(self):
+        """Free tombstones and store live values again (readers may miss
+        values meanwhile and fall back to storage)."""
+        self._rebuilds.inc()
+        live = []
+        for sid, index in self._index.items():
+            slot = self._read_slot(self._offset(index))
+            live.append((sid, slot[1], slot[2]))
+        for index in range(self._slots):
+            self._write(index, b"", 0, b"")
+        self._index = {}
+        self._tombstones = set()
+        for sid, ts, data in live:
+            key = sid.encode("utf-8")
+            index = self._find_slot(key)
+            self._index[sid] = index
+            self._write(index, key, ts, data)
+
+    def put(self, sid, ts, rendered):
+        """Store a sensor last value (writer only).
+
+        :param sid: sensor identifier
+        :type sid: str
+        :param ts: measurement epoch timestamp
+        :type ts: float
+        :param rendered: rendered JSON (see render_sensor())
+        :type rendered: bytes
+        :return: True if stored, False if it doesn't fit (table full or
+            too long sensor id or value), sensor previous value is then
+            removed from table.
+        :rtype: bool
+        """
+        key = sid.encode("utf-8")
+        with self._write_lock:
+            if len(key) > self._sid_max or len(rendered) > self._value_max:
+                self._rejected.inc()
+                self._delete(sid)
+                return False
+            index = self._index.get(sid)
+            if index is None:
+                index = self._find_slot(key)
+                if index is None:
+                    self._rejected.inc()
+                    self._logger.warning("Shared last values table is full")
+                    return False
+                self._index[sid] = index
+            self._write(index, key, ts, rendered)
+        return True
+
+    def remove(self, sid):
+        """Remove a sensor value (writer only).
+
+        :param sid: sensor identifier
+        :type sid: str
+        """
+        with self._write_lock:
+            self._delete(sid)
+
+    def close(self, unlink=False):
+        """Detach from segment.
+
+        :param unlink: also destroy segment (writer)
+        :type unlink: bool
+        """
+        if self._buf is None:
+            return
+        if unlink:
+            self._buf[_CLOSED_OFFSET] = 1
+        self._buf = None
+        self._shm.close()
+        if unlink:
+            self._shm.unlink()
+
+
+_TABLE = None
+_TABLE_LOCK = threading.Lock()
+_LAST_ATTACH = 0
+# Readers look for the writer segment at most once per period
+ATTACH_PERIOD_S = 1
+
+
+def _shm_conf(conf):
+    return conf.get("dao", settings.dao).get("shm", settings.dao["shm"])
+
+
+def shared_table_enabled(conf):
+    """Tell if last values are shared in memory between processes.
+
+    :param conf: runtime configuration (uses ``dao.shm`` section)
+    :type conf: dict
+    :rtype: bool
+    """
+    return _shm_conf(conf).get("enabled", False)
+
+
+def create_shared_table(conf):
+    """Create the process wide table as writer (ingest process).
+
+    :param conf: runtime configuration (uses ``dao.shm`` section)
+    :type conf: dict
+    :rtype: SharedLastValues
+    """
+    global _TABLE  # pylint: disable=global-statement
+    shm_conf = _shm_conf(conf)
+    with _TABLE_LOCK:
+        if _TABLE is not None:
+            _TABLE.close(unlink=_TABLE.writable)
+        _TABLE = SharedLastValues.create(
+            shm_conf.get("name", settings.dao["shm"]["name"]),
+            shm_conf.get("slots", settings.dao["shm"]["slots"]),
+            shm_conf.get("sid_max", settings.dao["shm"]["sid_max"]),
+            shm_conf.get("value_max", settings.dao["shm"]["value_max"])
+        )
+        return _TABLE
+
+
+def get_shared_table(conf):
+    """Return process wide table, attach to writer one if needed.
+
+    :param conf: runtime configuration (uses ``dao.shm`` section)
+    :type conf: dict
+    :return: table, None if disabled or not created by writer (yet)
+    :rtype: SharedLastValues
+    """
+    global _TABLE, _LAST_ATTACH  # pylint: disable=global-statement
+    table = _TABLE
+    if table is not None and (table.writable or not table.closed):
+        return table
+    if not shared_table_enabled(conf):
+        return None
+    with _TABLE_LOCK:
+        if _TABLE is not None and _TABLE.closed:
+            # Writer restarted
+            _TABLE.close()
+            _TABLE = None
+        if _TABLE is None and time.monotonic() - _LAST_ATTACH >= ATTACH_PERIOD_S:
+            _LAST_ATTACH = time.monotonic()
+            _TABLE = SharedLastValues.attach(
+                _shm_conf(conf).get("name", settings.dao["shm"]["name"])
+            )
+        return _TABLE
+
+
+def reset_shared_table():
+    """Drop process wide table (destroyed if this process is the writer)."""
+    global _TABLE, _LAST_ATTACH  # pylint: disable=global-statement
+    with _TABLE_LOCK:
+        if _TABLE is not None:
+            _TABLE.close(unlink=_TABLE.writable)
+        _TABLE = None
+        _LAST_ATTACH = 0
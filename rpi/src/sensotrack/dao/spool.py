@@ -0,0 +1,329 @@
+"""Disk backed FIFO of readings waiting for the bus.
+
+Readings are appended to segment files (``<seq>.seg``, rolled at
+``segment_bytes``) and consumed from a read cursor (``cursor`` file
+holding segment sequence and offset). Fully read segments are removed and
+the oldest segment is dropped when the spool exceeds ``max_bytes``.
+
+Records are::
+
+    crc32 (u32) | ts (f64) | sid length (u16) | value length (u32) | sid | value
+
+The cursor is saved when draining moves to the next segment, at most once
+per ``CURSOR_PERIOD_S`` otherwise and on close: readings may be sent again
+after a crash (at least once delivery).
+"""
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+
+from sensotrack import settings
+from sensotrack.utils.metrics import REGISTRY
+
+_RECORD = struct.Struct("<IdHI")
+_SEGMENT_SUFFIX = ".seg"
+_CURSOR_FILE = "cursor"
+
+
+class _Segment:  # pylint: disable=too-few-public-methods
+    """Spooled segment accounting."""
+
+    def __init__(self, seq):
+        self.seq = seq
+        # Unread records and bytes
+        self.records = 0
+        self.size = 0
+        # File size
+        self.end = 0
+
+
+class Spool:
+    """Bounded disk backed FIFO of (sensor id, timestamp, value) readings.
+
+    :param directory: spool files directory (created if needed)
+    :type directory: str
+    :param segment_bytes: segment file size before rolling to a new one
+    :type segment_bytes: int
+    :param max_bytes: max spool size, oldest segment is dropped beyond
+    :type max_bytes: int
+    :param drain_rate: max number of readings drained per second
+    :type drain_rate: float
+    :param name: metrics name prefix
+    :type name: str
+    """
+
+    # Min delay between cursor saves within a segment
+    CURSOR_PERIOD_S = 1
+
+    # pylint: disable=too-many-arguments,too-many-instance-attributes
+    def __init__(self, directory, segment_bytes, max_bytes, drain_rate, name) -> None:
+        self._dir = directory
+        self._segment_bytes = segment_bytes
+        self._max_bytes = max_bytes
+        self._drain_rate = drain_rate
+        self._logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._segments = []
+        self._offset = 0
+        self._tail = None
+        self._reader = None
+        self._tokens = 0
+        self._last_drain = None
+        self._saved_cursor = None
+        self._cursor_saved_at = 0
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self._buffered = REGISTRY.gauge(f"{name}.buffered")
+        self._bytes = REGISTRY.gauge(f"{name}.bytes")
+        self._rate = REGISTRY.gauge(f"{name}.drain_rate")
+        self._spilled = REGISTRY.counter(f"{name}.spilled")
+        self._replayed = REGISTRY.counter(f"{name}.replayed")
+        self._dropped = REGISTRY.counter(f"{name}.dropped")
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    @classmethod
+    def from_conf(cls, conf, name):
+        """Create the spool of a component if enabled.
+
+        :param conf: runtime configuration (uses ``spool`` section)
+        :type conf: dict
+        :param name: component name (spool sub directory and metrics prefix)
+        :type name: str
+        :return: spool, None if disabled
+        :rtype: Spool
+        """
+        spool_conf = conf.get("spool", settings.spool)
+        if not spool_conf.get("enabled", settings.spool["enabled"]):
+            return None
+        return cls(
+            os.path.join(conf["datadir"], "spool", name),
+            spool_conf.get("segment_bytes", settings.spool["segment_bytes"]),
+            spool_conf.get("max_bytes", settings.spool["max_bytes"]),
+            spool_conf.get("drain_rate", settings.spool["drain_rate"]),
+            f"spool.{name}"
+        )
+
+    def _path(self, seq):
+        return os.path.join(self._dir, f"{seq:020d}{_SEGMENT_SUFFIX}")
+
+    def _load(self):
+        """Account spooled segments from the saved cursor."""
+        seqs = sorted(
+            int(name[:-len(_SEGMENT_SUFFIX)]) for name in os.listdir(self._dir)
+            if name.endswith(_SEGMENT_SUFFIX)
+        )
+        cursor_seq, self._offset = 0, 0
+        try:
+            with open(os.path.join(self._dir, _CURSOR_FILE), encoding="utf-8") as cursor:
+                cursor_seq, self._offset = (int(part) for part in cursor.read().split())
+        except (FileNotFoundError, ValueError):
+            pass
+        for seq in seqs:
+            if seq < cursor_seq:
+                os.remove(self._path(seq))
+                continue
+            if not self._segments and seq != cursor_seq:
+                # Cursor segment is gone
+                self._offset = 0
+            segment = _Segment(seq)
+            segment.end = self._scan(segment, self._offset if not self._segments else 0)
+            if segment.end < os.path.getsize(self._path(seq)):
+                self._logger.warning("Truncating torn spool segment %s at %d", seq, segment.end)
+                os.truncate(self._path(seq), segment.end)
+            self._segments.append(segment)
+        self._update_gauges()
+
+    def _scan(self, segment, offset):
+        """Count valid records of a segment from offset.
+
+        :return: end of last valid record
+        :rtype: int
+        """
+        with open(self._path(segment.seq), "rb") as data:
+            data.seek(offset)
+            while True:
+                record = self._read_record(data)
+                if record is None:
+                    return offset
+                offset = data.tell()
+                segment.records += 1
+                segment.size += record[3]
+
+    @staticmethod
+    def _read_record(data):
+        """Read next record of a segment file.
+
+        :return: (sid, ts, value, record size), None at end or on torn record
+        :rtype: tuple
+        """
+        header = data.read(_RECORD.size)
+        if len(header) < _RECORD.size:
+            return None
+        crc, ts, sid_len, value_len = _RECORD.unpack(header)
+        body = data.read(sid_len + value_len)
+        if len(body) < sid_len + value_len or zlib.crc32(header[4:] + body) != crc:
+            return None
+        return (
+            body[:sid_len].decode("utf-8"),
+            ts,
+            body[sid_len:].decode("utf-8"),
+            _RECORD.size + len(body)
+        )
+
+    def _update_gauges(self):
+        self._buffered.set(sum(segment.records for segment in self._segments))
+        self._bytes.set(sum(segment.size for segment in self._segments))
+
+    def __len__(self):
+        return sum(segment.records for segment in self._segments)
+
+    def _drop_oldest(self):
+        segment = self._segments.pop(0)
+        self._dropped.inc(segment.records)
+        self._logger.warning("Spool is full, dropping %d readings", segment.records)
+        self._close_reader()
+        os.remove(self._path(segment.seq))
+        self._offset = 0
+
+    def append(self, sid, ts, value):
+        """Spool a reading.
+
+        :param sid: sensor identifier
+        :type sid: str
+        :param ts: measurement epoch timestamp
+        :type ts: float
+        :param value: sensor value
+        :type value: str
+        :return: False if it doesn't fit in the spool
+        :rtype: bool
+        """
+        key = sid.encode("utf-8")
+        data = value.encode("utf-8")
+        body = _RECORD.pack(0, ts, len(key), len(data))[4:] + key + data
+        record = struct.pack("<I", zlib.crc32(body)) + body
+        with self._lock:
+            size = sum(segment.size for segment in self._segments)
+            while len(self._segments) > 1 and size + len(record) > self._max_bytes:
+                size -= self._segments[0].size
+                self._drop_oldest()
+            if size + len(record) > self._max_bytes:
+                self._dropped.inc()
+                return False
+            if not self._segments or self._segments[-1].end >= self._segment_bytes:
+                self._close_tail()
+                self._segments.append(_Segment(self._segments[-1].seq + 1 if self._segments else 1))
+            segment = self._segments[-1]
+            if self._tail is None:
+                self._tail = open(self._path(segment.seq), "ab")  # pylint: disable=consider-using-with
+            self._tail.write(record)
+            self._tail.flush()
+            segment.records += 1
+            segment.size += len(record)
+            segment.end += len(record)
+            self._spilled.inc()
+            self._update_gauges()
+        return True
+
+    def _close_tail(self):
+        if self._tail is not None:
+            self._tail.close()
+            self._tail = None
+
+    def _close_reader(self):
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+    def _peek(self):
+        """Read the reading under the cursor (called holding the lock).
+
+        :return: (sid, ts, value, record size), None if spool is empty
+        :rtype: tuple
+        """
+        while self._segments:
+            segment = self._segments[0]
+            if segment.records:
+                if self._reader is None:
+                    self._reader = open(self._path(segment.seq), "rb")  # pylint: disable=consider-using-with
+                self._reader.seek(self._offset)
+                return self._read_record(self._reader)
+            if len(self._segments) == 1:
+                return None
+            # Fully read segment
+            self._close_reader()
+            os.remove(self._path(segment.seq))
+            self._segments.pop(0)
+            self._offset = 0
+        return None
+
+    def _save_cursor(self, now, force=False):
+        """Persist the cursor on segment change, periodically otherwise."""
+        position = (self._segments[0].seq if self._segments else 0, self._offset)
+        if position == self._saved_cursor:
+            return
+        if (
+            not force
+            and self._saved_cursor is not None
+            and position[0] == self._saved_cursor[0]
+            and now - self._cursor_saved_at < self.CURSOR_PERIOD_S
+        ):
+            return
+        tmp_name = os.path.join(self._dir, _CURSOR_FILE + ".tmp")
+        with open(tmp_name, "w", encoding="utf-8") as cursor:
+            cursor.write(f"{position[0]} {position[1]}\n")
+        os.replace(tmp_name, os.path.join(self._dir, _CURSOR_FILE))
+        self._saved_cursor = position
+        self._cursor_saved_at = now
+
+    def drain(self, send):
+        """Send spooled readings in order, at most at the drain rate.
+
+        :param send: called with (sid, ts, value), returns False if the
+            reading could not be sent (draining stops)
+        :type send: callable
+        :return: number of sent readings
+        :rtype: int
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._last_drain is not None:
+                # At most one second of burst
+                self._tokens = min(
+                    self._drain_rate, self._tokens + (now - self._last_drain) * self._drain_rate
+                )
+            self._last_drain = now
+            sent = 0
+            while self._tokens >= 1:
+                record = self._peek()
+                if record is None:
+                    break
+                sid, ts, value, size = record
+                if not send(sid, ts, value):
+                    break
+                self._tokens -= 1
+                self._offset += size
+                segment = self._segments[0]
+                segment.records -= 1
+                segment.size -= size
+                sent += 1
+            if sent:
+                self._save_cursor(now)
+                self._replayed.inc(sent)
+                self._update_gauges()
+            self._window_count += sent
+            if now - self._window_start >= 1:
+                self._rate.set(self._window_count / (now - self._window_start))
+                self._window_start = now
+                self._window_count = 0
+        return sent
+
+    def close(self):
+        """Close segment files."""
+        with self._lock:
+            self._save_cursor(time.monotonic(), True)
+            self._close_tail()
+            self._close_reader()
@@ -0,0 +1,338 @@
+"""SQLite last values storage.
+
+A single writer thread owns the write connection and commits queued
+upserts/deletes by batches, API threads read through a small pool of
+read only connections. The database runs in WAL mode so readers never
+wait for the writer.
+"""
+
+import datetime
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from sensotrack import settings
+from sensotrack.utils.metrics import REGISTRY
+
+_CREATE = (
+    "CREATE TABLE IF NOT EXISTS last_values ("
+    "sid TEXT PRIMARY KEY, value TEXT NOT NULL, "
+    "measurement_date TEXT NOT NULL, ts REAL NOT NULL"
+    ") WITHOUT ROWID"
+)
+_UPSERT = (
+    "INSERT INTO last_values (sid, value, measurement_date, ts) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT (sid) DO UPDATE SET value = excluded.value, "
+    "measurement_date = excluded.measurement_date, ts = excluded.ts"
+)
+_DELETE = "DELETE FROM last_values WHERE sid = ?"
+_SELECT = "SELECT value, measurement_date FROM last_values WHERE sid = ?"
+_SELECT_MANY = (
+    "SELECT sid, value, measurement_date FROM last_values WHERE sid IN ({})"
+)
+_SELECT_DATES = "SELECT sid, measurement_date FROM last_values WHERE sid IN ({})"
+_SELECT_IDS = "SELECT sid FROM last_values"
+
+# Max host parameters per statement for old SQLite versions
+_MAX_PARAMS = 999
+
+_DELETED = object()
+_STOP = object()
+
+
+class SQLiteStorage:
+    """Last values storage using SQLite."""
+
+    def __init__(self, conf) -> None:
+        self._conf = conf
+        self._logger = logging.getLogger(__name__)
+        sqlite_conf = conf.get("dao", settings.dao).get(
+            "sqlite", settings.dao["sqlite"]
+        )
+        self._path = sqlite_conf.get("path") or os.path.join(
+            conf["datadir"], "sensotrack.db"
+        )
+        self._batch_size = sqlite_conf.get(
+            "batch_size", settings.dao["sqlite"]["batch_size"]
+        )
+        self._read_pool_size = sqlite_conf.get(
+            "read_pool", settings.dao["sqlite"]["read_pool"]
+        )
+
+        # Pending writes not yet commited, read by get() to keep
+        # read-your-writes semantic
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._writer_thread = None
+        self._writer_lock = threading.Lock()
+
+        self._read_pool = queue.LifoQueue()
+        self._read_pool_count = 0
+        self._read_pool_lock = threading.Lock()
+
+        self._batch_summary = REGISTRY.summary("dao.sqlite.batch_size")
+        self._queue_depth = REGISTRY.gauge("dao.sqlite.queue_depth")
+
+        with self._connect() as conn:
+            conn.execute(_CREATE)
+
+    def _connect(self, read_only=False):
+        conn = sqlite3.connect(
+            self._path,
+            check_same_thread=False,
+            isolation_level=None
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if read_only:
+            conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    @contextmanager
+    def _reader(self):
+        try:
+            conn = self._read_pool.get_nowait()
+        except queue.Empty:
+            with self._read_pool_lock:
+                if self._read_pool_count < self._read_pool_size:
+                    self._read_pool_count += 1
+                    conn = self._connect(read_only=True)
+                else:
+                    conn = None
+            if conn is None:
+                conn = self._read_pool.get()
+        try:
+            yield conn
+        finally:
+            self._read_pool.put(conn)
+
+    def _ensure_writer(self):
+        if self._writer_thread is None:
+            with self._writer_lock:
+                if self._writer_thread is None:
+                    self._writer_thread = threading.Thread(
+                        target=self._writer_impl,
+                        daemon=True
+                    )
+                    self._writer_thread.start()
+
+    def _writer_impl(self):
+        conn = self._connect()
+        running = True
+        while running:
+            # Queue items are operations or lists of operations
+            batch = [self._queue.get()]
+            count = len(batch[0]) if isinstance(batch[0], list) else 1
+            while count < self._batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+                count += len(batch[-1]) if isinstance(batch[-1], list) else 1
+            self._queue_depth.set(self._queue.qsize())
+
+            ops = []
+            for item in batch:
+                if isinstance(item, list):
+                    ops.extend(item)
+                elif item is _STOP:
+                    running = False
+                else:
+                    ops.append(item)
+            try:
+                self._commit(conn, ops)
+            except sqlite3.Error:
+                self._logger.exception("Unable to commit %d sensors values", len(ops))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+        conn.close()
+
+    def _commit(self, conn, ops):
+        if not ops:
+            return
+        conn.execute("BEGIN")
+        try:
+            for sid, sensor in ops:
+                if sensor is _DELETED:
+                    conn.execute(_DELETE, (sid,))
+                else:
+                    conn.execute(
+                        _UPSERT,
+                        (
+                            sid,
+                            json.dumps(sensor["value"]),
+                            sensor["measurementDate"],
+                            datetime.datetime.fromisoformat(
+                                sensor["measurementDate"]
+                            ).timestamp()
+                        )
+                    )
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            with self._pending_lock:
+                for sid, sensor in ops:
+                    if self._pending.get(sid) is sensor:
+                        del self._pending[sid]
+        self._batch_summary.observe(len(ops))
+
+    def _enqueue(self, sid, sensor):
+        self._ensure_writer()
+        with self._pending_lock:
+            self._pending[sid] = sensor
+        self._queue.put((sid, sensor))
+
+    def _enqueue_many(self, ops):
+        self._ensure_writer()
+        with self._pending_lock:
+            for sid, sensor in ops:
+                self._pending[sid] = sensor
+        self._queue.put(ops)
+
+    def get(self, sid):
+        """Get a sensor by id
+
+        :param sid: sensor id
+        :type sid: str
+        :return: sensor data if found None else.
+        :rtype: dict
+        """
+        with self._pending_lock:
+            pending = self._pending.get(sid)
+        if pending is _DELETED:
+            return None
+        if pending is not None:
+            return pending
+
+        with self._reader() as conn:
+            row = conn.execute(_SELECT, (sid,)).fetchone()
+        if row is None:
+            return None
+        return {
+            "sensorId": sid,
+            "value": json.loads(row[0]),
+            "measurementDate": row[1]
+        }
+
+    def get_many(self, sids):
+        """Get sensors by ids
+
+        :param sids: sensors ids
+        :type sids: list[str]
+        :return: found sensors data by id
+        :rtype: dict
+        """
+        res = {}
+        to_read = []
+        with self._pending_lock:
+            for sid in sids:
+                pending = self._pending.get(sid)
+                if pending is None:
+                    to_read.append(sid)
+                elif pending is not _DELETED:
+                    res[sid] = pending
+
+        with self._reader() as conn:
+            for pos in range(0, len(to_read), _MAX_PARAMS):
+                chunk = to_read[pos:pos + _MAX_PARAMS]
+                for sid, value, measurement_date in conn.execute(
+                        _SELECT_MANY.format(",".join("?" * len(chunk))), chunk
+                    ):
+                    res[sid] = {
+                        "sensorId": sid,
+                        "value": json.loads(value),
+                        "measurementDate": measurement_date
+                    }
+        return res
+
+    def get_dates(self, sids):
+        """Get sensors measurement dates (values are not decoded).
+
+        :param sids: sensors ids
+        :type sids: list[str]
+        :return: found sensors ISO measurement date by id
+        :rtype: dict
+        """
+        res = {}
+        to_read = []
+        with self._pending_lock:
+            for sid in sids:
+                pending = self._pending.get(sid)
+                if pending is None:
+                    to_read.append(sid)
+                elif pending is not _DELETED:
+                    res[sid] = pending["measurementDate"]
+
+        with self._reader() as conn:
+            for pos in range(0, len(to_read), _MAX_PARAMS):
+                chunk = to_read[pos:pos + _MAX_PARAMS]
+                res.update(
+                    conn.execute(_SELECT_DATES.format(",".join("?" * len(chunk))), chunk)
+                )
+        return res
+
+    def list_ids(self):
+        """List stored sensors ids.
+
+        :rtype: list[str]
+        """
+        with self._reader() as conn:
+            res = {row[0] for row in conn.execute(_SELECT_IDS)}
+        with self._pending_lock:
+            for sid, pending in self._pending.items():
+                if pending is _DELETED:
+                    res.discard(sid)
+                else:
+                    res.add(sid)
+        return sorted(res)
+
+    def upsert(self, sensor):
+        """Persist sensor (commited asynchronously by writer thread)
+
+        :param sensor: sensor to persist
+        :type sensor: dict
+        """
+        self._enqueue(sensor["sensorId"], sensor)
+
+    def upsert_many(self, sensors):
+        """Persist sensors (commited together by writer thread)
+
+        :param sensors: sensors to persist
+        :type sensors: list[dict]
+        """
+        if sensors:
+            self._enqueue_many([(sensor["sensorId"], sensor) for sensor in sensors])
+
+    def delete(self, sid):
+        """Delet sensor data
+
+        :param sid: sensor identifier
+        :type sid: str
+        """
+        self._enqueue(sid, _DELETED)
+
+    def flush(self):
+        """Wait until all pending writes are commited."""
+        if self._writer_thread is not None:
+            self._queue.join()
+
+    def close(self):
+        """Flush pending writes and close connections."""
+        if self._writer_thread is not None:
+            self._queue.put(_STOP)
+            self._writer_thread.join()
+            self._writer_thread = None
+        while True:
+            try:
+                self._read_pool.get_nowait().close()
+            except queue.Empty:
+                break
+        self._read_pool_count = 0
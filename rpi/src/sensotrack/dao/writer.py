@@ -0,0 +1,202 @@
+"""Group commit writer for JSON last value files.
+
+Upserts are queued and written by a dedicated thread. A batch is flushed
+when it reaches ``max_batch`` sensors or ``flush_interval_s`` after its
+first item; repeated updates of a sensor within a batch are coalesced to
+the latest value. Files are written atomically (temporary file + rename),
+with ``fsync`` the batch data is synced once (``syncfs()`` where available)
+before the renames.
+"""
+
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from sensotrack import settings
+from sensotrack.utils.metrics import REGISTRY
+
+_STOP = object()
+
+
+def _load_syncfs():
+    try:
+        return ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True).syncfs
+    except (OSError, AttributeError, TypeError):
+        return None
+
+
+# Syncs the file system of a file descriptor (Linux only)
+_SYNCFS = _load_syncfs()
+
+
+class GroupCommitWriter:
+    """Batching writer of ``<datadir>/<sid>.json`` files."""
+
+    def __init__(self, conf) -> None:
+        self._conf = conf
+        self._logger = logging.getLogger(__name__)
+        writer_conf = conf.get("dao", settings.dao).get(
+            "writer", settings.dao["writer"]
+        )
+        self._flush_interval_s = writer_conf.get(
+            "flush_interval_s", settings.dao["writer"]["flush_interval_s"]
+        )
+        self._max_batch = writer_conf.get(
+            "max_batch", settings.dao["writer"]["max_batch"]
+        )
+        self._fsync = writer_conf.get("fsync", settings.dao["writer"]["fsync"])
+        self._queue = queue.Queue(
+            writer_conf.get("queue_size", settings.dao["writer"]["queue_size"])
+        )
+
+        # Latest values not yet written, read by the storage to keep
+        # read-your-writes semantic
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+
+        self._queue_depth = REGISTRY.gauge("dao.writer.queue_depth")
+        self._batch_size = REGISTRY.summary("dao.writer.batch_size")
+        self._flush_duration = REGISTRY.summary("dao.writer.flush_duration_s")
+        self._coalesced = REGISTRY.counter("dao.writer.coalesced")
+        self._errors = REGISTRY.counter("dao.writer.errors")
+
+        self._thread = threading.Thread(target=self._writer_impl, daemon=True)
+        self._thread.start()
+
+    def submit(self, sensor):
+        """Queue a sensor value for writing (blocks if queue is full).
+
+        :param sensor: sensor to persist
+        :type sensor: dict
+        """
+        with self._pending_lock:
+            self._pending[sensor["sensorId"]] = sensor
+        self._queue.put(sensor)
+        self._queue_depth.set(self._queue.qsize())
+
+    def pending(self, sid):
+        """Get a queued value not written yet.
+
+        :param sid: sensor identifier
+        :type sid: str
+        :return: sensor data or None
+        :rtype: dict
+        """
+        with self._pending_lock:
+            return self._pending.get(sid)
+
+    def pending_ids(self):
+        """Get ids of sensors with values not written yet.
+
+        :rtype: list[str]
+        """
+        with self._pending_lock:
+            return list(self._pending)
+
+    def forget(self, sid):
+        """Drop pending value of a sensor (sensor is deleted).
+
+        :param sid: sensor identifier
+        :type sid: str
+        """
+        with self._pending_lock:
+            self._pending.pop(sid, None)
+
+    def _collect(self):
+        items = [self._queue.get()]
+        deadline = time.monotonic() + self._flush_interval_s
+        while items[-1] is not _STOP and len(items) < self._max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return items
+
+    def _writer_impl(self):
+        running = True
+        while running:
+            items = self._collect()
+            self._queue_depth.set(self._queue.qsize())
+            sensors = {}
+            for item in items:
+                if item is _STOP:
+                    running = False
+                else:
+                    sensors[item["sensorId"]] = item
+            with self._pending_lock:
+                # Skip values forgotten because sensor was deleted, values
+                # superseded by a later submit are still newer than the file
+                sensors = {
+                    sid: sensor for sid, sensor in sensors.items()
+                    if sid in self._pending
+                }
+            self._coalesced.inc(len(items) - len(sensors) - (0 if running else 1))
+            try:
+                if sensors:
+                    self._write_batch(sensors)
+            except OSError:
+                self._errors.inc()
+                self._logger.exception("Unable to write %d sensors values", len(sensors))
+            finally:
+                with self._pending_lock:
+                    for sid, sensor in sensors.items():
+                        if self._pending.get(sid) is sensor:
+                            del self._pending[sid]
+                for _ in items:
+                    self._queue.task_done()
+
+    def _write_batch(self, sensors):
+        start = time.perf_counter()
+        datadir = self._conf["datadir"]
+        for sid, sensor in sensors.items():
+            with open(f"{datadir}/{sid}.json.tmp", "w", encoding="utf-8") as data_file:
+                data_file.write(json.dumps(sensor))
+        dir_fd = os.open(datadir, os.O_RDONLY) if self._fsync else None
+        try:
+            if self._fsync:
+                self._sync_data(dir_fd, [f"{datadir}/{sid}.json.tmp" for sid in sensors])
+            with self._pending_lock:
+                # Sensors deleted (forgotten) since the batch was collected
+                # are not written, delete waits for renames. Superseded values
+                # are written, next batch writes the latest one.
+                for sid in sensors:
+                    if sid in self._pending:
+                        os.replace(f"{datadir}/{sid}.json.tmp", f"{datadir}/{sid}.json")
+                    else:
+                        os.remove(f"{datadir}/{sid}.json.tmp")
+            if self._fsync:
+                os.fsync(dir_fd)
+        finally:
+            if dir_fd is not None:
+                os.close(dir_fd)
+        self._batch_size.observe(len(sensors))
+        self._flush_duration.observe(time.perf_counter() - start)
+
+    @staticmethod
+    def _sync_data(dir_fd, file_names):
+        """Sync written files data, once for the batch if possible."""
+        if _SYNCFS is not None and _SYNCFS(dir_fd) == 0:
+            return
+        for file_name in file_names:
+            data_fd = os.open(file_name, os.O_RDONLY)
+            try:
+                os.fsync(data_fd)
+            finally:
+                os.close(data_fd)
+
+    def flush(self):
+        """Wait until all queued values are written."""
+        self._queue.join()
+
+    def close(self):
+        """Write queued values and stop writer thread."""
+        self._queue.put(_STOP)
+        self._thread.join()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""ingest.py: Sensors ingest daemon.
+
+Runs the ``ingest`` role alone: bus reception, connectors (devices) and
+background maintenance. Exactly one such process must run, REST API
+workers are started separately with the ``api`` role (see bin/webapi).
+"""
+import argparse
+import logging
+import signal
+import threading
+
+from sensotrack import settings, __version__
+from sensotrack.app import load_config
+from sensotrack.dao import SensorDAO
+from sensotrack.dao.shm import reset_shared_table
+
+
+def wait_for_termination():
+    """Block until SIGTERM or SIGINT, then flush storages and drop shared
+    last values table."""
+    stopped = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stopped.set())
+    stopped.wait()
+    logging.getLogger(__name__).info("Stopping")
+    SensorDAO.close_storages()
+    reset_shared_table()
+
+
+def main():
+    """Ingest daemon launcher."""
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-version',
+        action="store_true",
+        default=False,
+        help="display version and exit"
+    )
+    args = parser.parse_args()
+
+    if args.version:
+        print(F"Version: {__version__}")
+        return
+
+    load_config([settings.ROLE_INGEST])
+    wait_for_termination()
+
+
+if __name__ == "__main__":
+    main()
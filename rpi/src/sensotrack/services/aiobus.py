@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+"""asyncio bus service.
+
+asyncio implementation of the MQTTClient contract: all clients of the
+process share one event loop (run by a single thread) driving paho network
+loops through socket callbacks, and messages are handled by coroutines.
+"""
+import asyncio
+import concurrent.futures
+import logging
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+from sensotrack import settings
+from sensotrack.services.bus import IngestedValuesMixin, SensorsDataMixin
+from sensotrack.services.dispatch import AsyncDispatchPool
+from sensotrack.utils.exceptions import STException
+from sensotrack.utils.metrics import REGISTRY
+
+
+def asyncio_client(conf):
+    """Tell if MQTT clients must be asyncio ones.
+
+    :param conf: runtime configuration (uses ``mqtt.client``)
+    :type conf: dict
+    :rtype: bool
+    """
+    client = conf.get("mqtt", {}).get("client", settings.mqtt_client)
+    if client not in (settings.MQTT_CLIENT_THREADED, settings.MQTT_CLIENT_ASYNCIO):
+        raise ValueError(f"Unsupported MQTT client {client}")
+    return client == settings.MQTT_CLIENT_ASYNCIO
+
+
+class BusLoop:
+    """Event loop shared by asyncio MQTT clients of the process.
+
+    The loop is run by a daemon thread started on first use.
+    """
+
+    _lock = threading.Lock()
+    _loop = None
+    _thread = None
+
+    @classmethod
+    def get(cls):
+        """Get the running shared loop (started if needed).
+
+        :rtype: asyncio.AbstractEventLoop
+        """
+        with cls._lock:
+            if cls._loop is None:
+                cls._loop = asyncio.new_event_loop()
+                cls._thread = threading.Thread(
+                    target=cls._loop.run_forever, name="mqtt.loop", daemon=True
+                )
+                cls._thread.start()
+            return cls._loop
+
+    @classmethod
+    def reset(cls):
+        """Stop and close the shared loop."""
+        with cls._lock:
+            if cls._loop is not None:
+                cls._loop.call_soon_threadsafe(cls._loop.stop)
+                cls._thread.join()
+                cls._loop.close()
+            cls._loop = None
+            cls._thread = None
+
+
+class AsyncMQTTClient:
+    """asyncio MQTT bus receiver.
+
+    Same contract as MQTTClient with coroutine ``process_message()`` (and
+    ``process_messages()``) handlers: messages of a sensor are handled in
+    order by the same worker task (see AsyncDispatchPool) configured by
+    ``mqtt.dispatch``. With the ``block`` policy, reading from the broker
+    is paused while a worker queue is full.
+
+    Handlers are run by the shared loop (see BusLoop): they must await (or
+    hand to an executor) anything that may block.
+    """
+    WAIT_BEFORE_RETRY = 1
+    # paho housekeeping (keep alive) period
+    MISC_PERIOD_S = 1
+    # Max number of packets read per socket readiness
+    READ_PACKETS = 100
+
+    def __init__(self, conf, topics=None, pool=10) -> None:
+        self._conf = conf
+        self._logger = logging.getLogger(__name__)
+        dispatch_conf = conf.get("mqtt", {}).get("dispatch", settings.mqtt_dispatch)
+        max_batch = dispatch_conf.get("max_batch", settings.mqtt_dispatch["max_batch"])
+        self._dispatcher = AsyncDispatchPool(
+            self.process_messages if max_batch > 1 else self.process_message,
+            pool,
+            dispatch_conf.get("queue_size", settings.mqtt_dispatch["queue_size"]),
+            dispatch_conf.get("policy", settings.mqtt_dispatch["policy"]),
+            f"mqtt.dispatch.{type(self).__name__.lower()}",
+            max_batch,
+            dispatch_conf.get("max_delay_s", settings.mqtt_dispatch["max_delay_s"]),
+            pause=self._pause_reading,
+            resume=self._resume_reading
+        )
+        if topics:
+            self._topics = topics
+        else:
+            raise STException(
+                "Subscription topics list can't be empty",
+                400
+            )
+        self._mqtt_client = None
+        self._loop = None
+        self._sock = None
+        self._misc_task = None
+        self._reading_paused = False
+        # Set on disconnection and stop
+        self._wake_up = None
+        self._running = False
+        self._main_future = None
+        self._retries = REGISTRY.counter("mqtt.asyncio.connect_retries")
+        self._pauses = REGISTRY.counter("mqtt.asyncio.read_pauses")
+
+    async def process_message(self, msg):
+        """Process a message."""
+
+        raise NotImplementedError()
+
+    async def process_messages(self, msgs):
+        """Process a batch of messages (one by one unless overridden).
+
+        :param msgs: messages in reception order
+        :type msgs: list
+        """
+        for msg in msgs:
+            await self.process_message(msg)
+
+    def _in_loop(self, callback, *args):
+        """Call from the loop thread (paho may call back from publishers)."""
+        if threading.current_thread() is BusLoop._thread:  # pylint: disable=protected-access
+            callback(*args)
+        else:
+            self._loop.call_soon_threadsafe(callback, *args)
+
+    # paho socket callbacks
+    def _on_socket_open(self, client, userdata, sock):  # pylint: disable=unused-argument
+        self._in_loop(self._watch_socket, sock)
+
+    def _on_socket_close(self, client, userdata, sock):  # pylint: disable=unused-argument
+        self._in_loop(self._unwatch_socket, sock.fileno())
+
+    def _on_socket_register_write(self, client, userdata, sock):  # pylint: disable=unused-argument
+        self._in_loop(self._watch_write, sock)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):  # pylint: disable=unused-argument
+        self._in_loop(self._unwatch_write, sock.fileno())
+
+    def _watch_socket(self, sock):
+        self._sock = sock
+        if not self._reading_paused:
+            self._loop.add_reader(sock, self._mqtt_client.loop_read, self.READ_PACKETS)
+        self._misc_task = self._loop.create_task(self._misc_loop())
+
+    def _unwatch_socket(self, fileno):
+        if self._sock is not None:
+            self._loop.remove_reader(fileno)
+            self._loop.remove_writer(fileno)
+            self._sock = None
+        if self._misc_task is not None:
+            self._misc_task.cancel()
+            self._misc_task = None
+
+    def _watch_write(self, sock):
+        if self._sock is sock:
+            self._loop.add_writer(sock, self._mqtt_client.loop_write)
+
+    def _unwatch_write(self, fileno):
+        if self._sock is not None:
+            self._loop.remove_writer(fileno)
+
+    def _pause_reading(self):
+        self._pauses.inc()
+        self._reading_paused = True
+        if self._sock is not None:
+            self._loop.remove_reader(self._sock)
+
+    def _resume_reading(self):
+        self._reading_paused = False
+        if self._sock is not None:
+            self._loop.add_reader(self._sock, self._mqtt_client.loop_read, self.READ_PACKETS)
+
+    async def _misc_loop(self):
+        while self._mqtt_client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(self.MISC_PERIOD_S)
+
+    # paho client callbacks (from the loop)
+    def _on_connect(self, client, userdata, flags, return_code): #pylint: disable=unused-argument
+        """Subscribe to MQTT topic when connected."""
+
+        self._logger.info("Connected to MQTT server with result code %s: ", return_code)
+        self._logger.info("Subscribing to topics %s", self._topics)
+        client.subscribe([(topic ,0) for topic in self._topics])
+
+    def _on_message(self, client, userdata, msg): #pylint: disable=unused-argument
+        """Receive message form MQTT and queue it to dispatch workers."""
+
+        self._dispatcher.submit(msg.topic.rsplit("/", 1)[-1], msg)
+
+    def _on_disconnect(self, client, userdata, return_code): #pylint: disable=unused-argument
+        self._logger.debug("Disconnected")
+        self._wake_up.set()
+
+    async def _wait_wake_up(self, timeout):
+        try:
+            await asyncio.wait_for(self._wake_up.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self):
+        client = mqtt.Client("mqttListener." + str(time.time()), False)
+        client.on_connect = self._on_connect
+        client.on_message = self._on_message
+        client.on_disconnect = self._on_disconnect
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+        self._mqtt_client = client
+        self._wake_up = asyncio.Event()
+        self._dispatcher.start()
+
+        self._logger.info("Connecting to MQTT bus at %s", self._conf["mqtt"]["host"])
+        while self._running:
+            self._wake_up.clear()
+            try:
+                # Name resolution and TCP connection are blocking
+                await self._loop.run_in_executor(
+                    None, client.connect, self._conf["mqtt"]["host"], self._conf["mqtt"]["port"], 60
+                )
+            except OSError:
+                self._logger.warning(
+                    "Can't connect to MQTT bus as %s",
+                    self._conf["mqtt"]["host"]
+                )
+                self._retries.inc()
+                await self._wait_wake_up(self.WAIT_BEFORE_RETRY)
+                continue
+            if not self._running:
+                client.disconnect()
+                break
+            await self._wake_up.wait()
+            if self._running:
+                self._retries.inc()
+                await self._wait_wake_up(self.WAIT_BEFORE_RETRY)
+
+    def _stop_impl(self):
+        self._running = False
+        if self._mqtt_client is not None and self._mqtt_client.is_connected():
+            self._mqtt_client.disconnect()
+        if self._wake_up is not None:
+            self._wake_up.set()
+        self._dispatcher.stop()
+
+    def publish(self, topic, message, qos=0):
+        """Publish a message to MQTT (from any thread).
+
+        :return: False if message was not handed to the MQTT client
+            (disconnected or full outbound queue)
+        :rtype: bool
+        """
+        if self._mqtt_client and self._mqtt_client.is_connected():
+            return self._mqtt_client.publish(topic, message, qos).rc == mqtt.MQTT_ERR_SUCCESS
+        return False
+
+    def start(self):
+        """Starts bus messages reviever on the shared loop."""
+
+        self._loop = BusLoop.get()
+        self._running = True
+        self._main_future = asyncio.run_coroutine_threadsafe(self._run(), self._loop)
+
+    def join(self):
+        """Wait for receiver end."""
+        if self._main_future:
+            self._main_future.result()
+            asyncio.run_coroutine_threadsafe(self._dispatcher.join(), self._loop).result()
+
+    def stop(self):
+        """Stop receiver (queued messages are still handled)."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stop_impl)
+
+
+class AsyncReceiver(SensorsDataMixin, AsyncMQTTClient):
+    """asyncio sensors data receiver (see Receiver).
+
+    Values are registered (storage, history, catalog... writes) by a pool
+    of ``mqtt.executor_threads`` threads so that the shared loop is never
+    blocked; messages of a sensor are still registered in order.
+
+    :param announce: publish registered values to ``INGESTED_TOPIC`` for API
+        workers running in other processes
+    :type announce: bool
+    """
+
+    def __init__(self, conf, pool=10, announce=False) -> None:
+        super().__init__(conf, self.DATA_TOPICS, pool)
+        self._init_sensors_data(conf, announce)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            conf.get("mqtt", {}).get("executor_threads", settings.mqtt_executor_threads),
+            thread_name_prefix="mqtt.register"
+        )
+
+    async def process_message(self, msg):
+        """Process data received from sensors."""
+        await asyncio.get_running_loop().run_in_executor(
+            self._executor, self._register_message, msg
+        )
+
+    async def process_messages(self, msgs):
+        """Process a batch of data received from sensors."""
+        await asyncio.get_running_loop().run_in_executor(
+            self._executor, self._register_messages, msgs
+        )
+
+    def join(self):
+        """Wait for receiver end."""
+        super().join()
+        self._executor.shutdown()
+
+
+class AsyncIngestedReceiver(IngestedValuesMixin, AsyncMQTTClient):
+    """asyncio receiver of values registered by the ingest process (see
+    IngestedReceiver)."""
+
+    def __init__(self, conf, pool=10) -> None:
+        super().__init__(conf, [f"{settings.INGESTED_TOPIC}/#"], pool)
+        self._init_ingested_values(conf)
+
+    async def process_message(self, msg):
+        """Process a registered value."""
+        self._refresh_message(msg)
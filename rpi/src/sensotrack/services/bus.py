@@ -1,21 +1,47 @@
 # -*- coding: utf-8 -*-
 """Asynch bus service."""
+import datetime
+import json
 import logging
-from threading import Thread, BoundedSemaphore
+from threading import Thread
 import time
 
 import paho.mqtt.client as mqtt
 
+from sensotrack import settings
+from sensotrack.services import envelope
+from sensotrack.services.dispatch import DispatchPool
+from sensotrack.services.notifier import ValueNotifier
+from sensotrack.services.publisher import MQTTPublisher
 from sensotrack.services.sensors import SensorService
+from sensotrack.services.stream import StreamHub
 from sensotrack.utils.exceptions import STException
+from sensotrack.utils.metrics import REGISTRY
 
 class MQTTClient:
-    """Async MQTT bus receiver."""
+    """Async MQTT bus receiver.
+
+    Messages are handled by a pool of ``pool`` workers (see DispatchPool)
+    configured by ``mqtt.dispatch``: messages of a sensor (last topic
+    level) are handled in order by the same worker. With
+    ``mqtt.dispatch.max_batch`` > 1 workers hand groups of messages to
+    ``process_messages()``.
+    """
     WAIT_BEFORE_RETRY = 1
     def __init__(self, conf, topics=None, pool=10) -> None:
         self._conf = conf
         self._logger = logging.getLogger(__name__)
-        self._sem = BoundedSemaphore(pool)
+        dispatch_conf = conf.get("mqtt", {}).get("dispatch", settings.mqtt_dispatch)
+        max_batch = dispatch_conf.get("max_batch", settings.mqtt_dispatch["max_batch"])
+        self._dispatcher = DispatchPool(
+            self.process_messages if max_batch > 1 else self.process_message,
+            pool,
+            dispatch_conf.get("queue_size", settings.mqtt_dispatch["queue_size"]),
+            dispatch_conf.get("policy", settings.mqtt_dispatch["policy"]),
+            f"mqtt.dispatch.{type(self).__name__.lower()}",
+            max_batch,
+            dispatch_conf.get("max_delay_s", settings.mqtt_dispatch["max_delay_s"])
+        )
         self._mqtt_client = None
         if topics:
             self._topics = topics
@@ -41,21 +67,24 @@ class MQTTClient:
         client.subscribe([(topic ,0) for topic in self._topics])
 
     def _on_message(self, client, userdata, msg): #pylint: disable=unused-argument
-        """Receive message form MQTT and process it as // thread."""
-
-        self._sem.acquire() #pylint: disable=consider-using-with
-        Thread(target=self._process_message, args=(msg,)).start()
+        """Receive message form MQTT and queue it to dispatch workers."""
 
-    def _process_message(self, msg):
-
-        self.process_message(msg)
-        self._sem.release()
+        self._dispatcher.submit(msg.topic.rsplit("/", 1)[-1], msg)
 
     def process_message(self, msg):
         """Process a message."""
 
         raise NotImplementedError()
 
+    def process_messages(self, msgs):
+        """Process a batch of messages (one by one unless overridden).
+
+        :param msgs: messages in reception order
+        :type msgs: list
+        """
+        for msg in msgs:
+            self.process_message(msg)
+
     def _on_disconnect(self, client, userdata, return_code): #pylint: disable=unused-argument
         self._logger.debug("Disconnected")
         client.loop_stop(True)
@@ -88,14 +117,21 @@ class MQTTClient:
                 time.sleep(self.WAIT_BEFORE_RETRY)
         self._running = False
 
-    def publish(self, topic, message):
-        """Publish a message to MQTT."""
+    def publish(self, topic, message, qos=0):
+        """Publish a message to MQTT.
+
+        :return: False if message was not handed to the MQTT client
+            (disconnected or full outbound queue)
+        :rtype: bool
+        """
         if self._mqtt_client and self._mqtt_client.is_connected():
-            self._mqtt_client.publish(topic, message)
+            return self._mqtt_client.publish(topic, message, qos).rc == mqtt.MQTT_ERR_SUCCESS
+        return False
 
     def start(self):
         """Starts bus messages reviever."""
 
+        self._dispatcher.start()
         self._main_thread = Thread(
             target=self._start_implem,
             daemon=True
@@ -106,36 +142,179 @@ class MQTTClient:
         """Wait for main thread end."""
         if self._main_thread:
             self._main_thread.join()
+        self._dispatcher.join()
 
     def stop(self):
-        """Stop main thread."""
+        """Stop main thread (queued messages are still handled)."""
         self._running = False
         if self._mqtt_client and self._mqtt_client.is_connected():
             self._mqtt_client.disconnect()
+        self._dispatcher.stop()
 
-class Receiver(MQTTClient):
-    """Sensors data receiver."""
+class SensorsDataMixin:
+    """Sensors data handling shared by threaded and asyncio receivers.
 
-    def __init__(self, conf, pool=10) -> None:
-        super().__init__(conf, ["sensors/data/#"], pool)
+    Live readings are received on ``sensors/data/<sid>`` (stamped on
+    reception), readings published late by connectors on
+    ``REPLAY_TOPIC/<sid>`` with their measurement date and envelopes of
+    readings (see envelope) on ``BATCH_TOPIC/<connector>``.
+    """
+
+    DATA_TOPICS = [
+        "sensors/data/#", f"{settings.REPLAY_TOPIC}/#", f"{settings.BATCH_TOPIC}/#"
+    ]
+
+    def _init_sensors_data(self, conf, announce):
         self._sensor_svc = SensorService(conf)
+        self._notifier = ValueNotifier()
+        self._stream_hub = StreamHub(conf)
+        self._announce = announce
+        # Next expected envelope sequence by topic
+        self._sequences = {}
+        self._gaps = REGISTRY.counter("bus.batch.gaps")
 
-    def process_message(self, msg):
-        """Process data received from sensors."""
+    def _unpack(self, msg):
+        """Decode an envelope, accounting readings lost since previous one."""
+        records = envelope.decode(msg.payload)
+        if records:
+            expected = self._sequences.get(msg.topic)
+            # A lower sequence is a connector restart, not a loss
+            if expected is not None and records[0][2] > expected:
+                self._gaps.inc(records[0][2] - expected)
+            self._sequences[msg.topic] = (records[-1][2] + 1) & 0xFFFFFFFF
+        return [(sid, value, ts) for sid, ts, _, value in records]
+
+    def _readings(self, msg):
+        """Extract readings from a message.
+
+        :return: (sensor id, value, measurement epoch timestamp or None)
+            list, empty if message is not understood
+        :rtype: list[tuple]
+        """
+        sensor_id = msg.topic.rsplit("/", 1)[-1]
+        try:
+            if msg.topic.startswith("sensors/data"):
+                return [(sensor_id, msg.payload.decode("utf8"), None)]
+            if msg.topic.startswith(settings.REPLAY_TOPIC):
+                reading = json.loads(msg.payload.decode("utf8"))
+                return [(
+                    sensor_id,
+                    reading["value"],
+                    datetime.datetime.fromisoformat(reading["measurementDate"]).timestamp()
+                )]
+            if msg.topic.startswith(settings.BATCH_TOPIC):
+                return self._unpack(msg)
+        except (ValueError, KeyError, TypeError):
+            pass
+        self._logger.warning(
+            "Ununderstood message %s from topic %s",
+            msg.payload.decode("utf8", "replace"),
+            msg.topic
+        )
+        return []
+
+    def _register_message(self, msg):
+        """Register data received from a sensor."""
 
         self._logger.info("Got message from topic %s", msg.topic)
-        if msg.topic.startswith("sensors/data"):
-            sensor_id = msg.topic.split("/")[-1]
-            value = msg.payload.decode("utf8")
-            self._sensor_svc.register_new_value(sensor_id, value)
+        readings = self._readings(msg)
+        if len(readings) == 1:
+            sensor = self._sensor_svc.register_new_value(*readings[0])
+            # Older replayed readings are not new values
+            if sensor is not None:
+                self._propagate(sensor)
             self._logger.debug(
                 "Received message %s from topic %s",
-                msg.payload.decode("utf8"),
+                msg.payload.decode("utf8", "replace"),
                 msg.topic
             )
-        else:
+        elif readings:
+            for sensor in self._sensor_svc.register_new_values(readings):
+                self._propagate(sensor)
+
+    def _register_messages(self, msgs):
+        """Register a batch of data received from sensors."""
+
+        readings = [reading for msg in msgs for reading in self._readings(msg)]
+        if not readings:
+            return
+        for sensor in self._sensor_svc.register_new_values(readings):
+            self._propagate(sensor)
+        self._logger.debug("Registered a batch of %d values", len(readings))
+
+    def _propagate(self, sensor):
+        """Wake up waiters and streams of a registered value."""
+        sensor_id = sensor["sensorId"]
+        self._notifier.notify(sensor_id, sensor)
+        self._stream_hub.publish(sensor_id, sensor)
+        if self._announce:
+            try:
+                MQTTPublisher.get(self._conf).publish(
+                    f"{settings.INGESTED_TOPIC}/{sensor_id}",
+                    json.dumps(sensor)
+                )
+            except STException:
+                self._logger.warning("Unable to announce value of %s", sensor_id)
+
+
+class IngestedValuesMixin:
+    """Ingested values handling shared by threaded and asyncio receivers."""
+
+    def _init_ingested_values(self, conf):
+        self._sensor_svc = SensorService(conf)
+        self._notifier = ValueNotifier()
+        self._stream_hub = StreamHub(conf)
+
+    def _refresh_message(self, msg):
+        """Refresh last value, waiters and streams from a registered value."""
+
+        try:
+            sensor = json.loads(msg.payload.decode("utf8"))
+            sensor_id = sensor["sensorId"]
+        except (ValueError, KeyError, TypeError):
             self._logger.warning(
                 "Ununderstood message %s from topic %s",
-                msg.payload.decode("utf8"),
+                msg.payload.decode("utf8", "replace"),
                 msg.topic
             )
+            return
+        self._sensor_svc.refresh_value(sensor)
+        self._notifier.notify(sensor_id, sensor)
+        self._stream_hub.publish(sensor_id, sensor)
+
+
+class Receiver(SensorsDataMixin, MQTTClient):
+    """Sensors data receiver.
+
+    :param announce: publish registered values to ``INGESTED_TOPIC`` for API
+        workers running in other processes
+    :type announce: bool
+    """
+
+    def __init__(self, conf, pool=10, announce=False) -> None:
+        super().__init__(conf, self.DATA_TOPICS, pool)
+        self._init_sensors_data(conf, announce)
+
+    def process_message(self, msg):
+        """Process data received from sensors."""
+        self._register_message(msg)
+
+    def process_messages(self, msgs):
+        """Process a batch of data received from sensors."""
+        self._register_messages(msgs)
+
+
+class IngestedReceiver(IngestedValuesMixin, MQTTClient):
+    """Receiver of values registered by the ingest process.
+
+    Used by API workers not running the ingest role: last values cache,
+    waiters and streams are fed from ``INGESTED_TOPIC``.
+    """
+
+    def __init__(self, conf, pool=10) -> None:
+        super().__init__(conf, [f"{settings.INGESTED_TOPIC}/#"], pool)
+        self._init_ingested_values(conf)
+
+    def process_message(self, msg):
+        """Process a registered value."""
+        self._refresh_message(msg)
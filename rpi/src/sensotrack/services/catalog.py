@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""Sensors catalog service."""
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+
+from sensotrack import settings
+from sensotrack.utils.metrics import REGISTRY
+
+
+class SensorCatalog:
+    """In memory index of known sensors.
+
+    Entries are maintained from ingest (``record_reading()``) and connectors
+    registration (``register()``). The index is periodically saved to a
+    snapshot file which is loaded at startup, and reloaded by processes not
+    maintaining the catalog when it changes.
+    """
+
+    # Index is shared by all instances of the process
+    _lock = threading.RLock()
+    _entries = {}
+    _sorted_ids = []
+    _snapshot_mtime = None
+    _dirty = False
+
+    def __init__(self, conf) -> None:
+        self._conf = conf
+        self._logger = logging.getLogger(__name__)
+        catalog_conf = conf.get("catalog", settings.catalog)
+        self._path = catalog_conf.get("path")
+        legacy_path = None
+        if not self._path and conf.get("datadir"):
+            # Outside sensors files
+            self._path = os.path.join(conf["datadir"], "catalog", "snapshot.json")
+            legacy_path = os.path.join(conf["datadir"], "catalog.json")
+        self._snapshot_period = catalog_conf.get(
+            "snapshot_period", settings.catalog["snapshot_period"]
+        )
+        self._size = REGISTRY.gauge("catalog.sensors")
+        with self._lock:
+            # Once per process, not on each instance (one per request)
+            if SensorCatalog._snapshot_mtime is None:
+                if legacy_path:
+                    self._move_legacy_snapshot(legacy_path)
+                self._load()
+
+    def _move_legacy_snapshot(self, legacy_path):
+        """Move a snapshot saved among sensors files by previous versions."""
+        if os.path.exists(legacy_path) and not os.path.exists(self._path):
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+            os.replace(legacy_path, self._path)
+            self._logger.info("Moved catalog snapshot %s to %s", legacy_path, self._path)
+
+    def _load(self):
+        if not self._path:
+            # No persistence
+            SensorCatalog._snapshot_mtime = 0
+            return
+        try:
+            mtime = os.path.getmtime(self._path)
+            with open(self._path, encoding="utf-8") as snapshot_file:
+                entries = json.load(snapshot_file)
+        except FileNotFoundError:
+            SensorCatalog._snapshot_mtime = 0
+            return
+        except (OSError, ValueError):
+            self._logger.exception("Unable to load catalog snapshot %s", self._path)
+            SensorCatalog._snapshot_mtime = 0
+            return
+        SensorCatalog._entries = {entry["sensorId"]: entry for entry in entries}
+        SensorCatalog._sorted_ids = sorted(SensorCatalog._entries)
+        SensorCatalog._snapshot_mtime = mtime
+        self._size.set(len(SensorCatalog._entries))
+
+    def refresh(self):
+        """Reload snapshot if it was updated by another process."""
+        if not self._path:
+            return
+        try:
+            mtime = os.path.getmtime(self._path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if mtime != SensorCatalog._snapshot_mtime and not SensorCatalog._dirty:
+                self._load()
+
+    def _get_or_create(self, sid, ts):
+        entry = SensorCatalog._entries.get(sid)
+        if entry is None:
+            entry = {
+                "sensorId": sid,
+                "connector": None,
+                "device": None,
+                "firstSeen": ts,
+                "lastSeen": None,
+                "readings": 0,
+                "valueType": None
+            }
+            SensorCatalog._entries[sid] = entry
+            bisect.insort(SensorCatalog._sorted_ids, sid)
+            self._size.set(len(SensorCatalog._entries))
+        SensorCatalog._dirty = True
+        return entry
+
+    def record_reading(self, sid, ts, value):
+        """Account a new reading for a sensor.
+
+        :param sid: sensor identifier
+        :type sid: str
+        :param ts: measurement epoch timestamp
+        :type ts: float
+        :param value: sensor value
+        :type value: str
+        """
+        try:
+            float(value)
+            value_type = "number"
+        except (TypeError, ValueError):
+            value_type = "string"
+        with self._lock:
+            entry = self._get_or_create(sid, ts)
+            if entry["lastSeen"] is None or ts > entry["lastSeen"]:
+                entry["lastSeen"] = ts
+            if ts < entry["firstSeen"]:
+                entry["firstSeen"] = ts
+            entry["readings"] += 1
+            entry["valueType"] = value_type
+
+    def register(self, sid, connector, device=None):
+        """Register a sensor handled by a connector.
+
+        :param sid: sensor identifier
+        :type sid: str
+        :param connector: connector class name
+        :type connector: str
+        :param device: device the sensor is attached to
+        :type device: str
+        """
+        with self._lock:
+            entry = self._get_or_create(sid, time.time())
+            entry["connector"] = connector
+            entry["device"] = device
+
+    def remove(self, sid):
+        """Remove a sensor from catalog.
+
+        :param sid: sensor identifier
+        :type sid: str
+        """
+        with self._lock:
+            if SensorCatalog._entries.pop(sid, None) is not None:
+                pos = bisect.bisect_left(SensorCatalog._sorted_ids, sid)
+                del SensorCatalog._sorted_ids[pos]
+                SensorCatalog._dirty = True
+                self._size.set(len(SensorCatalog._entries))
+
+    def get(self, sid):
+        """Get a sensor catalog entry.
+
+        :param sid: sensor identifier
+        :type sid: str
+        :return: entry copy or None
+        :rtype: dict
+        """
+        with self._lock:
+            entry = SensorCatalog._entries.get(sid)
+            return dict(entry) if entry else None
+
+    def entries(self):
+        """Get a copy of all entries (sorted by sensor id).
+
+        :rtype: list[dict]
+        """
+        with self._lock:
+            return [dict(SensorCatalog._entries[sid]) for sid in SensorCatalog._sorted_ids]
+
+    def search(  # pylint: disable=too-many-arguments
+            self, prefix=None, connector=None, stale_for=None, offset=0, limit=100
+        ):
+        """Search sensors.
+
+        :param prefix: sensor id prefix
+        :type prefix: str
+        :param connector: owning connector class name
+        :type connector: str
+        :param stale_for: only sensors without reading for this number of seconds
+        :type stale_for: float
+        :param offset: number of matching sensors to skip
+        :type offset: int
+        :param limit: max number of sensors to return
+        :type limit: int
+        :return: (matching sensors count, requested page of entries)
+        :rtype: tuple
+        """
+        stale_before = time.time() - stale_for if stale_for is not None else None
+        with self._lock:
+            ids = SensorCatalog._sorted_ids
+            start, end = 0, len(ids)
+            if prefix:
+                start = bisect.bisect_left(ids, prefix)
+                end = bisect.bisect_left(ids, prefix + "\U0010ffff", start)
+            total = 0
+            page = []
+            for sid in ids[start:end]:
+                entry = SensorCatalog._entries[sid]
+                if connector is not None and entry["connector"] != connector:
+                    continue
+                if stale_before is not None and entry["lastSeen"] is not None \
+                    and entry["lastSeen"] >= stale_before:
+                    continue
+                if offset <= total < offset + limit:
+                    page.append(dict(entry))
+                total += 1
+        return total, page
+
+    def snapshot(self):
+        """Save catalog to snapshot file if it changed."""
+        with self._lock:
+            if not SensorCatalog._dirty or not self._path:
+                return
+            entries = self.entries()
+            SensorCatalog._dirty = False
+        tmp_path = f"{self._path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self._path) or ".", exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as snapshot_file:
+                json.dump(entries, snapshot_file)
+            os.replace(tmp_path, self._path)
+        except OSError:
+            SensorCatalog._dirty = True
+            raise
+        with self._lock:
+            SensorCatalog._snapshot_mtime = os.path.getmtime(self._path)
+
+    def _snapshot_impl(self):
+        while True:
+            time.sleep(self._snapshot_period)
+            try:
+                self.snapshot()
+            except OSError:
+                self._logger.exception("Unable to save catalog snapshot %s", self._path)
+
+    def start_snapshots(self):
+        """Start catalog snapshot thread."""
+        threading.Thread(
+            target=self._snapshot_impl,
+            daemon=True
+        ).start()
+
+    @classmethod
+    def reset(cls):
+        """Drop in memory index (next instance reloads snapshot)."""
+        with cls._lock:
+            cls._entries = {}
+            cls._sorted_ids = []
+            cls._snapshot_mtime = None
+            cls._dirty = False
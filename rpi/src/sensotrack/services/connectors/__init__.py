@@ -1,42 +1,131 @@
 # -*- coding: utf-8 -*-
 """Connectors service."""
+import datetime
 import importlib
+import json
 import logging
 import threading
 import time
 from typing import Any
 
+from sensotrack import settings
+from sensotrack.dao.spool import Spool
+from sensotrack.services.aiobus import AsyncMQTTClient, asyncio_client
 from sensotrack.services.bus import MQTTClient
+from sensotrack.services import envelope
+from sensotrack.services.catalog import SensorCatalog
+from sensotrack.services.publisher import COMMANDS_BATCH_TOPIC
 
-class CommandReceiver(MQTTClient):
-    """MQTT receiver for command comming from core PF to sensors"""
+class CommandsMixin:
+    """Commands handling shared by threaded and asyncio command receivers."""
 
-    def __init__(self, conf, supported_sensors, on_command, pool=10) -> None:
+    def _init_commands(self, supported_sensors, on_command, on_commands):
         self._supported_sensors = supported_sensors
         self._on_command = on_command
-        super().__init__(conf, ["sensors/command/#"], pool)
+        self._on_commands = on_commands
 
-    def process_message(self, msg):
-        """Process messages comming from core PF (commands)
+    def _dispatch_command(self, msg):
+        """Hand commands comming from core PF to the connector.
+
+        Batches of commands are received on ``sensors/commands`` as a JSON
+        list of ``{"sid": ..., "command": ...}``.
 
         :param msg: message to process
         :type msg: MQTTMessage
         """
 
+        if msg.topic == COMMANDS_BATCH_TOPIC:
+            try:
+                batch = json.loads(msg.payload.decode("utf8"))
+                supported = set(self._supported_sensors())
+                commands = [
+                    (item["sid"], item["command"]) for item in batch
+                    if item["sid"] in supported
+                ]
+            except (ValueError, TypeError, KeyError):
+                self._logger.warning("Invalid commands batch %s", msg.payload)
+                return
+            if commands and self._on_commands:
+                self._on_commands(commands) #pylint: disable=not-callable
+            else:
+                for sensor_id, command in commands:
+                    self._on_command(sensor_id, command) #pylint: disable=not-callable
+            return
+
         sensor_id = msg.topic.split("/")[-1]
         if sensor_id in self._supported_sensors():
             self._on_command(sensor_id, msg.payload.decode("utf8")) #pylint: disable=not-callable
 
+class CommandReceiver(CommandsMixin, MQTTClient):
+    """MQTT receiver for command comming from core PF to sensors"""
+
+    def __init__(  # pylint: disable=too-many-arguments
+            self, conf, supported_sensors, on_command, on_commands=None, pool=10
+        ) -> None:
+        self._init_commands(supported_sensors, on_command, on_commands)
+        super().__init__(conf, ["sensors/command/#", COMMANDS_BATCH_TOPIC], pool)
+
+    def process_message(self, msg):
+        """Process messages comming from core PF (commands)
+
+        :param msg: message to process
+        :type msg: MQTTMessage
+        """
+        self._dispatch_command(msg)
+
+class AsyncCommandReceiver(CommandsMixin, AsyncMQTTClient):
+    """asyncio MQTT receiver for command comming from core PF to sensors.
+
+    Connector ``on_command()`` and ``on_commands()`` are called from the
+    shared bus event loop: they must not block.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+            self, conf, supported_sensors, on_command, on_commands=None, pool=10
+        ) -> None:
+        self._init_commands(supported_sensors, on_command, on_commands)
+        super().__init__(conf, ["sensors/command/#", COMMANDS_BATCH_TOPIC], pool)
+
+    async def process_message(self, msg):
+        """Process messages comming from core PF (commands)
+
+        :param msg: message to process
+        :type msg: MQTTMessage
+        """
+        self._dispatch_command(msg)
+
 class Connector:
-    """Connector abstract class."""
+    """Connector abstract class.
+
+    When ``spool`` is enabled, readings that can't be published (bus
+    unreachable) are spooled to disk, then published on ``REPLAY_TOPIC``
+    with their measurement date at ``spool.drain_rate`` once the bus is
+    back. Readings keep their order: new ones are spooled too until the
+    spool is drained.
+
+    When ``mqtt.batch`` is enabled, readings are stamped when read and sent
+    in binary envelopes (see envelope) on ``BATCH_TOPIC/<connector>``.
+    """
 
     def __init__(self, conf):
         self._conf = conf
         self._logger = logging.getLogger(__name__)
-        self._command_receiver = CommandReceiver(
+        self._name = type(self).__name__.lower()
+        self._spool = Spool.from_conf(conf, self._name)
+        batch_conf = conf.get("mqtt", {}).get("batch", settings.mqtt_batch)
+        self._batch = None
+        if batch_conf.get("enabled", settings.mqtt_batch["enabled"]):
+            self._batch = envelope.BatchWindow(
+                batch_conf.get("max_records", settings.mqtt_batch["max_records"]),
+                batch_conf.get("max_bytes", settings.mqtt_batch["max_bytes"]),
+                batch_conf.get("max_delay_s", settings.mqtt_batch["max_delay_s"])
+            )
+        receiver_class = AsyncCommandReceiver if asyncio_client(conf) else CommandReceiver
+        self._command_receiver = receiver_class(
             self._conf,
             self.supported_sensors,
-            self.on_command
+            self.on_command,
+            self.on_commands
         )
         self._running = False
         self._main_thread = None
@@ -51,14 +140,67 @@ class Connector:
         while self._running:
             data = self.read_data()
             if data:
-                self._command_receiver.publish(
-                    f'sensors/data/{data["sid"]}',
-                    data["data"]
-                )
+                if self._batch is None:
+                    self._publish_data(data["sid"], data["data"])
+                else:
+                    self._batch.add(data["sid"], time.time(), data["data"])
+            if self._batch is not None and self._batch.due():
+                self._publish_batch(self._batch.take())
+            if self._spool is not None:
+                self._spool.drain(self._replay)
 
             time.sleep(0.01)
+        if self._batch is not None and len(self._batch):
+            self._publish_batch(self._batch.take())
+
+    def _publish_data(self, sid, value):
+        """Publish a reading (spooled if it can't be published in order)."""
+        if self._spool is None:
+            self._command_receiver.publish(f'sensors/data/{sid}', value)
+        elif len(self._spool) or not self._command_receiver.publish(f'sensors/data/{sid}', value):
+            self._spool.append(sid, time.time(), value)
 
+    def _publish_batch(self, records):
+        """Publish readings in an envelope (spooled if it can't be published in order)."""
+        if self._spool is None:
+            self._command_receiver.publish(
+                f"{settings.BATCH_TOPIC}/{self._name}", envelope.encode(records)
+            )
+        elif len(self._spool) or not self._command_receiver.publish(
+                f"{settings.BATCH_TOPIC}/{self._name}", envelope.encode(records)
+        ):
+            for sid, ts, _, value in records:
+                self._spool.append(sid, ts, value)
+            # Replayed readings have no sequence, receivers must not see a gap
+            return
+        self._batch.published(records)
+
+    def _replay(self, sid, ts, value):
+        """Publish a spooled reading with its measurement date."""
+        return self._command_receiver.publish(
+            f"{settings.REPLAY_TOPIC}/{sid}",
+            json.dumps({
+                "value": value,
+                "measurementDate": datetime.datetime.fromtimestamp(
+                    ts, datetime.timezone.utc
+                ).isoformat()
+            }),
+            qos=1
+        )
+
+
+    def register_sensors(self, sensors, device=None):
+        """Declare sensors handled by this connector to the sensors catalog.
 
+        :param sensors: sensors identifiers
+        :type sensors: list[str]
+        :param device: device the sensors are attached to
+        :type device: str
+        """
+        catalog = SensorCatalog(self._conf)
+        connector = f"{type(self).__module__}.{type(self).__name__}"
+        for sid in sensors:
+            catalog.register(sid, connector, device)
 
     def supported_sensors(self):
         """Abstract method returning a list of supported sensors ID."""
@@ -75,6 +217,17 @@ class Connector:
         """
         raise NotImplementedError()
 
+    def on_commands(self, commands):
+        """Process a batch of commands comming from core PF
+
+        Default implementation calls on_command() for each command.
+
+        :param commands: (target sensor identifier, command) list
+        :type commands: list[tuple]
+        """
+        for sid, command in commands:
+            self.on_command(sid, command)
+
     def read_data(self):
         """Read data from a sensor and return it with the followinf dict:
         {
@@ -113,6 +266,8 @@ class Connector:
         if self._main_thread:
             self._main_thread.join()
         self._command_receiver.join()
+        if self._spool is not None:
+            self._spool.close()
 
 
 class ConnectorsManager:
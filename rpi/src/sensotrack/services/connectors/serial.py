@@ -99,6 +99,7 @@ class SerialConnector(Connector):
                 "serial": ser,
                 "sensors": sensors
             }
+            self.register_sensors(sensors, dev_name)
             self._logger.info("Device %s registered", dev_name)
         except OSError:
             self._logger.exception("Error while registring device %s", dev_name)
@@ -159,6 +160,16 @@ class SerialConnector(Connector):
 
         return res
 
+    @staticmethod
+    def _command_line(sid, command):
+        return (
+            f'COMMAND{SerialConnector._SEPARATOR}'
+            f'SENSOR{SerialConnector._SEPARATOR}{sid}'
+            # Without specific command sensor is requested to measure
+            f'{SerialConnector._SEPARATOR + command if command else ""}'
+            '\n'
+        )
+
     def on_command(self, sid, command):
         ser = self._get_serial(sid)
         if ser:
@@ -167,13 +178,20 @@ class SerialConnector(Connector):
                 command,
                 sid
             )
-            command = (
-                f'COMMAND{SerialConnector._SEPARATOR}'
-                f'SENSOR{SerialConnector._SEPARATOR}'
-                f'{sid}{SerialConnector._SEPARATOR}{command}'
-                '\n'
-            )
-            ser.write(command.encode("utf-8"))
+            ser.write(self._command_line(sid, command).encode("utf-8"))
+
+    def on_commands(self, commands):
+        # One write per device
+        batches = {}
+        for sid, command in commands:
+            ser = self._get_serial(sid)
+            if ser:
+                batches.setdefault(id(ser), (ser, []))[1].append(
+                    self._command_line(sid, command)
+                )
+        for ser, lines in batches.values():
+            self._logger.debug("Send %d commands batch", len(lines))
+            ser.write("".join(lines).encode("utf-8"))
 
 
     def read_data(self):
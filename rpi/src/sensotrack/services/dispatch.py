@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+"""Bounded dispatch of bus messages to long lived workers."""
+import asyncio
+from collections import deque
+import logging
+import threading
+import time
+import zlib
+
+from sensotrack.utils.metrics import REGISTRY
+
+POLICY_BLOCK = "block"
+POLICY_DROP_OLDEST = "drop_oldest"
+POLICY_SHED = "shed"
+
+_STOP = object()
+
+
+class _Worker:  # pylint: disable=too-few-public-methods
+    """Queue and thread of a worker."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.items = deque()
+        self.thread = None
+
+
+class DispatchPool:
+    """Fixed pool of workers fed by bounded queues.
+
+    Items are routed to a worker by key so that items of a same key (a
+    sensor) are handled in submission order by the same worker. When the
+    worker queue is full, ``policy`` tells what ``submit()`` does (items
+    submitted after ``stop()`` are shed):
+
+    * ``block``: wait for room in the queue (backpressure to the caller),
+    * ``drop_oldest``: drop the oldest queued item,
+    * ``shed``: drop the submitted item.
+
+    With ``max_batch`` > 1, workers drain up to ``max_batch`` queued items
+    (waiting at most ``max_delay_s`` for more) and ``handler`` is called
+    with the list of items.
+
+    :param handler: called with each item (or items list) by workers
+    :type handler: callable
+    :param workers: number of workers
+    :type workers: int
+    :param queue_size: max number of queued items per worker
+    :type queue_size: int
+    :param policy: overflow policy
+    :type policy: str
+    :param name: metrics name prefix
+    :type name: str
+    :param max_batch: max number of items per handler call
+    :type max_batch: int
+    :param max_delay_s: max wait for a batch to fill
+    :type max_delay_s: float
+    """
+
+    _worker_class = _Worker
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+            self, handler, workers, queue_size, policy, name, max_batch=1, max_delay_s=0
+    ) -> None:
+        if policy not in (POLICY_BLOCK, POLICY_DROP_OLDEST, POLICY_SHED):
+            raise ValueError(f"Unsupported dispatch policy {policy}")
+        self._handler = handler
+        self._queue_size = queue_size
+        self._policy = policy
+        self._name = name
+        self._max_batch = max(1, max_batch)
+        self._max_delay_s = max_delay_s
+        self._logger = logging.getLogger(__name__)
+        self._workers = [self._worker_class() for _ in range(max(1, workers))]
+        self._stopped = False
+        self._queue_depth = REGISTRY.gauge(f"{name}.queue_depth")
+        self._wait = REGISTRY.summary(f"{name}.wait_s")
+        self._dropped = REGISTRY.counter(f"{name}.dropped")
+        self._shed = REGISTRY.counter(f"{name}.shed")
+        self._errors = REGISTRY.counter(f"{name}.errors")
+        self._batch_size = REGISTRY.summary(f"{name}.batch_size")
+
+    def start(self):
+        """Start workers threads (not running ones only)."""
+        self._stopped = False
+        for index, worker in enumerate(self._workers):
+            if worker.thread is None or not worker.thread.is_alive():
+                worker.thread = threading.Thread(
+                    target=self._worker_impl,
+                    args=(worker,),
+                    name=f"{self._name}.{index}",
+                    daemon=True
+                )
+                worker.thread.start()
+
+    def stop(self):
+        """Stop workers once already queued items are handled."""
+        self._stopped = True
+        for worker in self._workers:
+            with worker.condition:
+                worker.items.append((0, _STOP))
+                worker.condition.notify_all()
+
+    def join(self, timeout=None):
+        """Wait for workers end.
+
+        :param timeout: max wait duration per worker in seconds
+        :type timeout: float
+        """
+        for worker in self._workers:
+            if worker.thread is not None:
+                worker.thread.join(timeout)
+
+    def submit(self, key, item):
+        """Queue an item.
+
+        :param key: routing key (items of a same key are handled in order)
+        :type key: str
+        :param item: item to handle
+        :return: False if item was shed
+        :rtype: bool
+        """
+        worker = self._workers[zlib.crc32(key.encode("utf-8")) % len(self._workers)]
+        with worker.condition:
+            if len(worker.items) >= self._queue_size and not self._stopped:
+                if self._policy == POLICY_SHED:
+                    self._shed.inc()
+                    return False
+                if self._policy == POLICY_DROP_OLDEST:
+                    worker.items.popleft()
+                    self._dropped.inc()
+                    self._queue_depth.dec()
+                else:
+                    worker.condition.wait_for(
+                        lambda: len(worker.items) < self._queue_size or self._stopped
+                    )
+            if self._stopped:
+                # Workers won't handle items queued after stop (the stop
+                # marker must not be dropped either)
+                self._shed.inc()
+                return False
+            worker.items.append((time.monotonic(), item))
+            self._queue_depth.inc()
+            worker.condition.notify_all()
+        return True
+
+    def _collect(self, worker):
+        """Pop next items of a worker queue (called holding its condition)."""
+        worker.condition.wait_for(lambda: worker.items)
+        batch = [worker.items.popleft()]
+        deadline = time.monotonic() + self._max_delay_s
+        while len(batch) < self._max_batch and batch[-1][1] is not _STOP:
+            if not worker.items:
+                timeout = deadline - time.monotonic()
+                # Room was made for blocked submitters
+                worker.condition.notify_all()
+                if timeout <= 0 or not worker.condition.wait_for(lambda: worker.items, timeout):
+                    break
+            batch.append(worker.items.popleft())
+        # Wake up blocked submitters
+        worker.condition.notify_all()
+        return batch
+
+    def _worker_impl(self, worker):
+        while True:
+            with worker.condition:
+                batch = self._collect(worker)
+            stop = batch[-1][1] is _STOP
+            if stop:
+                batch.pop()
+            if batch:
+                self._handle(batch)
+            if stop:
+                return
+
+    def _handle(self, batch):
+        self._queue_depth.dec(len(batch))
+        now = time.monotonic()
+        for queued_at, _ in batch:
+            self._wait.observe(now - queued_at)
+        try:
+            if self._max_batch > 1:
+                self._batch_size.observe(len(batch))
+                self._handler([item for _, item in batch])
+            else:
+                self._handler(batch[0][1])
+        except Exception:  # pylint: disable=broad-except
+            self._errors.inc()
+            self._logger.exception("Unable to handle %d items", len(batch))
+
+
+class _AsyncWorker:  # pylint: disable=too-few-public-methods
+    """Queue and task of an asyncio worker."""
+
+    def __init__(self):
+        self.ready = None
+        self.items = deque()
+        self.task = None
+
+
+class AsyncDispatchPool(DispatchPool):
+    """DispatchPool run by an event loop.
+
+    Workers are tasks of the loop and ``handler`` is a coroutine function.
+    All methods must be called from the loop. ``submit()`` can't wait for
+    room: with the ``block`` policy the item is queued anyway and ``pause``
+    is called (the producer must stop reading), then ``resume`` once all
+    queues have room again.
+
+    :param pause: called when a queue is full (block policy)
+    :type pause: callable
+    :param resume: called when all queues have room again
+    :type resume: callable
+    """
+
+    _worker_class = _AsyncWorker
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+            self, handler, workers, queue_size, policy, name, max_batch=1, max_delay_s=0,
+            pause=None, resume=None
+    ) -> None:
+        super().__init__(handler, workers, queue_size, policy, name, max_batch, max_delay_s)
+        self._pause = pause
+        self._resume = resume
+        self._paused = False
+
+    def start(self):
+        """Start workers tasks (not running ones only)."""
+        self._stopped = False
+        loop = asyncio.get_running_loop()
+        for index, worker in enumerate(self._workers):
+            if worker.task is None or worker.task.done():
+                worker.ready = asyncio.Event()
+                worker.task = loop.create_task(
+                    self._worker_impl(worker), name=f"{self._name}.{index}"
+                )
+
+    def stop(self):
+        """Stop workers once already queued items are handled."""
+        self._stopped = True
+        for worker in self._workers:
+            worker.items.append((0, _STOP))
+            if worker.ready is not None:
+                worker.ready.set()
+
+    async def join(self, timeout=None):  # pylint: disable=invalid-overridden-method
+        """Wait for workers end.
+
+        :param timeout: max wait duration in seconds
+        :type timeout: float
+        """
+        tasks = [worker.task for worker in self._workers if worker.task is not None]
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+
+    def submit(self, key, item):
+        """Queue an item.
+
+        :param key: routing key (items of a same key are handled in order)
+        :type key: str
+        :param item: item to handle
+        :return: False if item was shed
+        :rtype: bool
+        """
+        if self._stopped:
+            # Workers won't handle items queued after stop
+            self._shed.inc()
+            return False
+        worker = self._workers[zlib.crc32(key.encode("utf-8")) % len(self._workers)]
+        if len(worker.items) >= self._queue_size:
+            if self._policy == POLICY_SHED:
+                self._shed.inc()
+                return False
+            if self._policy == POLICY_DROP_OLDEST:
+                worker.items.popleft()
+                self._dropped.inc()
+                self._queue_depth.dec()
+            elif not self._paused:
+                self._paused = True
+                if self._pause is not None:
+                    self._pause()
+        worker.items.append((time.monotonic(), item))
+        self._queue_depth.inc()
+        if worker.ready is not None:
+            worker.ready.set()
+        return True
+
+    async def _wait_items(self, worker, timeout=None):
+        """Wait for queued items.
+
+        :return: False on timeout
+        :rtype: bool
+        """
+        while not worker.items:
+            worker.ready.clear()
+            try:
+                await asyncio.wait_for(worker.ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    async def _collect(self, worker):  # pylint: disable=invalid-overridden-method
+        """Pop next items of a worker queue."""
+        await self._wait_items(worker)
+        batch = [worker.items.popleft()]
+        deadline = time.monotonic() + self._max_delay_s
+        while len(batch) < self._max_batch and batch[-1][1] is not _STOP:
+            if not worker.items:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0 or not await self._wait_items(worker, timeout):
+                    break
+            batch.append(worker.items.popleft())
+        if self._paused and all(len(w.items) < self._queue_size for w in self._workers):
+            self._paused = False
+            if self._resume is not None:
+                self._resume()
+        return batch
+
+    async def _worker_impl(self, worker):  # pylint: disable=invalid-overridden-method
+        while True:
+            batch = await self._collect(worker)
+            stop = batch[-1][1] is _STOP
+            if stop:
+                batch.pop()
+            if batch:
+                await self._handle(batch)
+            if stop:
+                return
+
+    async def _handle(self, batch):  # pylint: disable=invalid-overridden-method
+        self._queue_depth.dec(len(batch))
+        now = time.monotonic()
+        for queued_at, _ in batch:
+            self._wait.observe(now - queued_at)
+        try:
+            if self._max_batch > 1:
+                self._batch_size.observe(len(batch))
+                await self._handler([item for _, item in batch])
+            else:
+                await self._handler(batch[0][1])
+        except Exception:  # pylint: disable=broad-except
+            self._errors.inc()
+            self._logger.exception("Unable to handle %d items", len(batch))
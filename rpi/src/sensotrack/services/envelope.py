@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""Binary envelope of sensors readings batches.
+
+Connectors may publish many readings per MQTT message on
+``BATCH_TOPIC/<connector>``. Version 1 layout (little endian, varints
+are LEB128, signed ones zigzag encoded)::
+
+    magic "STB" | version (u8) | base ts (f64) | first sequence (u32)
+    sensors count (varint) | records count (varint)
+    sensors table: sid length (varint) | sid (UTF-8)      (repeated)
+    records: sensor index (varint) | ts - base ts in µs (signed varint)
+             | type (u8) | value
+
+Records sequences follow the first one. A value of type 0 to 127 is a
+decimal number with that many digits after the point (mantissa as a
+signed varint), type 255 a UTF-8 string (varint length). Decimal numbers
+are used only if they render back to the original text, so decoded
+values are the exact text sent by the device.
+"""
+import re
+import struct
+import time
+
+MAGIC = b"STB"
+VERSION = 1
+
+MAX_SCALE = 127
+TYPE_STRING = 255
+
+_HEADER = struct.Struct("<3sBdI")
+_DECIMAL = re.compile(r"^-?(0|[1-9][0-9]*)(\.[0-9]+)?$")
+
+
+def _put_varint(out, number):
+    while number >= 0x80:
+        out.append((number & 0x7F) | 0x80)
+        number >>= 7
+    out.append(number)
+
+
+def _put_signed(out, number):
+    _put_varint(out, number * 2 if number >= 0 else -number * 2 - 1)
+
+
+def _get_varint(payload, offset):
+    number = 0
+    shift = 0
+    while True:
+        byte = payload[offset]
+        offset += 1
+        number |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return number, offset
+        shift += 7
+
+
+def _get_signed(payload, offset):
+    number, offset = _get_varint(payload, offset)
+    return (number >> 1) if not number & 1 else -(number >> 1) - 1, offset
+
+
+def _put_value(out, value):
+    text = str(value)
+    if _DECIMAL.match(text):
+        integer, _, fraction = text.partition(".")
+        mantissa = int(integer + fraction)
+        # Negative zeros would be decoded without sign
+        if len(fraction) <= MAX_SCALE and (mantissa or not text.startswith("-")):
+            out.append(len(fraction))
+            _put_signed(out, mantissa)
+            return
+    data = text.encode("utf-8")
+    out.append(TYPE_STRING)
+    _put_varint(out, len(data))
+    out += data
+
+
+def _get_value(payload, offset):
+    value_type = payload[offset]
+    offset += 1
+    if value_type == TYPE_STRING:
+        length, offset = _get_varint(payload, offset)
+        if offset + length > len(payload):
+            raise ValueError("Truncated envelope")
+        return payload[offset:offset + length].decode("utf-8"), offset + length
+    if value_type > MAX_SCALE:
+        raise ValueError(f"Unsupported value type {value_type}")
+    mantissa, offset = _get_signed(payload, offset)
+    digits = str(abs(mantissa)).rjust(value_type + 1, "0")
+    sign = "-" if mantissa < 0 else ""
+    if value_type:
+        return f"{sign}{digits[:-value_type]}.{digits[-value_type:]}", offset
+    return f"{sign}{digits}", offset
+
+
+def encode(records):
+    """Encode readings in an envelope.
+
+    :param records: (sensor id, epoch timestamp, sequence, value) list,
+        sequences must follow each other
+    :type records: list[tuple]
+    :rtype: bytes
+    :raises ValueError: empty or not consecutive records
+    """
+    if not records:
+        raise ValueError("Envelope can't be empty")
+    base_ts = records[0][1]
+    first_seq = records[0][2]
+    sids = {}
+    body = bytearray()
+    for index, (sid, ts, seq, value) in enumerate(records):
+        if seq != (first_seq + index) & 0xFFFFFFFF:
+            raise ValueError("Envelope records sequences must follow each other")
+        _put_varint(body, sids.setdefault(sid, len(sids)))
+        _put_signed(body, round((ts - base_ts) * 1000000))
+        _put_value(body, value)
+    out = bytearray(_HEADER.pack(MAGIC, VERSION, base_ts, first_seq & 0xFFFFFFFF))
+    _put_varint(out, len(sids))
+    _put_varint(out, len(records))
+    for sid in sids:
+        key = sid.encode("utf-8")
+        _put_varint(out, len(key))
+        out += key
+    return bytes(out + body)
+
+
+def decode(payload):
+    """Decode an envelope.
+
+    :param payload: envelope
+    :type payload: bytes
+    :return: (sensor id, epoch timestamp, sequence, value text) list
+    :rtype: list[tuple]
+    :raises ValueError: not a supported envelope
+    """
+    try:
+        magic, version, base_ts, first_seq = _HEADER.unpack_from(payload, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a readings envelope")
+        if version != VERSION:
+            raise ValueError(f"Unsupported envelope version {version}")
+        sid_count, offset = _get_varint(payload, _HEADER.size)
+        count, offset = _get_varint(payload, offset)
+        sids = []
+        for _ in range(sid_count):
+            length, offset = _get_varint(payload, offset)
+            if offset + length > len(payload):
+                raise ValueError("Truncated envelope")
+            sids.append(payload[offset:offset + length].decode("utf-8"))
+            offset += length
+        records = []
+        for index in range(count):
+            sid_index, offset = _get_varint(payload, offset)
+            delta, offset = _get_signed(payload, offset)
+            value, offset = _get_value(payload, offset)
+            records.append((
+                sids[sid_index],
+                base_ts + delta / 1000000,
+                (first_seq + index) & 0xFFFFFFFF,
+                value
+            ))
+    except (struct.error, IndexError, UnicodeDecodeError) as exc:
+        raise ValueError("Malformed envelope") from exc
+    return records
+
+
+class BatchWindow:
+    """Readings waiting to be sent in an envelope.
+
+    The window is due when it holds ``max_records`` readings, about
+    ``max_bytes`` of envelope, or when its oldest reading waited
+    ``max_delay_s``. Readings are numbered in sequence (per window
+    owner) so that receivers can detect losses: ``published()`` must be
+    called with the taken records once sent, readings of envelopes not
+    sent (e.g. spooled) don't consume sequences.
+
+    :param max_records: max number of readings per envelope
+    :type max_records: int
+    :param max_bytes: envelope size target
+    :type max_bytes: int
+    :param max_delay_s: max wait of a reading before sending
+    :type max_delay_s: float
+    """
+
+    def __init__(self, max_records, max_bytes, max_delay_s) -> None:
+        self._max_records = max_records
+        self._max_bytes = max_bytes
+        self._max_delay_s = max_delay_s
+        self._records = []
+        self._size = _HEADER.size
+        self._opened_at = None
+        self._seq = 0
+
+    def __len__(self):
+        return len(self._records)
+
+    def add(self, sid, ts, value):
+        """Add a reading.
+
+        :param sid: sensor identifier
+        :type sid: str
+        :param ts: measurement epoch timestamp
+        :type ts: float
+        :param value: sensor value
+        :type value: str
+        """
+        if not self._records:
+            self._opened_at = time.monotonic()
+        self._records.append((sid, ts, value))
+        # Estimate: sensor id in table and record
+        self._size += 2 * len(sid) + len(str(value)) + 16
+
+    def due(self):
+        """Tell if window must be sent.
+
+        :rtype: bool
+        """
+        return bool(self._records) and (
+            len(self._records) >= self._max_records
+            or self._size >= self._max_bytes
+            or time.monotonic() - self._opened_at >= self._max_delay_s
+        )
+
+    def take(self):
+        """Empty the window.
+
+        :return: (sensor id, epoch timestamp, sequence, value) list,
+            numbered from the next unpublished sequence
+        :rtype: list[tuple]
+        """
+        records = [
+            (sid, ts, (self._seq + index) & 0xFFFFFFFF, value)
+            for index, (sid, ts, value) in enumerate(self._records)
+        ]
+        self._records = []
+        self._size = _HEADER.size
+        return records
+
+    def published(self, records):
+        """Consume the sequences of sent records.
+
+        :param records: records returned by ``take()``
+        :type records: list[tuple]
+        """
+        if records:
+            self._seq = (records[-1][2] + 1) & 0xFFFFFFFF
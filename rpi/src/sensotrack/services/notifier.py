@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""In process notification of sensors new values."""
+import asyncio
+import threading
+
+from sensotrack.utils.metrics import REGISTRY
+
+
+class _Slot:  # pylint: disable=too-few-public-methods
+    """Waiters state of a sensor."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.version = 0
+        self.value = None
+        self.watchers = 0
+        # (loop, future) of asyncio waiters
+        self.futures = []
+
+
+class Watch:
+    """Subscription to a sensor new values (see ValueNotifier.watch())."""
+
+    def __init__(self, notifier, sid, slot) -> None:
+        self._notifier = notifier
+        self._sid = sid
+        self._slot = slot
+        with slot.condition:
+            self._version = slot.version
+
+    def wait(self, timeout=None):
+        """Wait for a value newer than the subscription.
+
+        :param timeout: max wait duration in seconds, None to wait forever
+        :type timeout: float
+        :return: sensor data or None on timeout
+        :rtype: dict
+        """
+        slot = self._slot
+        with slot.condition:
+            if slot.condition.wait_for(lambda: slot.version > self._version, timeout):
+                return slot.value
+        return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._notifier.release(self._sid, self._slot)
+
+
+class AsyncWatch(Watch):
+    """Subscription to a sensor new values for asyncio tasks.
+
+    Same as Watch but ``wait()`` is a coroutine (see ValueNotifier.watch_async()).
+    """
+
+    def __init__(self, notifier, sid, slot) -> None:  # pylint: disable=super-init-not-called
+        loop = asyncio.get_running_loop()
+        self._notifier = notifier
+        self._sid = sid
+        self._slot = slot
+        self._future = loop.create_future()
+        # Registered with the version so that no value is missed in between
+        with slot.condition:
+            self._version = slot.version
+            slot.futures.append((loop, self._future))
+
+    async def wait(self, timeout=None):  # pylint: disable=invalid-overridden-method
+        """Wait for a value newer than the subscription.
+
+        :param timeout: max wait duration in seconds, None to wait forever
+        :type timeout: float
+        :return: sensor data or None on timeout
+        :rtype: dict
+        """
+        try:
+            return await asyncio.wait_for(asyncio.shield(self._future), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        with self._slot.condition:
+            self._slot.futures = [
+                item for item in self._slot.futures if item[1] is not self._future
+            ]
+        self._notifier.release(self._sid, self._slot)
+
+
+class ValueNotifier:
+    """Per sensor wake up of threads waiting for a new value.
+
+    Ingest calls ``notify()`` for each received value, it only costs a dict
+    lookup when nobody waits for the sensor. Waiters subscribe with
+    ``watch()`` *before* triggering or checking anything, so a value landing
+    in between can't be missed::
+
+        with ValueNotifier().watch(sid) as watch:
+            sensor = watch.wait(timeout)
+    """
+
+    # Waiters are shared by all instances of the process
+    _lock = threading.Lock()
+    _slots = {}
+
+    def __init__(self) -> None:
+        self._waiters = REGISTRY.gauge("notifier.waiters")
+
+    def watch(self, sid):
+        """Subscribe to a sensor new values.
+
+        :param sid: sensor identifier
+        :type sid: str
+        :rtype: Watch
+        """
+        with self._lock:
+            slot = self._slots.get(sid)
+            if slot is None:
+                slot = self._slots[sid] = _Slot()
+            slot.watchers += 1
+            self._waiters.inc()
+        return Watch(self, sid, slot)
+
+    def watch_async(self, sid):
+        """Subscribe to a sensor new values from an asyncio task::
+
+            async with ValueNotifier().watch_async(sid) as watch:
+                sensor = await watch.wait(timeout)
+
+        :param sid: sensor identifier
+        :type sid: str
+        :rtype: AsyncWatch
+        """
+        with self._lock:
+            slot = self._slots.get(sid)
+            if slot is None:
+                slot = self._slots[sid] = _Slot()
+            slot.watchers += 1
+            self._waiters.inc()
+        return AsyncWatch(self, sid, slot)
+
+    def release(self, sid, slot):
+        """End a subscription (called on Watch exit).
+
+        :param sid: sensor identifier
+        :type sid: str
+        :param slot: subscription slot
+        :type slot: _Slot
+        """
+        with self._lock:
+            slot.watchers -= 1
+            self._waiters.dec()
+            if slot.watchers == 0 and self._slots.get(sid) is slot:
+                del self._slots[sid]
+
+    def waiters(self, sid):
+        """Get the number of subscriptions to a sensor.
+
+        :param sid: sensor identifier
+        :type sid: str
+        :rtype: int
+        """
+        with self._lock:
+            slot = self._slots.get(sid)
+            return slot.watchers if slot else 0
+
+    def notify(self, sid, sensor):
+        """Wake up threads waiting for a sensor.
+
+        :param sid: sensor identifier
+        :type sid: str
+        :param sensor: new sensor data
+        :type sensor: dict
+        """
+        slot = self._slots.get(sid)
+        if slot is None:
+            return
+        with slot.condition:
+            slot.version += 1
+            slot.value = sensor
+            slot.condition.notify_all()
+            futures, slot.futures = slot.futures, []
+        for loop, future in futures:
+            loop.call_soon_threadsafe(_set_result, future, sensor)
+
+
+def _set_result(future, value):
+    if not future.done():
+        future.set_result(value)
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""Shared MQTT publisher."""
+import logging
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+from sensotrack import settings
+from sensotrack.utils.exceptions import STException
+from sensotrack.utils.metrics import REGISTRY
+
+# Topic of commands batches, a JSON list of {"sid": ..., "command": ...}
+COMMANDS_BATCH_TOPIC = "sensors/commands"
+
+class MQTTPublisher:
+    """Long lived MQTT connection shared by all publishing threads.
+
+    The connection is opened on first publish, then a background network
+    loop sends queued messages and reconnects automatically. Outbound queue
+    is bounded by ``mqtt.publisher.max_queued``.
+
+    With ``mqtt.publisher.qos`` 1 messages are kept until acknowledged by
+    the broker (even across reconnections) and, if ``mqtt.publisher.wait_s``
+    is set, ``publish()`` waits for the acknowledgement. With QoS 0,
+    messages not sent before a connection loss are counted as errors.
+    """
+
+    # Publishers are shared by all threads of the process
+    _lock = threading.Lock()
+    _publishers = {}
+
+    def __init__(self, conf) -> None:
+        self._conf = conf
+        self._logger = logging.getLogger(__name__)
+        publisher_conf = conf["mqtt"].get("publisher", settings.mqtt_publisher)
+        self._qos = publisher_conf.get("qos", settings.mqtt_publisher["qos"])
+        self._max_queued = publisher_conf.get(
+            "max_queued", settings.mqtt_publisher["max_queued"]
+        )
+        self._wait_s = publisher_conf.get("wait_s", settings.mqtt_publisher["wait_s"])
+        self._client = None
+        self._client_lock = threading.Lock()
+        # Publish start time by message id, until publish is complete
+        self._in_flight = {}
+        # Messages completed before publish() returned
+        self._completed = set()
+        self._in_flight_lock = threading.Lock()
+        self._latency = REGISTRY.summary("mqtt.publisher.latency_s")
+        self._queue_depth = REGISTRY.gauge("mqtt.publisher.queue_depth")
+        self._errors = REGISTRY.counter("mqtt.publisher.errors")
+
+    @classmethod
+    def get(cls, conf):
+        """Get the process publisher for the configured broker.
+
+        :param conf: runtime configuration
+        :type conf: dict
+        :rtype: MQTTPublisher
+        """
+        key = (conf["mqtt"]["host"], conf["mqtt"]["port"])
+        with cls._lock:
+            if key not in cls._publishers:
+                cls._publishers[key] = cls(conf)
+            return cls._publishers[key]
+
+    @classmethod
+    def reset(cls):
+        """Close all publishers."""
+        with cls._lock:
+            for publisher in cls._publishers.values():
+                publisher.close()
+            cls._publishers.clear()
+
+    def _on_publish(self, client, userdata, mid):  # pylint: disable=unused-argument
+        with self._in_flight_lock:
+            start = self._in_flight.pop(mid, None)
+            if start is None:
+                self._completed.add(mid)
+            self._queue_depth.set(len(self._in_flight))
+        if start is not None:
+            self._latency.observe(time.monotonic() - start)
+
+    def _on_disconnect(self, client, userdata, return_code):  # pylint: disable=unused-argument
+        if self._qos == 0:
+            # Unsent QoS 0 messages are discarded by paho on reconnection
+            with self._in_flight_lock:
+                self._errors.inc(len(self._in_flight))
+                self._in_flight.clear()
+                self._completed.clear()
+                self._queue_depth.set(0)
+
+    def _on_connect(self, client, userdata, flags, return_code):  # pylint: disable=unused-argument
+        self._logger.info("Publisher connected to MQTT server with result code %s", return_code)
+
+    def _get_client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    client = mqtt.Client(
+                        "mqttPublisher." + str(time.time()),
+                        True
+                    )
+                    client.max_queued_messages_set(self._max_queued)
+                    client.on_publish = self._on_publish
+                    client.on_connect = self._on_connect
+                    client.on_disconnect = self._on_disconnect
+                    self._logger.info(
+                        "Connecting publisher to MQTT bus at %s", self._conf["mqtt"]["host"]
+                    )
+                    try:
+                        client.connect(
+                            self._conf["mqtt"]["host"],
+                            self._conf["mqtt"]["port"],
+                            60
+                        )
+                    except OSError as exc:
+                        self._errors.inc()
+                        raise STException("MQTT bus is unavailable", 503) from exc
+                    # Network loop thread also handles reconnections
+                    client.loop_start()
+                    self._client = client
+        return self._client
+
+    def publish(self, topic, payload):
+        """Publish a message.
+
+        :param topic: MQTT topic
+        :type topic: str
+        :param payload: message
+        :type payload: str
+        :raises STException: (503) if message can't be queued or (504) if
+            it was not acknowledged in time.
+        """
+        client = self._get_client()
+        start = time.monotonic()
+        # Not locked: paho calls on_publish() holding its own locks
+        info = client.publish(topic, payload, self._qos)
+        with self._in_flight_lock:
+            if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                # Dropped by paho, won't be completed
+                self._in_flight.pop(info.mid, None)
+                self._completed.discard(info.mid)
+            elif info.mid in self._completed:
+                self._completed.discard(info.mid)
+                self._latency.observe(time.monotonic() - start)
+            else:
+                self._in_flight[info.mid] = start
+            self._queue_depth.set(len(self._in_flight))
+        if info.rc == mqtt.MQTT_ERR_QUEUE_SIZE:
+            self._errors.inc()
+            raise STException("MQTT publish queue is full", 503)
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            self._errors.inc()
+            raise STException(f"Unable to publish to MQTT bus ({mqtt.error_string(info.rc)})", 503)
+        if self._qos and self._wait_s:
+            info.wait_for_publish(self._wait_s)
+            if not info.is_published():
+                raise STException("MQTT publish was not acknowledged", 504)
+
+    def close(self):
+        """Stop network loop and disconnect."""
+        with self._client_lock:
+            if self._client is not None:
+                self._client.disconnect()
+                self._client.loop_stop()
+                self._client = None
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""Data retention service."""
+import heapq
+import logging
+import threading
+
+from sensotrack import settings
+
+
+class RetentionIndex:
+    """Time bucketed index of items expiry dates.
+
+    Items are hashable keys scheduled at an expiry date. Keys are grouped in
+    buckets of ``granularity_s`` seconds, a min-heap of buckets gives the
+    next bucket to expire, so rescheduling a key is O(1) most of the time
+    and a sweep only looks at keys from expired buckets.
+    """
+
+    def __init__(self, granularity_s=60) -> None:
+        self._granularity_s = granularity_s
+        self._lock = threading.Lock()
+        self._expiry = {}
+        self._buckets = {}
+        self._heap = []
+
+    def schedule(self, key, expires_at, postpone_only=False):
+        """Set (or move) the expiry date of a key.
+
+        :param key: item key
+        :type key: hashable
+        :param expires_at: expiry epoch timestamp
+        :type expires_at: float
+        :param postpone_only: keep current expiry date if it's later
+        :type postpone_only: bool
+        """
+        bucket = int(expires_at // self._granularity_s)
+        with self._lock:
+            old = self._expiry.get(key)
+            if postpone_only and old is not None and old >= expires_at:
+                return
+            self._expiry[key] = expires_at
+            if old is not None:
+                old_bucket = int(old // self._granularity_s)
+                if old_bucket == bucket:
+                    return
+                keys = self._buckets.get(old_bucket)
+                if keys is not None:
+                    keys.discard(key)
+            keys = self._buckets.get(bucket)
+            if keys is None:
+                keys = self._buckets[bucket] = set()
+                heapq.heappush(self._heap, bucket)
+            keys.add(key)
+
+    def __contains__(self, key):
+        return key in self._expiry
+
+    def __len__(self):
+        return len(self._expiry)
+
+    def discard(self, key):
+        """Remove a key from index.
+
+        :param key: item key
+        :type key: hashable
+        """
+        with self._lock:
+            expires_at = self._expiry.pop(key, None)
+            if expires_at is not None:
+                keys = self._buckets.get(int(expires_at // self._granularity_s))
+                if keys is not None:
+                    keys.discard(key)
+
+    def pop_due(self, now):
+        """Remove and return expired keys.
+
+        :param now: current epoch timestamp
+        :type now: float
+        :return: (number of keys examined, expired keys)
+        :rtype: tuple
+        """
+        scanned = 0
+        due = []
+        with self._lock:
+            while self._heap and (self._heap[0] + 1) * self._granularity_s <= now:
+                bucket = heapq.heappop(self._heap)
+                for key in self._buckets.pop(bucket, ()):
+                    scanned += 1
+                    if self._expiry.get(key, now + 1) <= now:
+                        del self._expiry[key]
+                        due.append(key)
+        return scanned, due
+
+
+class RetentionPolicies:
+    """Retention periods of sensors according to ``dataCleaning`` configuration.
+
+    Example of configuration
+
+    .. code-block:: json
+
+        {
+            "dataCleaning": {
+                "retention_s": 86400,
+                "history_retention_s": 2592000,
+                "period": 3600,
+                "policies": [
+                    {"prefix": "tmp.", "retention_s": 3600, "history_retention_s": 86400},
+                    {"sensor": "door", "retention_s": 604800}
+                ]
+            }
+        }
+
+    ``retention_s`` is the time after which a silent sensor is removed,
+    ``history_retention_s`` the time history segments are kept. A sensor
+    policy takes precedence over prefix policies, the longest prefix wins.
+    """
+
+    def __init__(self, conf) -> None:
+        cleaning_conf = conf.get("dataCleaning", settings.data_cleaning)
+        self._default = (
+            cleaning_conf.get("retention_s", settings.data_cleaning["retention_s"]),
+            cleaning_conf.get(
+                "history_retention_s", settings.data_cleaning["history_retention_s"]
+            )
+        )
+        self._sensors = {}
+        self._prefixes = []
+        for policy in cleaning_conf.get("policies", []):
+            retention = (
+                policy.get("retention_s", self._default[0]),
+                policy.get("history_retention_s", self._default[1])
+            )
+            if "sensor" in policy:
+                self._sensors[policy["sensor"]] = retention
+            else:
+                self._prefixes.append((policy["prefix"], retention))
+        self._prefixes.sort(key=lambda item: len(item[0]), reverse=True)
+
+    def get(self, sid):
+        """Get retention periods of a sensor.
+
+        :param sid: sensor identifier
+        :type sid: str
+        :return: (sensor retention in seconds, history retention in seconds)
+        :rtype: tuple
+        """
+        retention = self._sensors.get(sid)
+        if retention is not None:
+            return retention
+        for prefix, retention in self._prefixes:
+            if sid.startswith(prefix):
+                return retention
+        return self._default
+
+
+class RetentionService:
+    """Track data expiry at write time.
+
+    Two kind of keys are indexed:
+
+    * ``("sensor", sid)`` expires when a sensor did not report for its
+      retention period, its last value and catalog entry are then removed,
+    * ``("segment", sid, start)`` expires when a history segment is older
+      than the history retention period, it's then dropped as a whole.
+    """
+
+    # Index is shared by all instances of the process
+    _index = RetentionIndex()
+
+    def __init__(self, conf) -> None:
+        self._conf = conf
+        self._logger = logging.getLogger(__name__)
+        self._policies = RetentionPolicies(conf)
+
+    @property
+    def index(self):
+        """Expiry index."""
+        return self._index
+
+    def touch_sensor(self, sid, ts):
+        """Account a reading of a sensor (older readings than the last one,
+        such as replayed ones, don't move expiry backwards).
+
+        :param sid: sensor identifier
+        :type sid: str
+        :param ts: reading epoch timestamp
+        :type ts: float
+        """
+        self._index.schedule(("sensor", sid), ts + self._policies.get(sid)[0], True)
+
+    def touch_segment(self, sid, start, segment_s):
+        """Account a history segment of a sensor (no-op if already known).
+
+        :param sid: sensor identifier
+        :type sid: str
+        :param start: segment start epoch timestamp
+        :type start: int
+        :param segment_s: segment duration
+        :type segment_s: int
+        """
+        key = ("segment", sid, start)
+        if key not in self._index:
+            self._index.schedule(key, start + segment_s + self._policies.get(sid)[1])
+
+    def forget_sensor(self, sid):
+        """Remove sensor from index (sensor was removed).
+
+        :param sid: sensor identifier
+        :type sid: str
+        """
+        self._index.discard(("sensor", sid))
+
+    def pop_due(self, now):
+        """Remove and return expired keys (see RetentionIndex.pop_due()).
+
+        :param now: current epoch timestamp
+        :type now: float
+        :return: (number of keys examined, expired keys)
+        :rtype: tuple
+        """
+        return self._index.pop_due(now)
+
+    @classmethod
+    def reset(cls):
+        """Drop index."""
+        cls._index = RetentionIndex()
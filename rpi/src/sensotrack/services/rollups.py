@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""Incremental rollups service."""
+import logging
+import math
+import re
+import threading
+import time
+
+from sensotrack import settings
+from sensotrack.dao.rollups import RollupDAO
+from sensotrack.utils.exceptions import STException
+from sensotrack.utils.metrics import REGISTRY
+
+_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_resolution(resolution):
+    """Convert a resolution like ``1m``, ``1h`` or ``1d`` to seconds.
+
+    :param resolution: resolution
+    :type resolution: str
+    :return: resolution in seconds
+    :rtype: int
+    """
+    match = re.fullmatch(r"(\d+)([smhd])", resolution or "")
+    if not match or int(match.group(1)) == 0:
+        raise STException(f"Invalid resolution {resolution}", 400)
+    return int(match.group(1)) * _UNITS[match.group(2)]
+
+
+def _combine(cur, bucket):
+    return [
+        min(cur[0], bucket[0]), max(cur[1], bucket[1]),
+        cur[2] + bucket[2], cur[3] + bucket[3]
+    ]
+
+
+class RollupService:
+    """Per sensor min/max/sum/count buckets maintained at ingest time.
+
+    New values update in memory buckets deltas, a flusher thread merges
+    them to storage every ``rollups.flush_period`` seconds.
+    """
+
+    # Unflushed deltas are shared by all instances of the process
+    _lock = threading.Lock()
+    _pending = {}
+    # Deltas being merged to storage, still visible to queries until commited
+    _flushing = {}
+    # Serializes storage merges with queries storage reads
+    _flush_lock = threading.Lock()
+
+    def __init__(self, conf) -> None:
+        self._conf = conf
+        self._logger = logging.getLogger(__name__)
+        rollups_conf = conf.get("rollups", settings.rollups)
+        self._resolutions = {
+            name: parse_resolution(name)
+            for name in rollups_conf.get("resolutions", settings.rollups["resolutions"])
+        }
+        self._flush_period = rollups_conf.get(
+            "flush_period", settings.rollups["flush_period"]
+        )
+        self._rollup_dao = RollupDAO(conf)
+        self._flush_duration = REGISTRY.summary("rollups.flush_duration_s")
+        self._flushed = REGISTRY.counter("rollups.flushed_buckets")
+
+    @staticmethod
+    def enabled(conf):
+        """Tell if rollups are enabled in configuration.
+
+        :param conf: runtime configuration
+        :type conf: dict
+        :rtype: bool
+        """
+        return conf.get("rollups", settings.rollups).get("enabled", False)
+
+    @property
+    def resolutions(self):
+        """Supported resolutions names."""
+        return list(self._resolutions)
+
+    def add(self, sid, ts, value):
+        """Account a new sensor value in all resolutions buckets.
+
+        :param sid: sensor identifier
+        :type sid: str
+        :param ts: measurement epoch timestamp
+        :type ts: float
+        :param value: sensor value (non numeric or non finite values are ignored)
+        :type value: str|float
+        """
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return
+        if not math.isfinite(value):
+            return
+        with self._lock:
+            for resolution in self._resolutions.values():
+                key = (sid, resolution, int(ts // resolution * resolution))
+                bucket = self._pending.get(key)
+                if bucket is None:
+                    self._pending[key] = [value, value, value, 1]
+                else:
+                    if value < bucket[0]:
+                        bucket[0] = value
+                    if value > bucket[1]:
+                        bucket[1] = value
+                    bucket[2] += value
+                    bucket[3] += 1
+
+    def flush(self):
+        """Merge in memory deltas to storage."""
+        with self._flush_lock:
+            with self._lock:
+                self._flushing.update(self._pending)
+                self._pending.clear()
+            if not self._flushing:
+                return
+            start = time.perf_counter()
+            try:
+                self._rollup_dao.merge(
+                    [key + tuple(bucket) for key, bucket in self._flushing.items()]
+                )
+            except Exception:  # pylint: disable=broad-except
+                self._logger.exception(
+                    "Unable to flush %d rollups buckets", len(self._flushing)
+                )
+                with self._lock:
+                    # Put back deltas for next flush
+                    for key, bucket in self._flushing.items():
+                        self._merge_pending(key, bucket)
+                    self._flushing.clear()
+                return
+            count = len(self._flushing)
+            with self._lock:
+                self._flushing.clear()
+        self._flushed.inc(count)
+        self._flush_duration.observe(time.perf_counter() - start)
+
+    def _merge_pending(self, key, bucket):
+        cur = self._pending.get(key)
+        self._pending[key] = list(bucket) if cur is None else _combine(cur, bucket)
+
+    def query(self, sid, resolution, from_ts=None, to_ts=None):
+        """Get sensor buckets in a time range.
+
+        :param sid: sensor identifier
+        :type sid: str
+        :param resolution: resolution name (e.g. ``1h``)
+        :type resolution: str
+        :param from_ts: range start epoch timestamp, None for no lower bound
+        :type from_ts: float
+        :param to_ts: range end epoch timestamp, None for no upper bound
+        :type to_ts: float
+        :return: list of (start, min, max, sum, count) sorted by start
+        :rtype: list[tuple]
+        """
+        if resolution not in self._resolutions:
+            raise STException(
+                f"Unsupported resolution {resolution}, use one of {self.resolutions}",
+                400
+            )
+        res_s = self._resolutions[resolution]
+        from_ts = from_ts if from_ts is not None else 0
+        to_ts = to_ts if to_ts is not None else float("inf")
+
+        with self._flush_lock:
+            buckets = {
+                row[0]: list(row[1:])
+                for row in self._rollup_dao.query(sid, res_s, from_ts, to_ts)
+            }
+            with self._lock:
+                for pending in (self._flushing, self._pending):
+                    for (p_sid, p_res, start), bucket in pending.items():
+                        if p_sid != sid or p_res != res_s \
+                            or start + res_s <= from_ts or start > to_ts:
+                            continue
+                        cur = buckets.get(start)
+                        buckets[start] = list(bucket) if cur is None else _combine(cur, bucket)
+        return [(start,) + tuple(buckets[start]) for start in sorted(buckets)]
+
+    def delete(self, sid, before_ts=None):
+        """Remove sensor buckets.
+
+        :param sid: sensor identifier
+        :type sid: str
+        :param before_ts: only remove buckets ended before this epoch timestamp
+        :type before_ts: float
+        """
+        with self._flush_lock:
+            with self._lock:
+                # Buckets being flushed must not be written back either
+                for pending in (self._pending, self._flushing):
+                    for key in [key for key in pending if key[0] == sid]:
+                        if before_ts is None or key[2] + key[1] <= before_ts:
+                            del pending[key]
+            self._rollup_dao.delete(sid, before_ts)
+
+    def _flusher_impl(self):
+        while True:
+            time.sleep(self._flush_period)
+            self.flush()
+
+    def start_flusher(self):
+        """Start rollups flusher thread."""
+        threading.Thread(
+            target=self._flusher_impl,
+            daemon=True
+        ).start()
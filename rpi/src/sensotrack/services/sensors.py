@@ -1,26 +1,43 @@
 # -*- coding: utf-8 -*-
 """Sensors service."""
+import asyncio
 import datetime
+import json
 import logging
-import os
+import sys
 import threading
 import time
 
-import paho.mqtt.client as mqtt
-
+from sensotrack import settings
 from sensotrack.dao import SensorDAO
+from sensotrack.dao.history import HistoryDAO, ts_to_iso
+from sensotrack.dao.ring import RingDAO
+from sensotrack.services.catalog import SensorCatalog
+from sensotrack.services.notifier import ValueNotifier
+from sensotrack.services.publisher import COMMANDS_BATCH_TOPIC, MQTTPublisher
+from sensotrack.services.retention import RetentionService
+from sensotrack.services.rollups import RollupService
+from sensotrack.utils.exceptions import STException
+from sensotrack.utils.metrics import REGISTRY
 
 class SensorService:
     """Sensor business implem."""
 
-    POLLING_PERIOD = 0.1
-    POLLING_COUNT = 50
+    # In flight measurement requests (sid -> trigger time) shared by all
+    # instances of the process
+    _flights_lock = threading.Lock()
+    _flights = {}
 
     def __init__(self, conf) -> None:
         self._conf = conf
         self._logger = logging.getLogger(__name__)
         self._sensor_dao = SensorDAO(conf)
-
+        self._history_dao = HistoryDAO(conf) if HistoryDAO.enabled(conf) else None
+        self._ring_dao = RingDAO(conf) if RingDAO.enabled(conf) else None
+        self._rollup_svc = RollupService(conf) if RollupService.enabled(conf) else None
+        self._catalog = SensorCatalog(conf)
+        self._retention = RetentionService(conf)
+        self._notifier = ValueNotifier()
 
     def get(self, sid):
         """Get a sensor by id
@@ -32,92 +49,494 @@ class SensorService:
         """
         return self._sensor_dao.get(sid)
 
-    def register_new_value(self, sid, value):
+    def get_rendered(self, sid):
+        """Get a sensor last value as a JSON document
+
+        :param sid: sensor id
+        :type sid: str
+        :return: JSON document if found None else.
+        :rtype: bytes
+        """
+        return self._sensor_dao.get_rendered(sid)
+
+    def search(  # pylint: disable=too-many-arguments
+            self, prefix=None, connector=None, stale_for=None, offset=0, limit=100
+        ):
+        """Search sensors in catalog.
+
+        :return: (matching sensors count, requested page of catalog entries)
+        :rtype: tuple
+        """
+        self._catalog.refresh()
+        total, entries = self._catalog.search(prefix, connector, stale_for, offset, limit)
+        for entry in entries:
+            entry["firstSeen"] = ts_to_iso(entry["firstSeen"])
+            if entry["lastSeen"] is not None:
+                entry["lastSeen"] = ts_to_iso(entry["lastSeen"])
+        return total, entries
+
+    def get_many(self, sids=None):
+        """Get sensors last values
+
+        :param sids: sensors ids, None for all sensors
+        :type sids: list[str]
+        :return: (found sensors data, ids of sensors without value)
+        :rtype: tuple
+        """
+        if sids is None:
+            sids = self._sensor_dao.list_ids()
+        found = self._sensor_dao.get_many(sids)
+        return (
+            [found[sid] for sid in sids if sid in found],
+            [sid for sid in sids if sid not in found]
+        )
+
+    def get_dates(self, sids=None):
+        """Get sensors last measurement dates (cheaper than values).
+
+        :param sids: sensors ids, None for all sensors
+        :type sids: list[str]
+        :return: epoch timestamp of last measurement by sensor id (sensors
+            without value are omitted)
+        :rtype: dict
+        """
+        if sids is None:
+            sids = self._sensor_dao.list_ids()
+        return {
+            sid: datetime.datetime.fromisoformat(date).timestamp()
+            for sid, date in self._sensor_dao.get_dates(sids).items()
+        }
+
+    def register_new_value(self, sid, value, measured_at=None):
         """Register a new value from a sensor.
 
         :param sid: Sensor idenfier
         :type sid: str
         :param value: sensor value
         :type value: float
+        :param measured_at: measurement epoch timestamp (None for now)
+        :type measured_at: float
+        :return: registered sensor data, None if the value is older than
+            the sensor last value (replayed reading)
+        :rtype: dict
         """
 
+        if measured_at is None:
+            now = datetime.datetime.utcnow().replace(
+                tzinfo=datetime.timezone.utc
+            )
+        else:
+            now = datetime.datetime.fromtimestamp(measured_at, datetime.timezone.utc)
         sensor = {
             "sensorId": sid,
             'value': value,
-            "measurementDate": datetime.datetime.utcnow().replace(
-                tzinfo=datetime.timezone.utc
-            ).isoformat()
+            "measurementDate": now.isoformat()
         }
-        self._sensor_dao.upsert(sensor)
+        now_ts = now.timestamp()
+        # Replayed readings don't replace a newer last value
+        latest = measured_at is None or now_ts >= self.get_dates([sid]).get(sid, now_ts)
+        if latest:
+            self._sensor_dao.upsert(sensor)
+        if self._history_dao:
+            self._history_dao.append(sid, now_ts, value)
+        self._record_reading(sid, now_ts, value)
+        return sensor if latest else None
 
-    def get_new_value(self, sid):
-        """Request a new measurement to sensor and return it
+    def register_new_values(self, readings):
+        """Register a batch of new values from sensors.
+
+        Values are persisted together, readings of a same sensor must be
+        in reception order.
+
+        :param readings: (sensor identifier, value[, measurement epoch
+            timestamp or None for now]) list
+        :type readings: list[tuple]
+        :return: registered sensors data which became sensors last values
+            (same order as readings, older replayed readings are omitted)
+        :rtype: list[dict]
+        """
+        sensors = []
+        timed = []
+        for sid, value, *measured_at in readings:
+            now_ts = measured_at[0] if measured_at and measured_at[0] is not None else time.time()
+            sensors.append({
+                "sensorId": sid,
+                "value": value,
+                "measurementDate": datetime.datetime.fromtimestamp(
+                    now_ts, datetime.timezone.utc
+                ).isoformat()
+            })
+            timed.append((sid, now_ts, value))
+        # Replayed readings don't replace a newer last value
+        newest = self.get_dates(list({
+            sid for sid, _, *measured_at in readings if measured_at and measured_at[0] is not None
+        }))
+        latest = []
+        for sensor, (sid, now_ts, _) in zip(sensors, timed):
+            if now_ts >= newest.get(sid, now_ts):
+                newest[sid] = now_ts
+                latest.append(sensor)
+        self._sensor_dao.upsert_many(latest)
+        if self._history_dao:
+            self._history_dao.append_many(timed)
+        for sid, now_ts, value in timed:
+            self._record_reading(sid, now_ts, value)
+        return latest
+
+    def _record_reading(self, sid, now_ts, value):
+        """Account a persisted reading in secondary stores and indexes."""
+        if self._history_dao:
+            self._retention.touch_segment(
+                sid,
+                self._history_dao.segment_start(now_ts),
+                self._history_dao.segment_s
+            )
+        if self._ring_dao:
+            self._ring_dao.append(sid, now_ts, value)
+        if self._rollup_svc:
+            self._rollup_svc.add(sid, now_ts, value)
+        self._catalog.record_reading(sid, now_ts, value)
+        self._retention.touch_sensor(sid, now_ts)
+
+    def refresh_value(self, sensor):
+        """Take into account a value registered by the ingest process.
+
+        :param sensor: registered sensor data
+        :type sensor: dict
+        """
+        self._sensor_dao.refresh_cache(sensor)
+
+    def delete(self, sid):
+        """Remove a sensor and all its data.
 
         :param sid: Sensor identifier
         :type sid: str
-        :return: new sensor measurement
-        :rtype: str
         """
+        self._sensor_dao.delete(sid)
+        if self._history_dao:
+            self._history_dao.delete(sid)
+        if self._ring_dao:
+            self._ring_dao.delete(sid)
+        if self._rollup_svc:
+            self._rollup_svc.delete(sid)
+        self._catalog.remove(sid)
+        self._retention.forget_sensor(sid)
 
-        last = self._sensor_dao.get(sid)
-        if last:
-            last_ts = datetime.datetime.fromisoformat(last["measurementDate"])
-        else:
-            last_ts = 0
+    def expire(self, sid):
+        """Remove a sensor which did not report for its retention period.
 
-        count = 0
-        res = None
-        while not res and count < SensorService.POLLING_COUNT:
-            time.sleep(SensorService.POLLING_PERIOD)
-            last = self._sensor_dao.get(sid)
-            if last \
-                and datetime.datetime.fromisoformat(last["measurementDate"]) > last_ts:
-                res = last
-                break
+        The last value, recent values ring and catalog entry are removed,
+        history data expires with its own retention (see RetentionService).
 
-            count += 1
+        :param sid: Sensor identifier
+        :type sid: str
+        """
+        self._sensor_dao.delete(sid)
+        if self._ring_dao:
+            self._ring_dao.delete(sid)
+        self._catalog.remove(sid)
+        self._retention.forget_sensor(sid)
 
-        return res
+    def get_history(  # pylint: disable=too-many-arguments
+            self, sid, from_ts=None, to_ts=None, limit=1000, min_value=None, max_value=None
+        ):
+        """Get sensor values in a time range.
 
-    def send_command(self, sid, command):
-        """Send a command to a sensor."
+        :param sid: Sensor identifier
+        :type sid: str
+        :param from_ts: range start epoch timestamp, None for no lower bound
+        :type from_ts: float
+        :param to_ts: range end epoch timestamp, None for no upper bound
+        :type to_ts: float
+        :param limit: max number of values to return
+        :type limit: int
+        :param min_value: only return numeric values >= min_value
+        :type min_value: float
+        :param max_value: only return numeric values <= max_value
+        :type max_value: float
+        :return: sensor values sorted by measurement date, None if history is disabled
+        :rtype: list[dict]
+        """
+        if not self._history_dao:
+            return None
+        return [
+            {
+                "sensorId": sid,
+                "value": value,
+                "measurementDate": ts_to_iso(ts)
+            }
+            for ts, value in self._history_dao.query(
+                sid, from_ts, to_ts, limit, min_value, max_value
+            )
+        ]
 
+    def get_rollup(self, sid, resolution, from_ts=None, to_ts=None):
+        """Get sensor aggregated values in a time range.
 
-        :param sid: _description_
-        :type sid: _type_
-        :param command: _description_
-        :type command: _type_
+        :param sid: Sensor identifier
+        :type sid: str
+        :param resolution: buckets resolution name (e.g. ``1h``)
+        :type resolution: str
+        :param from_ts: range start epoch timestamp, None for no lower bound
+        :type from_ts: float
+        :param to_ts: range end epoch timestamp, None for no upper bound
+        :type to_ts: float
+        :return: buckets sorted by start date, None if rollups are disabled
+        :rtype: list[dict]
         """
+        if not self._rollup_svc:
+            return None
+        return [
+            {
+                "start": ts_to_iso(start),
+                "min": b_min,
+                "max": b_max,
+                "avg": b_sum / count,
+                "count": count
+            }
+            for start, b_min, b_max, b_sum, count in self._rollup_svc.query(
+                sid, resolution, from_ts, to_ts
+            )
+        ]
+
+    def get_window(self, sid, count):
+        """Get sensor last numeric values from its ring buffer.
 
-        mqtt_client = mqtt.Client(
-            "mqttPublisher." + str(time.time()),
-            False
+        :param sid: Sensor identifier
+        :type sid: str
+        :param count: max number of values to return
+        :type count: int
+        :return: sensor values sorted by measurement date, None if ring
+            storage is disabled or sensor has no ring
+        :rtype: list[dict]
+        """
+        if not self._ring_dao:
+            return None
+        window = self._ring_dao.window(sid, count)
+        if window is None:
+            return None
+        return [
+            {
+                "sensorId": sid,
+                "value": value,
+                "measurementDate": ts_to_iso(ts)
+            }
+            for ts, value in window
+        ]
+
+    def _new_value_timeout(self):
+        return self._conf.get("notifications", settings.notifications).get(
+            "timeout_s", settings.notifications["timeout_s"]
         )
-        mqtt_client.connect(
-            self._conf["mqtt"]["host"],
-            self._conf["mqtt"]["port"],
-            60
+
+    def _join_flight(self, sid):
+        """Join or start the measurement request of a sensor.
+
+        :return: True if caller is the leader and must trigger the measurement
+        :rtype: bool
+        """
+        requests = REGISTRY.counter("last.requests")
+        coalesced = REGISTRY.counter("last.coalesced")
+        requests.inc()
+        with self._flights_lock:
+            leader = sid not in self._flights
+            if leader:
+                self._flights[sid] = time.monotonic()
+        if not leader:
+            coalesced.inc()
+        REGISTRY.gauge("last.coalescing_ratio").set(
+            coalesced.value / requests.value
         )
-        mqtt_client.publish(
+        return leader
+
+    def _trigger_measurement(self, sid):
+        try:
+            self.send_command(sid, "")
+        except STException:
+            self._logger.warning("Unable to request a measurement to %s", sid)
+
+    @staticmethod
+    def _end_flight(leader, res, triggered_at):
+        if res is None:
+            REGISTRY.counter("notifier.timeouts").inc()
+        elif leader:
+            REGISTRY.summary("last.trigger_to_value_s").observe(
+                time.monotonic() - triggered_at
+            )
+
+    def get_new_value(self, sid):
+        """Request a new measurement to sensor and return it
+
+        Concurrent requests for the same sensor are coalesced: only the first
+        one publishes a measurement request, all of them get the next value.
+
+        :param sid: Sensor identifier
+        :type sid: str
+        :return: new sensor measurement, None if none was received before
+            ``notifications.timeout_s``
+        :rtype: dict
+        """
+        triggered_at = None
+        # Subscribe before triggering to not miss a fast answer
+        with self._notifier.watch(sid) as watch:
+            leader = self._join_flight(sid)
+            if leader:
+                self._trigger_measurement(sid)
+            try:
+                res = watch.wait(self._new_value_timeout())
+            finally:
+                if leader:
+                    with self._flights_lock:
+                        triggered_at = self._flights.pop(sid)
+        self._end_flight(leader, res, triggered_at)
+        return res
+
+    async def get_new_value_async(self, sid):
+        """Same as ``get_new_value()`` without blocking a thread while waiting.
+
+        The measurement request is published from the loop default executor.
+
+        :param sid: Sensor identifier
+        :type sid: str
+        :return: new sensor measurement, None if none was received before
+            ``notifications.timeout_s``
+        :rtype: dict
+        """
+        triggered_at = None
+        async with self._notifier.watch_async(sid) as watch:
+            leader = self._join_flight(sid)
+            try:
+                if leader:
+                    await asyncio.get_running_loop().run_in_executor(
+                        None, self._trigger_measurement, sid
+                    )
+                res = await watch.wait(self._new_value_timeout())
+            finally:
+                if leader:
+                    with self._flights_lock:
+                        triggered_at = self._flights.pop(sid)
+        self._end_flight(leader, res, triggered_at)
+        return res
+
+    def send_command(self, sid, command):
+        """Send a command to a sensor.
+
+        :param sid: Sensor identifier
+        :type sid: str
+        :param command: command to send (empty to request a measurement)
+        :type command: str
+        :raises STException: if command can't be published
+        """
+        MQTTPublisher.get(self._conf).publish(
             f"sensors/command/{sid}",
             command
         )
 
+    def select_sensors(self, prefix=None, connector=None):
+        """Get identifiers of catalog sensors matching a selector.
+
+        :param prefix: sensor id prefix
+        :type prefix: str
+        :param connector: owning connector class name
+        :type connector: str
+        :rtype: list[str]
+        """
+        self._catalog.refresh()
+        _, entries = self._catalog.search(prefix, connector, limit=sys.maxsize)
+        return [entry["sensorId"] for entry in entries]
+
+    def send_commands(self, commands):
+        """Send commands to several sensors in a single batch message.
+
+        Commands to sensors unknown to the catalog are not sent.
+
+        :param commands: (sensor identifier, command) list
+        :type commands: list[tuple]
+        :return: dispatch status by sensor (same order as commands):
+            ``dispatched``, ``not_found`` or ``failed``
+        :rtype: list[dict]
+        """
+        self._catalog.refresh()
+        known = [
+            (sid, command) for sid, command in commands
+            if self._catalog.get(sid) is not None
+        ]
+        status, message = "dispatched", None
+        if known:
+            try:
+                MQTTPublisher.get(self._conf).publish(
+                    COMMANDS_BATCH_TOPIC,
+                    json.dumps([{"sid": sid, "command": command} for sid, command in known])
+                )
+            except STException as exc:
+                status, message = "failed", str(exc)
+        known_ids = {sid for sid, _ in known}
+        return [
+            {"sensorId": sid, "status": status, "message": message}
+            if sid in known_ids else
+            {"sensorId": sid, "status": "not_found", "message": "Unknown sensor"}
+            for sid, _ in commands
+        ]
+
+    def _seed_retention(self):
+        # Index is maintained at write time, existing data is accounted once
+        # at startup from catalog (sensors without catalog entry are
+        # considered as seen now)
+        now = time.time()
+        known = set()
+        for entry in self._catalog.entries():
+            sid = entry["sensorId"]
+            known.add(sid)
+            self._retention.touch_sensor(sid, entry["lastSeen"] or entry["firstSeen"])
+            if self._history_dao:
+                for start in self._history_dao.segments(sid):
+                    self._retention.touch_segment(sid, start, self._history_dao.segment_s)
+        for sid in self._sensor_dao.list_ids():
+            if sid not in known:
+                self._retention.touch_sensor(sid, now)
+
+    def clean_data(self, now=None):
+        """Remove expired sensors and history segments.
+
+        Only items due according to the retention index are visited.
+
+        :param now: current epoch timestamp, None for current time
+        :type now: float
+        :return: (number of index entries scanned, number of removed sensors,
+            number of removed history segments)
+        :rtype: tuple
+        """
+        start = time.perf_counter()
+        scanned, due = self._retention.pop_due(time.time() if now is None else now)
+        sensors = 0
+        segments = 0
+        for key in due:
+            if key[0] == "sensor":
+                self.expire(key[1])
+                sensors += 1
+            elif self._history_dao:
+                _, sid, seg_start = key
+                segments += self._history_dao.drop_segments(
+                    sid, seg_start + self._history_dao.segment_s
+                )
+        REGISTRY.counter("retention.scanned").inc(scanned)
+        REGISTRY.counter("retention.removed_sensors").inc(sensors)
+        REGISTRY.counter("retention.removed_segments").inc(segments)
+        REGISTRY.summary("retention.sweep_duration_s").observe(
+            time.perf_counter() - start
+        )
+        return scanned, sensors, segments
+
     def _data_cleaner_impl(self):
+        self._seed_retention()
         while True:
-            self._logger.info("Data cleaning is starting....")
-            cur_ts = datetime.datetime.now().timestamp()
-            for fname in os.listdir(self._conf["datadir"]):
-                file_ts = os.path.getmtime(
-                    f'{self._conf["datadir"]}/{fname}'
-                )
-                if (cur_ts - file_ts) > self._conf["dataCleaning"]["retention_s"]:
-                    self._logger.debug(
-                        "Removing data file %s/%s",
-                        self._conf["datadir"],
-                        fname
-                    )
-                    os.remove(f'{self._conf["datadir"]}/{fname}')
+            start = time.perf_counter()
+            scanned, sensors, segments = self.clean_data()
+            self._logger.info(
+                "Data cleaning scanned %d entries, removed %d sensors "
+                "and %d history segments in %.3fs",
+                scanned, sensors, segments, time.perf_counter() - start
+            )
             time.sleep(self._conf["dataCleaning"]["period"])
 
     def start_data_cleaner(self):
@@ -126,3 +545,24 @@ class SensorService:
             target=self._data_cleaner_impl,
             daemon=True
         ).start()
+
+
+    def _compactor_impl(self):
+        archive_conf = self._conf["history"]["archive"]
+        while True:
+            self._logger.info("History compaction is starting....")
+            count = self._history_dao.compact_all(
+                datetime.datetime.now().timestamp() - archive_conf["grace_s"]
+            )
+            self._logger.info("History compaction archived %d segments", count)
+            time.sleep(archive_conf["period"])
+
+    def start_compactor(self):
+        """Start history compaction thread if history archive is enabled."""
+        if not self._history_dao \
+            or not self._conf["history"].get("archive", {}).get("enabled", False):
+            return
+        threading.Thread(
+            target=self._compactor_impl,
+            daemon=True
+        ).start()
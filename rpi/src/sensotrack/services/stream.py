@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""Live stream of sensors values (Server-Sent Events)."""
+import asyncio
+from collections import deque
+import itertools
+import json
+import threading
+
+from sensotrack import settings
+from sensotrack.utils.metrics import REGISTRY
+
+POLICY_DROP_OLDEST = "drop_oldest"
+POLICY_DISCONNECT = "disconnect"
+
+HEARTBEAT = b": heartbeat\n\n"
+
+
+class Subscription:
+    """A stream client with its own bounded buffer of events."""
+
+    def __init__(self, ids, prefix, buffer_size, policy) -> None:
+        self._ids = ids
+        self._prefix = prefix
+        self._buffer_size = buffer_size
+        self._policy = policy
+        self._condition = threading.Condition()
+        self._events = deque()
+        self.closed = False
+        self.dropped = 0
+
+    def matches(self, sid):
+        """Tell if subscription filters select a sensor.
+
+        :param sid: sensor identifier
+        :type sid: str
+        :rtype: bool
+        """
+        if self._ids is not None and sid in self._ids:
+            return True
+        if self._prefix is not None and sid.startswith(self._prefix):
+            return True
+        return self._ids is None and self._prefix is None
+
+    def push(self, event):
+        """Queue a serialized event (applying slow consumer policy).
+
+        :param event: serialized event
+        :type event: bytes
+        """
+        with self._condition:
+            if self.closed:
+                return
+            if len(self._events) >= self._buffer_size:
+                if self._policy == POLICY_DISCONNECT:
+                    self.closed = True
+                    self._condition.notify()
+                    return
+                self._events.popleft()
+                self.dropped += 1
+                REGISTRY.counter("stream.dropped").inc()
+            self._events.append(event)
+            self._condition.notify()
+
+    def next_events(self, timeout):
+        """Wait for queued events.
+
+        :param timeout: max wait duration in seconds
+        :type timeout: float
+        :return: serialized events (empty on timeout), None if subscription
+            was closed
+        :rtype: list[bytes]
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._events or self.closed, timeout)
+            if self.closed:
+                return None
+            events = list(self._events)
+            self._events.clear()
+        return events
+
+    def close(self):
+        """Close subscription (wakes up reader)."""
+        with self._condition:
+            self.closed = True
+            self._condition.notify()
+
+
+class AsyncSubscription(Subscription):
+    """A stream client read by an asyncio task.
+
+    Pushes come from ingest threads, the reader is woken up through its
+    event loop.
+    """
+
+    def __init__(self, ids, prefix, buffer_size, policy) -> None:
+        super().__init__(ids, prefix, buffer_size, policy)
+        self._loop = asyncio.get_running_loop()
+        self._ready = asyncio.Event()
+
+    def _wake_up(self):
+        try:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:
+            # Event loop is closed, nobody to wake up
+            pass
+
+    def push(self, event):
+        super().push(event)
+        self._wake_up()
+
+    def close(self):
+        super().close()
+        self._wake_up()
+
+    async def next_events(self, timeout):  # pylint: disable=invalid-overridden-method
+        """Wait for queued events.
+
+        :param timeout: max wait duration in seconds
+        :type timeout: float
+        :return: serialized events (empty on timeout), None if subscription
+            was closed
+        :rtype: list[bytes]
+        """
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        # Cleared before reading: a push after this point sets it again
+        self._ready.clear()
+        with self._condition:
+            if self.closed:
+                return None
+            events = list(self._events)
+            self._events.clear()
+        return events
+
+
+class StreamHub:
+    """Fan out of ingested values to stream subscribers.
+
+    Each value is serialized once as a SSE event and the same bytes are
+    queued to all matching subscriptions. Last events are kept in a replay
+    buffer so that reconnecting clients can resume from ``Last-Event-ID``.
+    """
+
+    # Subscriptions and replay buffer are shared by all instances of the process
+    _lock = threading.Lock()
+    _subscriptions = set()
+    _replay = deque()
+    _ids = itertools.count(1)
+
+    def __init__(self, conf) -> None:
+        stream_conf = conf.get("stream", settings.stream)
+        self._buffer_size = stream_conf.get("buffer_size", settings.stream["buffer_size"])
+        self._policy = stream_conf.get("policy", settings.stream["policy"])
+        self._replay_size = stream_conf.get("replay_size", settings.stream["replay_size"])
+        self.heartbeat_s = stream_conf.get("heartbeat_s", settings.stream["heartbeat_s"])
+        self._subscribers = REGISTRY.gauge("stream.subscribers")
+
+    def publish(self, sid, sensor):
+        """Send a new sensor value to subscribers.
+
+        :param sid: sensor identifier
+        :type sid: str
+        :param sensor: sensor data
+        :type sensor: dict
+        """
+        with self._lock:
+            if not self._subscriptions and not self._replay_size:
+                return
+            event_id = next(self._ids)
+            event = (
+                f"id: {event_id}\nevent: value\ndata: {json.dumps(sensor)}\n\n"
+            ).encode("utf-8")
+            self._replay.append((event_id, sid, event))
+            while len(self._replay) > self._replay_size:
+                self._replay.popleft()
+            subscriptions = [sub for sub in self._subscriptions if sub.matches(sid)]
+        for sub in subscriptions:
+            sub.push(event)
+
+    def subscribe(self, ids=None, prefix=None, last_event_id=None, asynchronous=False):
+        """Open a subscription.
+
+        :param ids: sensors identifiers, None for no filter on ids
+        :type ids: set[str]
+        :param prefix: sensors identifiers prefix, None for no filter on prefix
+        :type prefix: str
+        :param last_event_id: last event received by client, events from replay
+            buffer after this one are queued
+        :type last_event_id: int
+        :param asynchronous: subscription is read from an asyncio task (must
+            be called from the event loop)
+        :type asynchronous: bool
+        :rtype: Subscription
+        """
+        sub_class = AsyncSubscription if asynchronous else Subscription
+        sub = sub_class(ids, prefix, self._buffer_size, self._policy)
+        with self._lock:
+            if last_event_id is not None:
+                missed = [
+                    event for event_id, sid, event in self._replay
+                    if event_id > last_event_id and sub.matches(sid)
+                ]
+                for event in missed[-self._buffer_size:]:
+                    sub.push(event)
+            self._subscriptions.add(sub)
+            self._subscribers.set(len(self._subscriptions))
+        return sub
+
+    def unsubscribe(self, sub):
+        """Close a subscription.
+
+        :param sub: subscription
+        :type sub: Subscription
+        """
+        sub.close()
+        with self._lock:
+            self._subscriptions.discard(sub)
+            self._subscribers.set(len(self._subscriptions))
+
+    def events(self, sub):
+        """Generate stream bytes of a subscription until it's closed.
+
+        Heartbeat comments are sent when no event was sent for
+        ``heartbeat_s``.
+
+        :param sub: subscription
+        :type sub: Subscription
+        """
+        try:
+            # Send headers right away
+            yield HEARTBEAT
+            while True:
+                events = sub.next_events(self.heartbeat_s)
+                if events is None:
+                    break
+                yield b"".join(events) if events else HEARTBEAT
+        finally:
+            self.unsubscribe(sub)
+
+    async def events_async(self, sub):
+        """Same as ``events()`` for an ``AsyncSubscription``.
+
+        :param sub: subscription
+        :type sub: AsyncSubscription
+        """
+        try:
+            yield HEARTBEAT
+            while True:
+                events = await sub.next_events(self.heartbeat_s)
+                if events is None:
+                    break
+                yield b"".join(events) if events else HEARTBEAT
+        finally:
+            self.unsubscribe(sub)
+
+    @classmethod
+    def reset(cls):
+        """Close subscriptions and drop replay buffer."""
+        with cls._lock:
+            for sub in cls._subscriptions:
+                sub.close()
+            cls._subscriptions = set()
+            cls._replay = deque()
+            cls._ids = itertools.count(1)
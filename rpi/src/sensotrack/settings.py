@@ -40,9 +40,145 @@ CONFIG_FILES = {
     "log": "conf/logging.json"
 }
 
+# Process roles: "ingest" owns devices, bus reception and writes (exactly
+# one process), "api" serves the REST API (any number of workers)
+ROLE_INGEST = "ingest"
+ROLE_API = "api"
+ROLES_ENV = "SENSOTRACK_ROLES"
+roles = [ROLE_INGEST, ROLE_API]
+
+# Topic of values stored by ingest role, followed by sensor id
+INGESTED_TOPIC = "sensors/ingested"
+
+# Topic of readings envelopes published by connectors, followed by
+# connector name
+BATCH_TOPIC = "sensors/batch"
+
+# Topic of readings published late by connectors (JSON value and
+# measurementDate), followed by sensor id
+REPLAY_TOPIC = "sensors/replay"
+
 data_cleaning = {
     "retention_s": 86400,
-    "period": 3600
+    "history_retention_s": 2592000,
+    "period": 3600,
+    "policies": []
+}
+
+dao = {
+    "backend": "json",
+    "sqlite": {
+        "path": None,
+        "batch_size": 256,
+        "read_pool": 4
+    },
+    "writer": {
+        "enabled": False,
+        "flush_interval_s": 0.5,
+        "max_batch": 512,
+        "queue_size": 10000,
+        "fsync": True
+    },
+    "cache": {
+        "size": 1024,
+        "ttl_s": 60
+    },
+    # Last values table shared by ingest and API processes
+    "shm": {
+        "enabled": False,
+        "name": "sensotrack-last",
+        "slots": 4096,
+        "sid_max": 128,
+        "value_max": 512
+    }
+}
+
+history = {
+    "enabled": False,
+    "dir": None,
+    "segment_s": 3600,
+    "index_every": 64,
+    "archive": {
+        "enabled": False,
+        "period": 3600,
+        "grace_s": 60,
+        "block_size": 1024
+    }
+}
+
+ring = {
+    "enabled": False,
+    "dir": None,
+    "capacity": 86400
+}
+
+rollups = {
+    "enabled": False,
+    "path": None,
+    "resolutions": ["1m", "1h", "1d"],
+    "flush_period": 10
+}
+
+catalog = {
+    "path": None,
+    "snapshot_period": 60
+}
+
+notifications = {
+    "timeout_s": 5
+}
+
+stream = {
+    "buffer_size": 256,
+    "policy": "drop_oldest",
+    "heartbeat_s": 15,
+    "replay_size": 1024
+}
+
+http = {
+    "cache_control": "no-cache"
+}
+
+# MQTT clients implementation (mqtt.client): a network thread per client
+# or a single event loop shared by all clients of the process
+MQTT_CLIENT_THREADED = "threaded"
+MQTT_CLIENT_ASYNCIO = "asyncio"
+mqtt_client = MQTT_CLIENT_THREADED
+# Threads running values registration (storage writes) of asyncio receivers
+mqtt_executor_threads = 2
+
+# Received messages dispatch: per worker queue size, overflow policy
+# (block, drop_oldest or shed) and micro batching (max_batch 1 to disable)
+mqtt_dispatch = {
+    "queue_size": 1000,
+    "policy": "block",
+    "max_batch": 1,
+    "max_delay_s": 0.005
+}
+
+# Connectors readings sent in binary envelopes (see services.envelope) on
+# BATCH_TOPIC/<connector> when enabled: an envelope is sent when it holds
+# max_records readings, about max_bytes, or after max_delay_s
+mqtt_batch = {
+    "enabled": False,
+    "max_records": 256,
+    "max_bytes": 16384,
+    "max_delay_s": 0.05
+}
+
+# Connectors readings spooled to disk while the bus is unreachable, drained
+# at drain_rate readings/s once it's back
+spool = {
+    "enabled": False,
+    "segment_bytes": 1048576,
+    "max_bytes": 67108864,
+    "drain_rate": 200
+}
+
+mqtt_publisher = {
+    "qos": 0,
+    "max_queued": 1000,
+    "wait_s": 0
 }
 
 # Runtime configuration
@@ -0,0 +1,146 @@
+# -*- coding: UTF-8 -*-
+
+"""Process wide metrics registry.
+
+Counters, gauges and summaries are created on first use by name and
+shared by all modules, they are exposed by the metrics endpoint.
+"""
+
+# --------------------------------------------------------
+# Software Name : Sensor Track
+#
+# 2023 Orange
+#
+# -------------------------------------------------------
+#   Benoit HERARD <benoit.herard(at)orange.com>
+# -------------------------------------------------------
+import threading
+
+
+class Counter:
+    """Monotonic counter."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._value = 0
+
+    def inc(self, amount=1):
+        """Increment counter.
+
+        :param amount: increment value
+        :type amount: int
+        """
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        """Current counter value."""
+        return self._value
+
+    def snapshot(self):
+        """Return counter value for reporting."""
+        return self._value
+
+
+class Gauge:
+    """Value that can go up and down."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._value = 0
+
+    def set(self, value):
+        """Set gauge value."""
+        self._value = value
+
+    def inc(self, amount=1):
+        """Increment gauge."""
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        """Decrement gauge."""
+        with self._lock:
+            self._value -= amount
+
+    @property
+    def value(self):
+        """Current gauge value."""
+        return self._value
+
+    def snapshot(self):
+        """Return gauge value for reporting."""
+        return self._value
+
+
+class Summary:
+    """Count, sum and max of observed values (latencies, batch sizes...)."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._count = 0
+        self._sum = 0.0
+        self._max = 0.0
+
+    def observe(self, value):
+        """Record an observation.
+
+        :param value: observed value
+        :type value: float
+        """
+        with self._lock:
+            self._count += 1
+            self._sum += value
+            if value > self._max:
+                self._max = value
+
+    def snapshot(self):
+        """Return summary values for reporting."""
+        with self._lock:
+            return {
+                "count": self._count,
+                "sum": self._sum,
+                "avg": self._sum / self._count if self._count else 0.0,
+                "max": self._max
+            }
+
+
+class MetricsRegistry:
+    """Process wide registry of named metrics."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _get_or_create(self, name, klass):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = klass()
+                self._metrics[name] = metric
+            return metric
+
+    def counter(self, name):
+        """Get (or create) a counter by name."""
+        return self._get_or_create(name, Counter)
+
+    def gauge(self, name):
+        """Get (or create) a gauge by name."""
+        return self._get_or_create(name, Gauge)
+
+    def summary(self, name):
+        """Get (or create) a summary by name."""
+        return self._get_or_create(name, Summary)
+
+    def snapshot(self):
+        """Return all metrics values as a dict."""
+        with self._lock:
+            metrics = dict(self._metrics)
+        return {
+            name: metric.snapshot()
+            for name, metric in sorted(metrics.items())
+        }
+
+
+REGISTRY = MetricsRegistry()
@@ -40,6 +40,10 @@ setup(
             'requirements.txt'
         ).read().split("\n")
     ],
+    extras_require={
+        # ASGI serving mode (bin/webapi -mode asgi)
+        "asgi": ["uvicorn>=0.20"]
+    },
     include_package_data=True,
     scripts=['bin/{}'.format(x) for x in os.listdir('bin') if x != '__pycache__']
 
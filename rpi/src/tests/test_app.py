@@ -0,0 +1,49 @@
+import os
+import unittest
+
+import mock
+
+from sensotrack import app, settings
+
+
+@mock.patch("sensotrack.app.initialize_app")
+@mock.patch("sensotrack.app.SensorCatalog", mock.MagicMock())
+@mock.patch("sensotrack.app.SensorService", mock.MagicMock())
+@mock.patch("sensotrack.app.ConnectorsManager")
+@mock.patch("sensotrack.app.IngestedReceiver")
+@mock.patch("sensotrack.app.Receiver")
+class TestRoles(unittest.TestCase):
+    """Test process roles."""
+
+    def setUp(self) -> None:
+        self._conf = settings.conf
+
+    def tearDown(self) -> None:
+        settings.conf = self._conf
+
+    def test_all_roles(self, receiver_mock, ingested_mock, connectors_mock, init_mock):
+        """Test default single process."""
+        with mock.patch.dict(os.environ, {settings.ROLES_ENV: ""}):
+            app.load_config()
+        receiver_mock.assert_called_once_with(settings.conf, announce=False)
+        self.assertFalse(ingested_mock.called)
+        self.assertTrue(connectors_mock.return_value.start_connectors.called)
+        self.assertTrue(init_mock.called)
+
+    def test_api_role(self, receiver_mock, ingested_mock, connectors_mock, init_mock):
+        """Test API workers own no device and are fed by ingest process."""
+        with mock.patch.dict(os.environ, {settings.ROLES_ENV: "api"}):
+            app.load_config()
+        self.assertEqual(settings.conf["roles"], [settings.ROLE_API])
+        self.assertFalse(receiver_mock.called)
+        self.assertFalse(connectors_mock.called)
+        self.assertTrue(ingested_mock.return_value.start.called)
+        self.assertTrue(init_mock.called)
+
+    def test_ingest_role(self, receiver_mock, ingested_mock, connectors_mock, init_mock):
+        """Test ingest daemon announces values and serves no API."""
+        app.load_config([settings.ROLE_INGEST])
+        receiver_mock.assert_called_once_with(settings.conf, announce=True)
+        self.assertTrue(connectors_mock.return_value.start_connectors.called)
+        self.assertFalse(ingested_mock.called)
+        self.assertFalse(init_mock.called)
@@ -0,0 +1,120 @@
+import asyncio
+import json
+import threading
+import unittest
+
+from flask import Flask
+import mock
+
+from sensotrack import settings
+from sensotrack.asgi import AsgiApp
+from sensotrack.services.notifier import ValueNotifier
+from sensotrack.services.stream import StreamHub
+
+
+def _request(app, method, path, headers=None, query=b"", disconnect_after=None):
+    """Run a request on an ASGI app.
+
+    :return: status, headers, body chunks
+    """
+    sent = []
+    received = []
+
+    async def receive():
+        if not received:
+            received.append(True)
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # Client leaves after a while
+        await asyncio.sleep(disconnect_after if disconnect_after is not None else 3600)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "query_string": query,
+        "headers": [
+            (name.lower().encode(), value.encode()) for name, value in (headers or {}).items()
+        ]
+    }
+
+    asyncio.run(app(scope, receive, send))
+    return (
+        sent[0]["status"],
+        dict(sent[0]["headers"]),
+        [message["body"] for message in sent[1:] if message["body"]]
+    )
+
+
+class TestAsgiApp(unittest.TestCase):
+    """Test ASGI serving mode."""
+
+    def setUp(self) -> None:
+        StreamHub.reset()
+        flask_app = Flask(__name__)
+        flask_app.add_url_rule("/v1/hello", "hello", lambda: {"hello": "world"})
+        self._app = AsgiApp(flask_app)
+
+    @mock.patch("sensotrack.services.sensors.SensorService.send_command")
+    @mock.patch.dict(settings.conf, {"notifications": {"timeout_s": 5}})
+    def test_post_last(self, send_command_mock):
+        """Test POST /last is answered by the next notified value."""
+        sensor = {
+            "sensorId": "random-sensor",
+            "value": "69",
+            "measurementDate": "2123-10-03T05:27:40.464057+00:00"
+        }
+        send_command_mock.side_effect = lambda *_: threading.Timer(
+            0.05, ValueNotifier().notify, ("random-sensor", sensor)
+        ).start()
+
+        status, headers, body = _request(self._app, "POST", "/v1/sensors/random-sensor/last")
+        self.assertEqual(status, 200)
+        self.assertEqual(headers[b"content-type"], b"application/json")
+        self.assertEqual(json.loads(b"".join(body)), sensor)
+        send_command_mock.assert_called_once_with("random-sensor", "")
+
+    @mock.patch("sensotrack.services.sensors.SensorService.send_command", mock.MagicMock())
+    @mock.patch.dict(settings.conf, {"notifications": {"timeout_s": 0.05}})
+    def test_post_last_timeout(self):
+        """Test POST /last without new value."""
+        status, _, body = _request(self._app, "POST", "/v1/sensors/random-sensor/last")
+        self.assertEqual(status, 404)
+        self.assertEqual(json.loads(b"".join(body))["code"], 404)
+
+    def test_not_acceptable(self):
+        """Test content negociation of native routes."""
+        status, _, _ = _request(
+            self._app, "POST", "/v1/sensors/random-sensor/last", headers={"Accept": "text/xml"}
+        )
+        self.assertEqual(status, 406)
+
+    @mock.patch.dict(settings.conf, {"stream": {"heartbeat_s": 0.02}})
+    def test_stream(self):
+        """Test stream until client disconnection."""
+        hub = StreamHub(settings.conf)
+
+        def publish():
+            hub.publish("s1", {"sensorId": "s1", "value": "1"})
+            hub.publish("s2", {"sensorId": "s2", "value": "2"})
+
+        threading.Timer(0.05, publish).start()
+        status, headers, body = _request(
+            self._app, "GET", "/v1/sensors/stream", query=b"ids=s2", disconnect_after=0.2
+        )
+        self.assertEqual(status, 200)
+        self.assertEqual(headers[b"content-type"], b"text/event-stream")
+        events = [chunk for chunk in body if chunk.startswith(b"id:")]
+        self.assertEqual(len(events), 1)
+        self.assertIn(b'"s2"', events[0])
+        # Subscription was closed on disconnection
+        self.assertEqual(StreamHub._subscriptions, set())  # pylint: disable=protected-access
+
+    def test_wsgi(self):
+        """Test other routes are served by Flask."""
+        status, _, body = _request(self._app, "GET", "/v1/hello")
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(b"".join(body)), {"hello": "world"})
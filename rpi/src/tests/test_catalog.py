@@ -0,0 +1,88 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+
+import mock
+
+from sensotrack.dao import JSONFileStorage
+from sensotrack.services.catalog import SensorCatalog
+
+
+class TestSensorCatalog(unittest.TestCase):
+    """Test sensors catalog."""
+
+    def setUp(self) -> None:
+        SensorCatalog.reset()
+        self._tmp = tempfile.TemporaryDirectory()
+        self._conf = {"datadir": self._tmp.name}
+
+    def tearDown(self) -> None:
+        SensorCatalog.reset()
+        self._tmp.cleanup()
+
+    def test_search(self):
+        """Test filters and pagination."""
+        catalog = SensorCatalog(self._conf)
+        now = time.time()
+        for i in range(20):
+            catalog.record_reading(f"room1.t{i:02d}", now, "21.5")
+        catalog.record_reading("room2.t00", now - 3600, "open")
+        catalog.register("room2.t01", "my.Connector", "/dev/ttyX")
+
+        total, page = catalog.search(prefix="room1.", offset=5, limit=10)
+        self.assertEqual(total, 20)
+        self.assertEqual(page[0]["sensorId"], "room1.t05")
+        self.assertEqual(len(page), 10)
+        self.assertEqual(page[0]["valueType"], "number")
+
+        total, page = catalog.search(stale_for=60)
+        self.assertEqual([entry["sensorId"] for entry in page], ["room2.t00", "room2.t01"])
+
+        total, page = catalog.search(connector="my.Connector")
+        self.assertEqual(page[0]["device"], "/dev/ttyX")
+
+        catalog.remove("room2.t00")
+        self.assertEqual(catalog.search(prefix="room2")[0], 1)
+
+    def test_snapshot(self):
+        """Test catalog is reloaded from snapshot."""
+        catalog = SensorCatalog(self._conf)
+        catalog.record_reading("A", 10.0, "1")
+        catalog.record_reading("A", 20.0, "2")
+        catalog.snapshot()
+
+        SensorCatalog.reset()
+        entry = SensorCatalog(self._conf).get("A")
+        self.assertEqual(entry["readings"], 2)
+        self.assertEqual(entry["firstSeen"], 10.0)
+        self.assertEqual(entry["lastSeen"], 20.0)
+
+    def test_snapshot_not_a_sensor(self):
+        """Test snapshot is kept apart from sensors files."""
+        storage = JSONFileStorage(self._conf)
+        storage.upsert({"sensorId": "A", "value": "1", "measurementDate": "x"})
+        catalog = SensorCatalog(self._conf)
+        catalog.record_reading("A", 10.0, "1")
+        catalog.snapshot()
+        self.assertEqual(storage.list_ids(), ["A"])
+        SensorCatalog.reset()
+        self.assertIsNotNone(SensorCatalog(self._conf).get("A"))
+
+    def test_legacy_snapshot(self):
+        """Test snapshot saved in datadir is moved and ignored by storage."""
+        legacy = os.path.join(self._tmp.name, "catalog.json")
+        with open(legacy, "w", encoding="utf-8") as snapshot_file:
+            json.dump([{
+                "sensorId": "A", "connector": None, "device": None,
+                "firstSeen": 10.0, "lastSeen": 20.0, "readings": 2, "valueType": "number"
+            }], snapshot_file)
+        self.assertEqual(JSONFileStorage(self._conf).list_ids(), [])
+        self.assertEqual(SensorCatalog(self._conf).get("A")["readings"], 2)
+        self.assertFalse(os.path.exists(legacy))
+
+        # Not checked again by next instances
+        with mock.patch("sensotrack.services.catalog.os.path.exists") as exists_mock:
+            SensorCatalog(self._conf)
+        exists_mock.assert_not_called()
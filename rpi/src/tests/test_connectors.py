@@ -1,12 +1,18 @@
 
+import asyncio
+import datetime
+import json
 import logging
+import tempfile
 import time
 import unittest
 
 import mock
 import paho.mqtt.client as mqtt
 
-from sensotrack.services.connectors import ConnectorsManager, Connector
+from sensotrack.services.aiobus import BusLoop
+from sensotrack.services import envelope
+from sensotrack.services.connectors import AsyncCommandReceiver, ConnectorsManager, Connector
 
 class ConnectorBasicImpl(Connector):
     """Basic implementation for testing."""
@@ -79,6 +85,50 @@ class TestConnectorAbstract(unittest.TestCase):
         self.assertEqual(connector.last_command["command"], "my-command")
 
 
+    def test_receive_commands_batch(self):
+        """Test commands batch dispatch to supported sensors."""
+
+        conf = {
+            "mqtt": {
+                "host": "localhost",
+                "port": 1883
+            }
+        }
+        connector = ConnectorBasicImpl(conf)
+        msg = mqtt.MQTTMessage(topic=b"sensors/commands")
+        msg.payload = json.dumps([
+            {"sid": "X", "command": "ignored"},
+            {"sid": "B", "command": "my-command"}
+        ]).encode("utf-8")
+        connector._command_receiver.process_message(msg)  # pylint: disable=protected-access
+        self.assertEqual(connector.last_command, {"sid": "B", "command": "my-command"})
+
+    def test_asyncio_client(self):
+        """Test command receiver runs on the shared loop when configured."""
+
+        conf = {
+            "mqtt": {
+                "host": "localhost",
+                "port": 1883,
+                "client": "asyncio"
+            }
+        }
+        connector = ConnectorBasicImpl(conf)
+        self.assertIsInstance(
+            connector._command_receiver, AsyncCommandReceiver  # pylint: disable=protected-access
+        )
+        msg = mqtt.MQTTMessage(topic=b"sensors/command/A")
+        msg.payload = b"my-command"
+        asyncio.run(
+            connector._command_receiver.process_message(msg)  # pylint: disable=protected-access
+        )
+        self.assertEqual(connector.last_command, {"sid": "A", "command": "my-command"})
+        connector.start()
+        time.sleep(0.1)
+        connector.stop()
+        connector.join()
+        BusLoop.reset()
+
     @mock.patch("sensotrack.services.connectors.CommandReceiver.publish")
     def test_data_reception(self, publish_mock):
         """Test data reception form sensor."""
@@ -98,6 +148,118 @@ class TestConnectorAbstract(unittest.TestCase):
         self.assertEqual(publish_mock.call_args[0][1], 'my-data')
 
 
+    def test_spool(self):
+        """Test readings are spooled while bus is unreachable, then replayed."""
+
+        with tempfile.TemporaryDirectory() as datadir:
+            conf = {
+                "datadir": datadir,
+                "mqtt": {
+                    "host": "localhost",
+                    "port": 1883
+                },
+                "spool": {
+                    "enabled": True,
+                    "drain_rate": 1000
+                }
+            }
+            connector = ConnectorBasicImpl(conf)
+            publish = mock.MagicMock(return_value=False)
+            connector._command_receiver.publish = publish  # pylint: disable=protected-access
+            before = time.time()
+            connector._publish_data("A", "1")  # pylint: disable=protected-access
+            # Bus is back: order is kept
+            publish.return_value = True
+            connector._publish_data("B", "2")  # pylint: disable=protected-access
+            self.assertEqual(publish.call_count, 1)
+
+            publish.reset_mock()
+            # No live reading
+            connector.read_count = 1
+            connector.start()
+            time.sleep(0.1)
+            connector.stop()
+            connector.join()
+
+            replayed = [call for call in publish.call_args_list if call[1].get("qos") == 1]
+            self.assertEqual(
+                [call[0][0] for call in replayed], ["sensors/replay/A", "sensors/replay/B"]
+            )
+            reading = json.loads(replayed[0][0][1])
+            self.assertEqual(reading["value"], "1")
+            self.assertGreaterEqual(
+                datetime.datetime.fromisoformat(reading["measurementDate"]).timestamp(), before
+            )
+            # Spool is drained: live readings are published directly
+            connector._publish_data("C", "3")  # pylint: disable=protected-access
+            self.assertEqual(publish.call_args[0][0], "sensors/data/C")
+
+
+    def test_batch(self):
+        """Test readings are sent in envelopes."""
+
+        conf = {
+            "mqtt": {
+                "host": "localhost",
+                "port": 1883,
+                "batch": {
+                    "enabled": True,
+                    "max_records": 2,
+                    "max_delay_s": 0.05
+                }
+            }
+        }
+        connector = ConnectorBasicImpl(conf)
+        publish = mock.MagicMock(return_value=True)
+        connector._command_receiver.publish = publish  # pylint: disable=protected-access
+        before = time.time()
+        connector.start()
+        time.sleep(0.2)
+        connector.stop()
+        connector.join()
+
+        topic, payload = publish.call_args[0]
+        self.assertEqual(topic, "sensors/batch/connectorbasicimpl")
+        records = envelope.decode(payload)
+        self.assertEqual([(sid, value) for sid, _, _, value in records], [("A", "my-data")])
+        self.assertGreaterEqual(records[0][1], before)
+
+    def test_batch_spooled(self):
+        """Test spooled envelopes don't consume sequences."""
+
+        with tempfile.TemporaryDirectory() as datadir:
+            conf = {
+                "datadir": datadir,
+                "mqtt": {
+                    "host": "localhost",
+                    "port": 1883,
+                    "batch": {"enabled": True}
+                },
+                "spool": {"enabled": True}
+            }
+            connector = ConnectorBasicImpl(conf)
+            publish = mock.MagicMock(return_value=False)
+            connector._command_receiver.publish = publish  # pylint: disable=protected-access
+            window = connector._batch  # pylint: disable=protected-access
+            window.add("A", 1.0, "1")
+            window.add("B", 1.0, "2")
+            connector._publish_batch(window.take())  # pylint: disable=protected-access
+            self.assertEqual(len(connector._spool), 2)  # pylint: disable=protected-access
+
+            # Spool is drained
+            publish.return_value = True
+            spool = connector._spool  # pylint: disable=protected-access
+            spool.drain(lambda *_: True)
+            while len(spool):
+                spool._last_drain -= 1  # pylint: disable=protected-access
+                spool.drain(lambda *_: True)
+            window.add("A", 2.0, "3")
+            connector._publish_batch(window.take())  # pylint: disable=protected-access
+            records = envelope.decode(publish.call_args[0][1])
+            self.assertEqual([(value, seq) for _, _, seq, value in records], [("3", 0)])
+            spool.close()
+
+
 class TestsConnectorsManager(unittest.TestCase):
     """Test CommenctorManager."""
 
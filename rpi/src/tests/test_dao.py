@@ -0,0 +1,293 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+
+import mock
+from flask_restx import marshal
+
+from sensotrack.api.datamodel import SENSOR_VALUE
+from sensotrack.dao import SensorDAO, render_sensor
+from sensotrack.dao.cache import LastValueCache, reset_cache
+
+
+class TestLastValueCache(unittest.TestCase):
+    """Test last value cache."""
+
+    def test_hit_miss(self):
+        """Test hit and miss."""
+        cache = LastValueCache(10, 0)
+        self.assertIsNone(cache.get("A"))
+        cache.put("A", {"value": "1"})
+        self.assertEqual(cache.get("A")["value"], "1")
+        cache.invalidate("A")
+        self.assertIsNone(cache.get("A"))
+
+    def test_copies(self):
+        """Test callers can't modify cached values."""
+        cache = LastValueCache(10, 0)
+        value = {"value": "1"}
+        cache.put("A", value)
+        value["value"] = "2"
+        cache.get("A")["value"] = "3"
+        self.assertEqual(cache.get("A"), {"value": "1"})
+
+    def test_lru_eviction(self):
+        """Test size eviction."""
+        cache = LastValueCache(2, 0)
+        cache.put("A", 1)
+        cache.put("B", 2)
+        cache.get("A")
+        cache.put("C", 3)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get("B"))
+        self.assertEqual(cache.get("A"), 1)
+
+    def test_ttl_eviction(self):
+        """Test time eviction."""
+        cache = LastValueCache(10, 0.05)
+        cache.put("A", 1)
+        self.assertEqual(cache.get("A"), 1)
+        time.sleep(0.1)
+        self.assertIsNone(cache.get("A"))
+
+    def test_disabled(self):
+        """Test cache with size 0."""
+        cache = LastValueCache(0, 0)
+        cache.put("A", 1)
+        self.assertIsNone(cache.get("A"))
+
+
+class TestSensorDAO(unittest.TestCase):
+    """Test JSON files DAO."""
+
+    def setUp(self) -> None:
+        reset_cache()
+        self._tmp = tempfile.TemporaryDirectory()
+        self._conf = {"datadir": self._tmp.name}
+
+    def tearDown(self) -> None:
+        SensorDAO.close_storages()
+        reset_cache()
+        self._tmp.cleanup()
+
+    def test_read_through(self):
+        """Test reads only hit disk on cache misses."""
+        dao = SensorDAO(self._conf)
+        dao.upsert({"sensorId": "A", "value": "1", "measurementDate": "x"})
+        self.assertTrue(os.path.exists(f"{self._tmp.name}/A.json"))
+
+        with mock.patch("sensotrack.dao.open") as open_mock:
+            self.assertEqual(SensorDAO(self._conf).get("A")["value"], "1")
+            self.assertFalse(open_mock.called)
+
+        reset_cache()
+        self.assertEqual(SensorDAO(self._conf).get("A")["value"], "1")
+
+    def test_rendered(self):
+        """Test rendering is done once and matches API marshalling."""
+        sensor = {"sensorId": "A", "value": "1", "measurementDate": "x"}
+        self.assertEqual(
+            render_sensor(sensor),
+            (json.dumps(marshal(sensor, SENSOR_VALUE)) + "\n").encode("utf-8")
+        )
+        dao = SensorDAO(self._conf)
+        dao.upsert(sensor)
+        with mock.patch("sensotrack.dao.render_sensor") as render_mock:
+            self.assertEqual(dao.get_rendered("A"), render_sensor(sensor))
+            self.assertFalse(render_mock.called)
+
+        reset_cache()
+        self.assertEqual(SensorDAO(self._conf).get_rendered("A"), render_sensor(sensor))
+        self.assertIsNone(SensorDAO(self._conf).get_rendered("B"))
+
+    def test_delete(self):
+        """Test delete invalidates cache."""
+        dao = SensorDAO(self._conf)
+        dao.upsert({"sensorId": "A", "value": "1", "measurementDate": "x"})
+        dao.delete("A")
+        self.assertIsNone(dao.get("A"))
+
+
+class TestGroupCommitWriter(unittest.TestCase):
+    """Test JSON files DAO with group commit writer."""
+
+    def setUp(self) -> None:
+        reset_cache()
+        self._tmp = tempfile.TemporaryDirectory()
+        self._conf = {
+            "datadir": self._tmp.name,
+            "dao": {
+                "writer": {
+                    "enabled": True,
+                    "flush_interval_s": 0.2,
+                    "max_batch": 1000,
+                    "fsync": False
+                },
+                "cache": {"size": 0}
+            }
+        }
+
+    def tearDown(self) -> None:
+        SensorDAO.close_storages()
+        reset_cache()
+        self._tmp.cleanup()
+
+    def test_coalesce(self):
+        """Test updates of a sensor are coalesced to the latest one."""
+        dao = SensorDAO(self._conf)
+        with mock.patch("sensotrack.dao.writer.os.replace", wraps=os.replace) as replace_mock:
+            for i in range(50):
+                dao.upsert({"sensorId": "A", "value": str(i), "measurementDate": "x"})
+                dao.upsert({"sensorId": "B", "value": str(i), "measurementDate": "x"})
+            # Read your writes before flush
+            self.assertEqual(dao.get("A")["value"], "49")
+            dao.storage.flush()
+            self.assertEqual(replace_mock.call_count, 2)
+
+        self.assertEqual(dao.get("A")["value"], "49")
+        self.assertEqual(sorted(os.listdir(self._tmp.name)), ["A.json", "B.json"])
+
+    def test_delete_pending(self):
+        """Test deleted sensor is not written by writer."""
+        dao = SensorDAO(self._conf)
+        dao.upsert({"sensorId": "A", "value": "1", "measurementDate": "x"})
+        dao.delete("A")
+        dao.storage.flush()
+        self.assertIsNone(dao.get("A"))
+
+    def test_delete_while_writing(self):
+        """Test sensor deleted after its batch was collected is not written."""
+        self._conf["dao"]["writer"]["fsync"] = True
+        dao = SensorDAO(self._conf)
+        dumps = json.dumps
+
+        def delete_then_dumps(sensor):
+            if sensor["sensorId"] == "A":
+                dao.delete("A")
+            return dumps(sensor)
+
+        with mock.patch("sensotrack.dao.writer.json.dumps", side_effect=delete_then_dumps):
+            dao.upsert({"sensorId": "A", "value": "1", "measurementDate": "x"})
+            dao.upsert({"sensorId": "B", "value": "1", "measurementDate": "x"})
+            dao.storage.flush()
+        self.assertEqual(os.listdir(self._tmp.name), ["B.json"])
+        self.assertIsNone(dao.get("A"))
+
+    def test_update_while_writing(self):
+        """Test value updated after its batch was collected is still written."""
+        self._conf["dao"]["writer"]["fsync"] = True
+        dao = SensorDAO(self._conf)
+        dumps = json.dumps
+        written = []
+
+        def update_then_dumps(sensor):
+            if sensor["value"] == "1":
+                dao.upsert({"sensorId": "A", "value": "2", "measurementDate": "x"})
+            return dumps(sensor)
+
+        def replace(src, dst):
+            with open(src, encoding="utf-8") as data_file:
+                written.append(json.load(data_file)["value"])
+            os.rename(src, dst)
+
+        with mock.patch("sensotrack.dao.writer.json.dumps", side_effect=update_then_dumps), \
+                mock.patch("sensotrack.dao.writer.os.replace", side_effect=replace):
+            dao.upsert({"sensorId": "A", "value": "1", "measurementDate": "x"})
+            dao.storage.flush()
+        self.assertEqual(written, ["1", "2"])
+        self.assertEqual(dao.get("A")["value"], "2")
+        self.assertEqual(os.listdir(self._tmp.name), ["A.json"])
+
+    def test_sync_fallback(self):
+        """Test files are synced one by one without syncfs()."""
+        self._conf["dao"]["writer"]["fsync"] = True
+        dao = SensorDAO(self._conf)
+        with mock.patch("sensotrack.dao.writer._SYNCFS", None), \
+                mock.patch("sensotrack.dao.writer.os.fsync", wraps=os.fsync) as fsync_mock:
+            for sid in ("A", "B"):
+                dao.upsert({"sensorId": sid, "value": "1", "measurementDate": "x"})
+            dao.storage.flush()
+        # Both files then the directory
+        self.assertEqual(fsync_mock.call_count, 3)
+        self.assertEqual(sorted(os.listdir(self._tmp.name)), ["A.json", "B.json"])
+
+
+class TestSQLiteStorage(unittest.TestCase):
+    """Test SQLite backend."""
+
+    def setUp(self) -> None:
+        reset_cache()
+        self._tmp = tempfile.TemporaryDirectory()
+        self._conf = {
+            "datadir": self._tmp.name,
+            "dao": {
+                "backend": "sqlite",
+                "cache": {"size": 0}
+            }
+        }
+
+    def tearDown(self) -> None:
+        SensorDAO.close_storages()
+        reset_cache()
+        self._tmp.cleanup()
+
+    def test_upsert_get_delete(self):
+        """Test DAO contract with SQLite backend."""
+        dao = SensorDAO(self._conf)
+        for i in range(100):
+            dao.upsert({
+                "sensorId": "A",
+                "value": str(i),
+                "measurementDate": "2023-10-03T05:27:40.464057+00:00"
+            })
+        # Read your writes, even before commit
+        self.assertEqual(dao.get("A")["value"], "99")
+        dao.storage.flush()
+        self.assertEqual(SensorDAO(self._conf).get("A")["value"], "99")
+
+        dao.delete("A")
+        self.assertIsNone(dao.get("A"))
+        dao.storage.flush()
+        self.assertIsNone(dao.get("A"))
+
+    def test_upsert_many(self):
+        """Test batched writes."""
+        dao = SensorDAO(self._conf)
+        dao.upsert_many([
+            {
+                "sensorId": sid,
+                "value": str(i),
+                "measurementDate": "2023-10-03T05:27:40.464057+00:00"
+            }
+            for i in range(10) for sid in ("A", "B")
+        ])
+        self.assertEqual(dao.get("A")["value"], "9")
+        dao.storage.flush()
+        self.assertEqual(
+            {sid: sensor["value"] for sid, sensor in dao.get_many(["A", "B"]).items()},
+            {"A": "9", "B": "9"}
+        )
+
+    def test_get_many(self):
+        """Test batched reads."""
+        dao = SensorDAO(self._conf)
+        for sid in ["A", "B", "C"]:
+            dao.upsert({
+                "sensorId": sid,
+                "value": sid,
+                "measurementDate": "2023-10-03T05:27:40.464057+00:00"
+            })
+        dao.storage.flush()
+        dao.delete("C")
+        res = dao.get_many(["A", "B", "C", "D"])
+        self.assertEqual(sorted(res), ["A", "B"])
+        self.assertEqual(res["B"]["value"], "B")
+        self.assertEqual(dao.list_ids(), ["A", "B"])
+
+        reset_cache()
+        self.assertEqual(
+            SensorDAO(self._conf).get_dates(["A", "C"]),
+            {"A": "2023-10-03T05:27:40.464057+00:00"}
+        )
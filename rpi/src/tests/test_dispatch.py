@@ -0,0 +1,228 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from sensotrack.services.dispatch import AsyncDispatchPool, DispatchPool
+from sensotrack.utils.metrics import REGISTRY
+
+
+class TestDispatchPool(unittest.TestCase):
+    """Test bounded dispatch workers."""
+
+    def test_ordering(self):
+        """Test items of a key are handled in order by one worker."""
+        handled = {}
+        threads = {}
+
+        def handler(item):
+            key, index = item
+            handled.setdefault(key, []).append(index)
+            threads.setdefault(key, set()).add(threading.current_thread().name)
+
+        pool = DispatchPool(handler, 4, 10, "block", "test.dispatch.ordering")
+        pool.start()
+        for index in range(100):
+            for key in ("a", "b", "c"):
+                pool.submit(key, (key, index))
+        pool.stop()
+        pool.join()
+        for key in ("a", "b", "c"):
+            self.assertEqual(handled[key], list(range(100)))
+            self.assertEqual(len(threads[key]), 1)
+        self.assertEqual(REGISTRY.gauge("test.dispatch.ordering.queue_depth").value, 0)
+        self.assertEqual(
+            REGISTRY.summary("test.dispatch.ordering.wait_s").snapshot()["count"], 300
+        )
+
+    def _overflow(self, policy):
+        release = threading.Event()
+        handled = []
+
+        def handler(item):
+            release.wait(5)
+            handled.append(item)
+
+        pool = DispatchPool(handler, 1, 2, policy, f"test.dispatch.{policy}")
+        pool.start()
+        pool.submit("s", 0)
+        # Wait for the worker to hold item 0
+        while REGISTRY.gauge(f"test.dispatch.{policy}.queue_depth").value:
+            time.sleep(0.001)
+        results = [pool.submit("s", item) for item in (1, 2, 3)]
+        release.set()
+        pool.stop()
+        pool.join()
+        return results, handled
+
+    def test_drop_oldest(self):
+        """Test oldest item is dropped on overflow."""
+        results, handled = self._overflow("drop_oldest")
+        self.assertEqual(results, [True, True, True])
+        self.assertEqual(handled, [0, 2, 3])
+        self.assertEqual(REGISTRY.counter("test.dispatch.drop_oldest.dropped").value, 1)
+
+    def test_shed(self):
+        """Test new item is dropped on overflow."""
+        results, handled = self._overflow("shed")
+        self.assertEqual(results, [True, True, False])
+        self.assertEqual(handled, [0, 1, 2])
+        self.assertEqual(REGISTRY.counter("test.dispatch.shed.shed").value, 1)
+
+    def test_block(self):
+        """Test submit waits for room in queue."""
+        release = threading.Event()
+        pool = DispatchPool(lambda item: release.wait(5), 1, 1, "block", "test.dispatch.block")
+        pool.start()
+        pool.submit("s", 0)
+        pool.submit("s", 1)
+        submitted = threading.Event()
+        threading.Thread(target=lambda: (pool.submit("s", 2), submitted.set())).start()
+        self.assertFalse(submitted.wait(0.05))
+        release.set()
+        self.assertTrue(submitted.wait(5))
+        pool.stop()
+        pool.join()
+
+    def test_submit_after_stop(self):
+        """Test items submitted after stop are shed and workers still end."""
+        release = threading.Event()
+        handled = []
+
+        def handler(item):
+            release.wait(5)
+            handled.append(item)
+
+        pool = DispatchPool(handler, 1, 1, "drop_oldest", "test.dispatch.stopped")
+        pool.start()
+        pool.submit("s", 0)
+        while REGISTRY.gauge("test.dispatch.stopped.queue_depth").value:
+            time.sleep(0.001)
+        pool.submit("s", 1)
+        pool.stop()
+        self.assertFalse(pool.submit("s", 2))
+        release.set()
+        pool.join(5)
+        self.assertFalse(pool._workers[0].thread.is_alive())  # pylint: disable=protected-access
+        self.assertEqual(handled, [0, 1])
+        self.assertEqual(REGISTRY.counter("test.dispatch.stopped.shed").value, 1)
+
+    def test_handler_error(self):
+        """Test workers survive handler errors."""
+        handled = []
+
+        def handler(item):
+            if item == 0:
+                raise ValueError("boom")
+            handled.append(item)
+
+        pool = DispatchPool(handler, 1, 10, "block", "test.dispatch.error")
+        pool.start()
+        pool.submit("s", 0)
+        pool.submit("s", 1)
+        pool.stop()
+        pool.join()
+        self.assertEqual(handled, [1])
+        self.assertEqual(REGISTRY.counter("test.dispatch.error.errors").value, 1)
+
+    def test_batch(self):
+        """Test workers hand batches of queued items."""
+        release = threading.Event()
+        batches = []
+
+        def handler(items):
+            release.wait(5)
+            batches.append(items)
+
+        pool = DispatchPool(handler, 1, 100, "block", "test.dispatch.batch", max_batch=4)
+        pool.start()
+        for item in range(10):
+            pool.submit("s", item)
+        release.set()
+        pool.stop()
+        pool.join()
+        self.assertEqual(sum(batches, []), list(range(10)))
+        self.assertLessEqual(max(len(batch) for batch in batches), 4)
+        self.assertGreater(len(batches[1]), 1)
+
+
+class TestAsyncDispatchPool(unittest.IsolatedAsyncioTestCase):
+    """Test bounded dispatch worker tasks."""
+
+    async def test_ordering(self):
+        """Test items of a key are handled in order, with batches."""
+        handled = {}
+
+        async def handler(items):
+            await asyncio.sleep(0)
+            for key, index in items:
+                handled.setdefault(key, []).append(index)
+
+        pool = AsyncDispatchPool(
+            handler, 4, 1000, "block", "test.adispatch.ordering", max_batch=8
+        )
+        pool.start()
+        for index in range(100):
+            for key in ("a", "b", "c"):
+                pool.submit(key, (key, index))
+        pool.stop()
+        await pool.join(5)
+        for key in ("a", "b", "c"):
+            self.assertEqual(handled[key], list(range(100)))
+        self.assertEqual(REGISTRY.gauge("test.adispatch.ordering.queue_depth").value, 0)
+
+    async def test_block(self):
+        """Test producer is paused while a queue is full."""
+        release = asyncio.Event()
+        calls = []
+
+        async def handler(item):
+            await release.wait()
+
+        pool = AsyncDispatchPool(
+            handler, 1, 1, "block", "test.adispatch.block",
+            pause=lambda: calls.append("pause"), resume=lambda: calls.append("resume")
+        )
+        pool.start()
+        self.assertTrue(pool.submit("s", 0))
+        await asyncio.sleep(0)
+        pool.submit("s", 1)
+        self.assertEqual(calls, [])
+        # Queued anyway, producer is told to pause
+        self.assertTrue(pool.submit("s", 2))
+        self.assertEqual(calls, ["pause"])
+        release.set()
+        pool.stop()
+        await pool.join(5)
+        self.assertEqual(calls, ["pause", "resume"])
+
+    async def test_submit_after_stop(self):
+        """Test items submitted after stop are shed and workers still end."""
+        handled = []
+
+        async def handler(item):
+            handled.append(item)
+
+        pool = AsyncDispatchPool(handler, 1, 1, "drop_oldest", "test.adispatch.stopped")
+        pool.start()
+        pool.submit("s", 0)
+        pool.stop()
+        self.assertFalse(pool.submit("s", 1))
+        await pool.join(5)
+        self.assertTrue(all(worker.task.done() for worker in pool._workers))  # pylint: disable=protected-access
+        self.assertEqual(handled, [0])
+
+    async def test_shed(self):
+        """Test new item is dropped on overflow."""
+        handled = []
+
+        async def handler(item):
+            handled.append(item)
+
+        pool = AsyncDispatchPool(handler, 1, 2, "shed", "test.adispatch.shed")
+        pool.start()
+        results = [pool.submit("s", item) for item in (0, 1, 2)]
+        pool.stop()
+        await pool.join(5)
+        self.assertEqual(results, [True, True, False])
+        self.assertEqual(handled, [0, 1])
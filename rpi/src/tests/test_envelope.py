@@ -0,0 +1,60 @@
+import time
+import unittest
+
+from sensotrack.services import envelope
+
+
+class TestEnvelope(unittest.TestCase):
+    """Test readings envelopes."""
+
+    def test_round_trip(self):
+        """Test values text is kept whatever wire type is used."""
+        values = [
+            "12", "-3", "12.5", "1.50", "-0.05", "0", "-0", "-0.0", "1e3", "007", "nan",
+            "on", "", "é" * 10, "1" * 40, 42, 1.25
+        ]
+        records = [(f"s{i % 3}", 1696310860.25 + i, i, value) for i, value in enumerate(values)]
+        payload = envelope.encode(records)
+        decoded = envelope.decode(payload)
+        self.assertEqual(
+            [(sid, seq, value) for sid, _, seq, value in decoded],
+            [(sid, seq, str(value)) for sid, _, seq, value in records]
+        )
+        for (_, ts, _, _), (_, sent_ts, _, _) in zip(decoded, records):
+            self.assertAlmostEqual(ts, sent_ts, places=6)
+        # Sensors ids are sent once
+        self.assertEqual(payload.count(b"s1"), 1)
+
+    def test_invalid(self):
+        """Test unsupported payloads are rejected."""
+        payload = envelope.encode([("s", 1.0, 0, "abc")])
+        for invalid in (b"", b"12.5", b"STB\x02\x00\x00\x00\x00", payload[:-1], payload[:12]):
+            with self.assertRaises(ValueError):
+                envelope.decode(invalid)
+        with self.assertRaises(ValueError):
+            envelope.encode([("s", 1.0, 0, "1"), ("s", 1.0, 2, "1")])
+
+    def test_window(self):
+        """Test window is due on size and latency."""
+        window = envelope.BatchWindow(3, 16384, 60)
+        self.assertFalse(window.due())
+        for i in range(3):
+            window.add("s", float(i), str(i))
+        self.assertTrue(window.due())
+        records = window.take()
+        self.assertEqual([record[2] for record in records], [0, 1, 2])
+        self.assertEqual(len(window), 0)
+
+        # Sequences of unpublished records are reused
+        window.add("s", 3.0, "3")
+        self.assertEqual([record[2] for record in window.take()], [0])
+        window.published(records)
+        window.add("s", 3.0, "3")
+        self.assertEqual([record[2] for record in window.take()], [3])
+
+        window = envelope.BatchWindow(100, 16384, 0.01)
+        window.add("s", 0.0, "0")
+        self.assertFalse(window.due())
+        time.sleep(0.02)
+        self.assertTrue(window.due())
+        self.assertEqual(window.take(), [("s", 0.0, 0, "0")])
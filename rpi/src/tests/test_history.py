@@ -0,0 +1,153 @@
+import os
+import tempfile
+import time
+import unittest
+
+import mock
+
+from sensotrack.dao import archive
+from sensotrack.dao.history import HistoryDAO
+
+
+class TestHistoryDAO(unittest.TestCase):
+    """Test append only history store."""
+
+    def setUp(self) -> None:
+        self._tmp = tempfile.TemporaryDirectory()
+        self._conf = {
+            "datadir": self._tmp.name,
+            "history": {
+                "enabled": True,
+                "segment_s": 100,
+                "index_every": 4
+            }
+        }
+
+    def tearDown(self) -> None:
+        self._tmp.cleanup()
+
+    def test_range_query(self):
+        """Test time range reads across segments."""
+        dao = HistoryDAO(self._conf)
+        for i in range(1000):
+            dao.append("A", 1000.0 + i, str(i))
+
+        self.assertEqual(len(dao.segments("A")), 10)
+        res = dao.query("A", 1250, 1349)
+        self.assertEqual(len(res), 100)
+        self.assertEqual(res[0], (1250.0, "250"))
+        self.assertEqual(res[-1], (1349.0, "349"))
+
+        res = dao.query("A", 1250, None, 10)
+        self.assertEqual([item[1] for item in res], [str(i) for i in range(250, 260)])
+
+        self.assertEqual(len(dao.query("A")), 1000)
+        self.assertEqual(dao.query("B"), [])
+
+    def test_append_many(self):
+        """Test batched appends."""
+        dao = HistoryDAO(self._conf)
+        dao.append_many([(sid, 1000.0 + i, str(i)) for i in range(300) for sid in ("A", "B")])
+        self.assertEqual(len(dao.segments("A")), 3)
+        self.assertEqual(dao.query("B", 1250, 1251), [(1250.0, "250"), (1251.0, "251")])
+
+    def test_unsorted_segment(self):
+        """Test reading segment with out of order readings."""
+        dao = HistoryDAO(self._conf)
+        for ts in [10, 11, 12, 13, 14, 5, 15, 16, 17]:
+            dao.append("A", float(ts), str(ts))
+        res = dao.query("A", 5, 12)
+        self.assertEqual([item[0] for item in res], [5.0, 10.0, 11.0, 12.0])
+
+    def test_drop_segments(self):
+        """Test segments retention."""
+        dao = HistoryDAO(self._conf)
+        for i in range(300):
+            dao.append("A", 1000.0 + i, str(i))
+        self.assertEqual(dao.drop_segments("A", 1250), 2)
+        self.assertEqual(dao.segments("A"), [1200])
+        dao.append("A", 1300.0, "x")
+        dao.delete("A")
+        self.assertEqual(dao.segments("A"), [])
+
+    def test_reopen(self):
+        """Test appending after writer state is lost."""
+        dao = HistoryDAO(self._conf)
+        now = time.time()
+        dao.append("A", now, "1")
+        HistoryDAO._open_segments.popitem()[1].close()  # pylint: disable=protected-access
+        dao.append("A", now + 0.5, "2")
+        self.assertEqual([item[1] for item in dao.query("A")], ["1", "2"])
+
+    def test_compaction(self):
+        """Test queries span hot and archived segments."""
+        dao = HistoryDAO(self._conf)
+        for i in range(300):
+            dao.append("A", 1000.0 + i, repr(float(i % 50)))
+        dao.append("A", 1001.5, "late")
+        self.assertEqual(dao.compact("A", 1250), 2)
+        self.assertEqual(dao.segments("A"), [1000, 1100, 1200])
+
+        res = dao.query("A", 1095, 1105)
+        self.assertEqual([item[0] for item in res], [1095.0 + i for i in range(11)])
+        self.assertEqual(res[0][1], "45.0")
+        self.assertEqual(dao.query("A", 1001, 1002)[1], (1001.5, "late"))
+
+        # Late reading appended to an archived segment
+        dao.append("A", 1050.5, "42.0")
+        self.assertEqual(dao.query("A", 1050, 1051)[1], (1050.5, "42.0"))
+
+        res = dao.query("A", None, None, 1000, 49, 49.5)
+        self.assertEqual([item[0] for item in res], [1049.0, 1099.0, 1149.0, 1199.0, 1249.0, 1299.0])
+        self.assertEqual(len(dao.query("A")), 302)
+
+    def test_query_during_compaction(self):
+        """Test queries racing with compaction neither duplicate nor miss readings."""
+        dao = HistoryDAO(self._conf)
+        for i in range(100):
+            dao.append("A", 1000.0 + i, str(i))
+        dao.compact("A", 1200)
+        # Late readings
+        dao.append("A", 1000.5, "late")
+        dao.append("A", 1001.5, "late")
+
+        # Archive replaced, log not removed yet
+        results = []
+        replace = os.replace
+
+        def replace_then_query(src, dst):
+            replace(src, dst)
+            results.append(dao.query("A"))
+
+        with mock.patch("sensotrack.dao.history.os.replace", side_effect=replace_then_query):
+            dao.compact("A", 1200)
+        self.assertEqual(len(results[0]), 102)
+        self.assertEqual(results[0][1], (1000.5, "late"))
+
+        # Log removed after the previous archive was read
+        dao.append("A", 1002.5, "late")
+        read = archive.read_archive
+
+        def read_then_compact(*args):
+            res = read(*args)
+            if not results[1:]:
+                results.append(None)
+                dao.compact("A", 1200)
+            return res
+
+        with mock.patch("sensotrack.dao.history.read_archive", side_effect=read_then_compact):
+            self.assertEqual(len(dao.query("A")), 103)
+
+    def test_archived_integers(self):
+        """Test integer values keep their type once archived."""
+        dao = HistoryDAO(self._conf)
+        for i, value in enumerate([42, 43, -7, 2 ** 60, "42", 1.5]):
+            dao.append(str(i // 3), 1000.0 + i, value)
+        dao.compact("0", 1200)
+        dao.compact("1", 1200)
+        self.assertEqual([item[1] for item in dao.query("0")], [42, 43, -7])
+        self.assertEqual([item[1] for item in dao.query("1")], [2 ** 60, "42", 1.5])
+
+        block = archive.encode_block([(1.0, 3), (2.0, 4)])
+        header = archive.BlockHeader(block[:archive.BLOCK_HEADER.size])
+        self.assertEqual(header.kind, archive.KIND_INT)
@@ -1,12 +1,21 @@
+import asyncio
 import datetime
+import json
 import logging
+import threading
 import time
 import unittest
 
 import mock
 import paho.mqtt.client as mqtt
 from paho.mqtt.properties import Properties as Properties
-from sensotrack.services.bus import Receiver
+from sensotrack.dao import SensorDAO
+from sensotrack.dao.cache import reset_cache
+from sensotrack.services.aiobus import AsyncMQTTClient, AsyncReceiver, BusLoop, asyncio_client
+from sensotrack.services.bus import IngestedReceiver, Receiver
+from sensotrack.services import envelope
+from sensotrack.services.notifier import ValueNotifier
+from sensotrack.utils.metrics import REGISTRY
 
 from sensotrack.services.connectors import MQTTClient
 
@@ -98,6 +107,68 @@ class TestMqttClientAbstract(unittest.TestCase):
 
         self.assertGreater(mqtt_mock.return_value.count, 0)
 
+class BasicAsyncMQTTClient(AsyncMQTTClient):
+    """Basic asyncio implementation for testing."""
+
+    last_message = None
+
+    async def process_message(self, msg):
+        self.last_message = msg
+
+
+class TestAsyncMqttClient(unittest.TestCase):
+    """Test asyncio MQTT client."""
+
+    conf = {
+        "mqtt": {
+            "host": "localhost",
+            "port": 1883,
+            "client": "asyncio"
+        }
+    }
+
+    def tearDown(self) -> None:
+        BusLoop.reset()
+
+    def test_selection(self):
+        """Test client implementation selection."""
+        self.assertTrue(asyncio_client(self.conf))
+        self.assertFalse(asyncio_client({"mqtt": {}}))
+        with self.assertRaises(ValueError):
+            asyncio_client({"mqtt": {"client": "foo"}})
+
+    def test_publish_receive(self):
+        """Test clients share the loop."""
+
+        client = BasicAsyncMQTTClient(self.conf, ["foo/bar/#"])
+        other = BasicAsyncMQTTClient(self.conf, ["foo/baz/#"])
+        client.start()
+        other.start()
+        time.sleep(0.2)
+        client.publish("foo/bar", "data")
+        client.publish("foo/baz", "other")
+        time.sleep(0.2)
+        client.stop()
+        other.stop()
+        client.join()
+        other.join()
+
+        self.assertEqual(client.last_message.payload, b"data")
+        self.assertEqual(other.last_message.payload, b"other")
+
+    @mock.patch("paho.mqtt.client.Client.connect", side_effect=ConnectionRefusedError())
+    def test_retry_connection(self, connect_mock):
+        """Test connection retries and stop while retrying."""
+
+        client = BasicAsyncMQTTClient(self.conf, ["foo/bar"])
+        client.WAIT_BEFORE_RETRY = 0.01
+        client.start()
+        time.sleep(0.1)
+        client.stop()
+        client.join()
+
+        self.assertGreater(connect_mock.call_count, 1)
+
 class TestsBusReceiver(unittest.TestCase):
     """Test MQTT Bus data receiver."""
 
@@ -126,3 +197,226 @@ class TestsBusReceiver(unittest.TestCase):
         self.assertEqual(stored_data["sensorId"], "random-sensor")
         self.assertEqual(stored_data["value"], "random-payload")
         datetime.datetime.fromisoformat(stored_data["measurementDate"])
+
+    @mock.patch("sensotrack.dao.SensorDAO.upsert_many")
+    def test_receive_batch(self, dao_mock):
+        '''Test batch of sensors data reception form bus.'''
+
+        conf = {
+            "mqtt": {
+                "host": "localhost",
+                "port": 1883
+            }
+        }
+
+        msgs = []
+        for topic in ("sensors/data/s1", "sensors/data/s2", "foo/bar", "sensors/data/s1"):
+            msg = mock.MagicMock()
+            msg.topic = topic
+            msg.payload = topic.encode("utf8")
+            msgs.append(msg)
+        # Not UTF-8, only this message is skipped
+        msg = mock.MagicMock()
+        msg.topic = "sensors/data/s3"
+        msg.payload = b"\xff\xfe"
+        msgs.insert(1, msg)
+
+        with ValueNotifier().watch("s2") as watch:
+            Receiver(conf).process_messages(msgs)
+            self.assertEqual(watch.wait(0)["value"], "sensors/data/s2")
+        stored = dao_mock.call_args[0][0]
+        self.assertEqual([sensor["sensorId"] for sensor in stored], ["s1", "s2", "s1"])
+        datetime.datetime.fromisoformat(stored[0]["measurementDate"])
+
+    @mock.patch("sensotrack.dao.SensorDAO.get_dates", return_value={})
+    @mock.patch("sensotrack.dao.SensorDAO.upsert_many")
+    def test_receive_replay(self, dao_mock, _):
+        '''Test replayed readings keep their measurement date.'''
+
+        conf = {
+            "mqtt": {
+                "host": "localhost",
+                "port": 1883
+            }
+        }
+
+        msgs = []
+        for topic, payload in (
+                ("sensors/replay/s1", '{"value": "1", "measurementDate": "2023-10-03T05:27:40+00:00"}'),
+                ("sensors/replay/s1", "not json"),
+                ("sensors/data/s1", "2")
+        ):
+            msg = mock.MagicMock()
+            msg.topic = topic
+            msg.payload = payload.encode("utf8")
+            msgs.append(msg)
+
+        Receiver(conf).process_messages(msgs)
+        stored = dao_mock.call_args[0][0]
+        self.assertEqual([sensor["value"] for sensor in stored], ["1", "2"])
+        self.assertEqual(stored[0]["measurementDate"], "2023-10-03T05:27:40+00:00")
+        self.assertGreater(stored[1]["measurementDate"], "2023-10-04")
+
+    @mock.patch(
+        "sensotrack.dao.SensorDAO.get_dates",
+        return_value={"s1": "2023-10-03T05:27:41+00:00"}
+    )
+    @mock.patch("sensotrack.dao.SensorDAO.upsert")
+    @mock.patch("sensotrack.dao.SensorDAO.upsert_many")
+    @mock.patch("sensotrack.services.publisher.MQTTPublisher.publish")
+    @mock.patch("sensotrack.services.stream.StreamHub.publish")
+    @mock.patch("sensotrack.services.notifier.ValueNotifier.notify")
+    def test_receive_old_replay(self, notify_mock, stream_mock, announce_mock, *dao_mocks):
+        '''Test replayed readings older than last value are not propagated.'''
+
+        upsert_many_mock, upsert_mock, _ = dao_mocks
+        conf = {
+            "mqtt": {
+                "host": "localhost",
+                "port": 1883
+            }
+        }
+        msgs = []
+        for date in ("2023-10-03T05:27:40+00:00", "2023-10-03T05:27:42+00:00"):
+            msg = mock.MagicMock()
+            msg.topic = "sensors/replay/s1"
+            msg.payload = json.dumps({"value": date, "measurementDate": date}).encode("utf8")
+            msgs.append(msg)
+
+        receiver = Receiver(conf, announce=True)
+        receiver.process_message(msgs[0])
+        upsert_mock.assert_not_called()
+        receiver.process_messages(msgs)
+        self.assertEqual(
+            [sensor["value"] for sensor in upsert_many_mock.call_args[0][0]],
+            ["2023-10-03T05:27:42+00:00"]
+        )
+        for propagate_mock in (notify_mock, stream_mock, announce_mock):
+            self.assertEqual(propagate_mock.call_count, 1)
+            self.assertIn("05:27:42", json.dumps(propagate_mock.call_args[0][1]))
+
+    @mock.patch("sensotrack.dao.SensorDAO.get_dates", return_value={})
+    @mock.patch("sensotrack.dao.SensorDAO.upsert")
+    @mock.patch("sensotrack.dao.SensorDAO.upsert_many")
+    def test_receive_envelope(self, dao_mock, upsert_mock, _):
+        '''Test readings envelopes are decoded with source timestamps.'''
+
+        conf = {
+            "mqtt": {
+                "host": "localhost",
+                "port": 1883
+            }
+        }
+
+        receiver = Receiver(conf)
+        gaps = REGISTRY.counter("bus.batch.gaps").value
+        for records in (
+                [("s1", 1696310860.0, 0, "1"), ("s2", 1696310860.5, 1, "2.5")],
+                # Reading 2 was lost
+                [("s1", 1696310861.0, 3, "on")]
+        ):
+            msg = mock.MagicMock()
+            msg.topic = "sensors/batch/serialconnector"
+            msg.payload = envelope.encode(records)
+            receiver.process_message(msg)
+        self.assertEqual(REGISTRY.counter("bus.batch.gaps").value - gaps, 1)
+        stored = dao_mock.call_args_list[0][0][0]
+        self.assertEqual([sensor["value"] for sensor in stored], ["1", "2.5"])
+        self.assertEqual(stored[1]["measurementDate"], "2023-10-03T05:27:40.500000+00:00")
+
+        self.assertEqual(upsert_mock.call_args[0][0]["value"], "on")
+
+        msg.payload = b"garbage"
+        receiver.process_message(msg)
+        self.assertEqual(dao_mock.call_count + upsert_mock.call_count, 2)
+
+    @mock.patch("sensotrack.dao.SensorDAO.upsert_many")
+    def test_async_receive(self, dao_mock):
+        '''Test asyncio receiver registers data.'''
+
+        conf = {
+            "mqtt": {
+                "host": "localhost",
+                "port": 1883
+            }
+        }
+
+        msg = mock.MagicMock()
+        msg.topic = "sensors/data/random-sensor"
+        msg.payload = b'random-payload'
+
+        threads = []
+        dao_mock.side_effect = lambda _: threads.append(threading.current_thread().name)
+        receiver = AsyncReceiver(conf)
+        with ValueNotifier().watch("random-sensor") as watch:
+            asyncio.run(receiver.process_messages([msg]))
+            self.assertEqual(watch.wait(0)["value"], "random-payload")
+        self.assertEqual(dao_mock.call_args[0][0][0]["sensorId"], "random-sensor")
+        # Not registered by the loop thread
+        self.assertTrue(threads[0].startswith("mqtt.register"))
+        receiver.join()
+
+    @mock.patch("sensotrack.services.bus.MQTTPublisher")
+    @mock.patch("sensotrack.dao.SensorDAO.upsert", mock.MagicMock())
+    def test_announce(self, publisher_mock):
+        '''Test registered values are announced to API workers.'''
+
+        conf = {
+            "mqtt": {
+                "host": "localhost",
+                "port": 1883
+            }
+        }
+
+        msg = mock.MagicMock()
+        msg.topic = "sensors/data/random-sensor"
+        msg.payload = b'random-payload'
+
+        Receiver(conf).process_message(msg)
+        self.assertFalse(publisher_mock.get.called)
+
+        Receiver(conf, announce=True).process_message(msg)
+        topic, payload = publisher_mock.get.return_value.publish.call_args[0]
+        self.assertEqual(topic, "sensors/ingested/random-sensor")
+        self.assertEqual(json.loads(payload)["value"], "random-payload")
+
+
+class TestsIngestedReceiver(unittest.TestCase):
+    """Test values registered by ingest process reception."""
+
+    def setUp(self) -> None:
+        reset_cache()
+
+    def tearDown(self) -> None:
+        reset_cache()
+
+    def test_receive(self):
+        '''Test cache, waiters and streams are fed.'''
+
+        conf = {
+            "mqtt": {
+                "host": "localhost",
+                "port": 1883
+            },
+            "datadir": "/nonexistent"
+        }
+        sensor = {
+            "sensorId": "random-sensor",
+            "value": "2",
+            "measurementDate": "2023-10-03T05:27:41+00:00"
+        }
+        older = dict(sensor, value="1", measurementDate="2023-10-03T05:27:40+00:00")
+
+        receiver = IngestedReceiver(conf)
+        with ValueNotifier().watch("random-sensor") as watch:
+            for value in (sensor, older):
+                msg = mock.MagicMock()
+                msg.topic = "sensors/ingested/random-sensor"
+                msg.payload = json.dumps(value).encode("utf8")
+                receiver.process_message(msg)
+            self.assertEqual(watch.wait(0), older)
+        # Out of order value was not cached
+        self.assertEqual(SensorDAO(conf).get("random-sensor"), sensor)
+
+        msg.payload = b"not json"
+        receiver.process_message(msg)
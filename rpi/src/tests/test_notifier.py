@@ -0,0 +1,43 @@
+import asyncio
+import threading
+import unittest
+
+from sensotrack.services.notifier import ValueNotifier
+
+
+class TestValueNotifier(unittest.TestCase):
+    """Test new values notifications."""
+
+    def test_wait(self):
+        """Test waiters get values notified after their subscription."""
+        notifier = ValueNotifier()
+        notifier.notify("A", {"value": "1"})  # Nobody waits
+        res = []
+        with notifier.watch("A") as watch:
+            thread = threading.Thread(target=lambda: res.append(watch.wait(5)))
+            thread.start()
+            notifier.notify("B", {"value": "2"})
+            notifier.notify("A", {"value": "3"})
+            thread.join()
+            self.assertEqual(notifier.waiters("A"), 1)
+        self.assertEqual(res, [{"value": "3"}])
+        self.assertEqual(notifier.waiters("A"), 0)
+
+    def test_timeout(self):
+        """Test wait timeout."""
+        with ValueNotifier().watch("A") as watch:
+            self.assertIsNone(watch.wait(0.01))
+
+    def test_wait_async(self):
+        """Test asyncio waiters are woken up by ingest threads."""
+        notifier = ValueNotifier()
+
+        async def wait():
+            async with notifier.watch_async("A") as watch:
+                threading.Timer(0.01, notifier.notify, ("A", {"value": "1"})).start()
+                res = await watch.wait(5)
+            async with notifier.watch_async("A") as watch:
+                return res, await watch.wait(0.01)
+
+        self.assertEqual(asyncio.run(wait()), ({"value": "1"}, None))
+        self.assertEqual(notifier.waiters("A"), 0)
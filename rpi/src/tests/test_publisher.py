@@ -0,0 +1,77 @@
+import unittest
+
+import mock
+import paho.mqtt.client as mqtt
+
+from sensotrack.services.publisher import MQTTPublisher
+from sensotrack.utils.exceptions import STException
+from sensotrack.utils.metrics import REGISTRY
+
+
+class TestMQTTPublisher(unittest.TestCase):
+    """Test shared MQTT publisher."""
+
+    def setUp(self) -> None:
+        MQTTPublisher.reset()
+        self._conf = {
+            "mqtt": {
+                "host": "localhost",
+                "port": 1883,
+                "publisher": {"qos": 1, "max_queued": 2, "wait_s": 0}
+            }
+        }
+
+    def tearDown(self) -> None:
+        MQTTPublisher.reset()
+
+    @mock.patch("paho.mqtt.client.Client")
+    def test_publish(self, mqtt_mock):
+        """Test publish tracking and errors."""
+        client = mqtt_mock.return_value
+        publisher = MQTTPublisher.get(self._conf)
+        self.assertIs(MQTTPublisher.get(self._conf), publisher)
+
+        client.publish.return_value = mock.Mock(rc=mqtt.MQTT_ERR_SUCCESS, mid=1)
+        publisher.publish("sensors/command/A", "foo")
+        client.max_queued_messages_set.assert_called_once_with(2)
+        client.publish.assert_called_once_with("sensors/command/A", "foo", 1)
+        self.assertEqual(REGISTRY.gauge("mqtt.publisher.queue_depth").value, 1)
+        count = REGISTRY.summary("mqtt.publisher.latency_s").snapshot()["count"]
+        client.on_publish(client, None, 1)
+        self.assertEqual(REGISTRY.gauge("mqtt.publisher.queue_depth").value, 0)
+        self.assertEqual(
+            REGISTRY.summary("mqtt.publisher.latency_s").snapshot()["count"], count + 1
+        )
+
+        client.publish.return_value = mock.Mock(rc=mqtt.MQTT_ERR_QUEUE_SIZE, mid=2)
+        with self.assertRaises(STException) as ctx:
+            publisher.publish("sensors/command/A", "foo")
+        self.assertEqual(ctx.exception.http_status, 503)
+
+    @mock.patch("paho.mqtt.client.Client")
+    def test_qos0_dropped(self, mqtt_mock):
+        """Test QoS 0 messages dropped by paho are not kept in flight."""
+        self._conf["mqtt"]["publisher"]["qos"] = 0
+        client = mqtt_mock.return_value
+        publisher = MQTTPublisher.get(self._conf)
+
+        client.publish.return_value = mock.Mock(rc=mqtt.MQTT_ERR_NO_CONN, mid=1)
+        with self.assertRaises(STException):
+            publisher.publish("sensors/command/A", "foo")
+        client.publish.return_value = mock.Mock(rc=mqtt.MQTT_ERR_SUCCESS, mid=2)
+        publisher.publish("sensors/command/A", "foo")
+        self.assertEqual(REGISTRY.gauge("mqtt.publisher.queue_depth").value, 1)
+
+        # Unsent messages are lost on connection loss
+        errors = REGISTRY.counter("mqtt.publisher.errors").value
+        client.on_disconnect(client, None, mqtt.MQTT_ERR_CONN_LOST)
+        self.assertEqual(REGISTRY.gauge("mqtt.publisher.queue_depth").value, 0)
+        self.assertEqual(REGISTRY.counter("mqtt.publisher.errors").value, errors + 1)
+        self.assertEqual(publisher._in_flight, {})  # pylint: disable=protected-access
+
+    @mock.patch("paho.mqtt.client.Client")
+    def test_unavailable(self, mqtt_mock):
+        """Test broker connection error."""
+        mqtt_mock.return_value.connect.side_effect = ConnectionRefusedError()
+        with self.assertRaises(STException):
+            MQTTPublisher.get(self._conf).publish("sensors/command/A", "foo")
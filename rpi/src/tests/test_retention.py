@@ -0,0 +1,147 @@
+import tempfile
+import time
+import unittest
+
+from sensotrack.dao import SensorDAO
+from sensotrack.dao.cache import reset_cache
+from sensotrack.dao.history import HistoryDAO
+from sensotrack.services.catalog import SensorCatalog
+from sensotrack.services.retention import (
+    RetentionIndex, RetentionPolicies, RetentionService
+)
+from sensotrack.services.sensors import SensorService
+
+
+class TestRetentionIndex(unittest.TestCase):
+    """Test expiry index."""
+
+    def test_pop_due(self):
+        """Test only expired keys are returned."""
+        index = RetentionIndex(granularity_s=10)
+        index.schedule("a", 105)
+        index.schedule("b", 125)
+        index.schedule("c", 105)
+        index.schedule("c", 300)  # Rescheduled
+        index.discard("b")
+
+        self.assertEqual(index.pop_due(100), (0, []))
+        scanned, due = index.pop_due(200)
+        self.assertEqual(due, ["a"])
+        self.assertEqual(scanned, 1)
+        self.assertEqual(len(index), 1)
+        self.assertEqual(index.pop_due(310)[1], ["c"])
+        self.assertEqual(len(index), 0)
+
+    def test_postpone_only(self):
+        """Test expiry is not moved backwards when postponing only."""
+        index = RetentionIndex(granularity_s=10)
+        index.schedule("a", 300, True)
+        index.schedule("a", 105, True)
+        self.assertEqual(index.pop_due(200), (0, []))
+        index.schedule("a", 400, True)
+        self.assertEqual(index.pop_due(310), (0, []))
+        self.assertEqual(index.pop_due(410)[1], ["a"])
+
+
+class TestRetentionPolicies(unittest.TestCase):
+    """Test retention policies."""
+
+    def test_get(self):
+        """Test sensor and longest prefix policies."""
+        policies = RetentionPolicies({
+            "dataCleaning": {
+                "retention_s": 100,
+                "history_retention_s": 1000,
+                "policies": [
+                    {"prefix": "tmp.", "retention_s": 10},
+                    {"prefix": "tmp.fast.", "retention_s": 1, "history_retention_s": 5},
+                    {"sensor": "tmp.door", "retention_s": 50}
+                ]
+            }
+        })
+        self.assertEqual(policies.get("room.t"), (100, 1000))
+        self.assertEqual(policies.get("tmp.t"), (10, 1000))
+        self.assertEqual(policies.get("tmp.fast.t"), (1, 5))
+        self.assertEqual(policies.get("tmp.door"), (50, 1000))
+
+
+class TestDataCleaning(unittest.TestCase):
+    """Test index driven data cleaning."""
+
+    def setUp(self) -> None:
+        RetentionService.reset()
+        SensorCatalog.reset()
+        reset_cache()
+        self._tmp = tempfile.TemporaryDirectory()
+        self._conf = {
+            "datadir": self._tmp.name,
+            "dataCleaning": {
+                "retention_s": 3600,
+                "history_retention_s": 7200,
+                "period": 3600,
+                "policies": [{"prefix": "tmp.", "retention_s": 60}]
+            },
+            "history": {"enabled": True, "segment_s": 600}
+        }
+
+    def tearDown(self) -> None:
+        SensorDAO.close_storages()
+        RetentionService.reset()
+        SensorCatalog.reset()
+        reset_cache()
+        self._tmp.cleanup()
+
+    def test_clean_data(self):
+        """Test expired sensors and segments are removed."""
+        svc = SensorService(self._conf)
+        svc.register_new_value("room.t", "21")
+        svc.register_new_value("tmp.t", "1")
+        now = time.time()
+
+        self.assertEqual(svc.clean_data(now), (0, 0, 0))
+        scanned, sensors, segments = svc.clean_data(now + 600)
+        self.assertEqual((sensors, segments), (1, 0))
+        self.assertLessEqual(scanned, 1)
+        self.assertIsNone(svc.get("tmp.t"))
+        self.assertIsNotNone(svc.get("room.t"))
+        # History is kept for its own retention period
+        self.assertEqual(len(svc.get_history("tmp.t")), 1)
+
+        # History segment expires before sensor
+        history = HistoryDAO(self._conf)
+        history.append("room.t", now - 86400, "20")
+        svc = SensorService(self._conf)
+        svc._seed_retention()  # pylint: disable=protected-access
+        self.assertEqual(svc.clean_data(now)[1:], (0, 1))
+        self.assertEqual(len(history.segments("room.t")), 1)
+        self.assertEqual(svc.clean_data(now + 3700)[1:], (1, 0))
+        self.assertEqual(len(history.segments("room.t")), 1)
+        self.assertEqual(svc.clean_data(now + 8400)[1:], (0, 2))
+        self.assertEqual(history.segments("room.t"), [])
+        self.assertEqual(history.segments("tmp.t"), [])
+
+    def test_expire_ring(self):
+        """Test expired sensor ring is removed."""
+        self._conf["ring"] = {"enabled": True, "capacity": 10}
+        svc = SensorService(self._conf)
+        svc.register_new_value("tmp.t", "1")
+        self.assertEqual(len(svc.get_window("tmp.t", 5)), 1)
+        self.assertEqual(svc.clean_data(time.time() + 600)[1], 1)
+        self.assertIsNone(svc.get_window("tmp.t", 5))
+
+    def test_replayed_readings(self):
+        """Test older readings don't replace last value nor expire sensor."""
+        svc = SensorService(self._conf)
+        svc.register_new_value("room.t", "21")
+        now = time.time()
+        svc.register_new_value("room.t", "19", now - 3000)
+        svc.register_new_values([("room.t", "18", now - 2000), ("tmp.t", "1", now - 30)])
+        self.assertEqual(svc.get("room.t")["value"], "21")
+        self.assertEqual(svc.get("tmp.t")["value"], "1")
+        self.assertEqual(
+            [reading["value"] for reading in svc.get_history("room.t")], ["19", "18", "21"]
+        )
+
+        self.assertEqual(svc.clean_data(now + 1800)[1], 1)
+        self.assertIsNotNone(svc.get("room.t"))
+        self.assertIsNone(svc.get("tmp.t"))
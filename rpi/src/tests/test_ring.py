@@ -0,0 +1,90 @@
+import multiprocessing
+import os
+import tempfile
+import unittest
+
+import mock
+
+from sensotrack.dao.ring import RingBuffer, RingDAO
+
+
+def _read_window(path, queue):
+    queue.put(RingBuffer(path).window(3))
+
+
+class TestRingBuffer(unittest.TestCase):
+    """Test mmap ring buffers."""
+
+    def setUp(self) -> None:
+        self._tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self._tmp.cleanup()
+
+    def test_wrap(self):
+        """Test window when ring wraps."""
+        ring = RingBuffer(f"{self._tmp.name}/A.ring", 4, True)
+        self.assertEqual(ring.window(10), [])
+        for i in range(6):
+            ring.append(float(i), float(i * 10))
+        self.assertEqual(ring.head, 6)
+        self.assertEqual(
+            [item[1] for item in ring.window(10)],
+            [20.0, 30.0, 40.0, 50.0]
+        )
+        self.assertEqual([item[1] for item in ring.window(2)], [40.0, 50.0])
+        ring.close()
+
+    def test_other_process_reader(self):
+        """Test reading ring from another process."""
+        path = f"{self._tmp.name}/A.ring"
+        ring = RingBuffer(path, 8, True)
+        for i in range(5):
+            ring.append(float(i), float(i))
+        queue = multiprocessing.Queue()
+        proc = multiprocessing.Process(target=_read_window, args=(path, queue))
+        proc.start()
+        res = queue.get(timeout=10)
+        proc.join()
+        self.assertEqual([item[0] for item in res], [2.0, 3.0, 4.0])
+        ring.close()
+
+    def test_dao(self):
+        """Test ring DAO."""
+        dao = RingDAO({
+            "datadir": self._tmp.name,
+            "ring": {"enabled": True, "capacity": 10}
+        })
+        self.assertIsNone(dao.window("A", 5))
+        self.assertTrue(dao.append("A", 1.0, "21.5"))
+        self.assertFalse(dao.append("A", 2.0, "not-a-number"))
+        self.assertEqual(dao.window("A", 5), [(1.0, 21.5)])
+        dao.delete("A")
+        self.assertIsNone(dao.window("A", 5))
+
+    def test_dao_ring_recreated(self):
+        """Test cached reader follows a ring removed and created again elsewhere."""
+        dao = RingDAO({
+            "datadir": self._tmp.name,
+            "ring": {"enabled": True, "capacity": 10}
+        })
+        path = f"{self._tmp.name}/ring/A.ring"
+        dao.append("A", 1.0, "1")
+        self.assertEqual(dao.window("A", 5), [(1.0, 1.0)])
+
+        # Mapped file is not checked on each access
+        with mock.patch("sensotrack.dao.ring.os.stat") as stat_mock, \
+                mock.patch("sensotrack.dao.ring.os.path.exists") as exists_mock:
+            dao.append("A", 1.5, "1.5")
+            self.assertEqual(len(dao.window("A", 5)), 2)
+        stat_mock.assert_not_called()
+        exists_mock.assert_not_called()
+
+        # Another process removes the ring then creates it again
+        RingBuffer.remove(path)
+        self.assertFalse(os.path.exists(path))
+        self.assertIsNone(dao.window("A", 5))
+        ring = RingBuffer(path, 10, True)
+        ring.append(2.0, 2.0)
+        self.assertEqual(dao.window("A", 5), [(2.0, 2.0)])
+        ring.close()
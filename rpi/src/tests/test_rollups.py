@@ -0,0 +1,128 @@
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+from sensotrack.dao.rollups import RollupDAO
+from sensotrack.services.rollups import RollupService, parse_resolution
+from sensotrack.utils.exceptions import STException
+
+
+class TestRollupService(unittest.TestCase):
+    """Test incremental rollups."""
+
+    def setUp(self) -> None:
+        self._tmp = tempfile.TemporaryDirectory()
+        self._conf = {
+            "datadir": self._tmp.name,
+            "rollups": {
+                "enabled": True,
+                "resolutions": ["1m", "1h"]
+            }
+        }
+        RollupService._pending.clear()  # pylint: disable=protected-access
+        RollupService._flushing.clear()  # pylint: disable=protected-access
+
+    def tearDown(self) -> None:
+        self._tmp.cleanup()
+
+    def test_parse_resolution(self):
+        """Test resolutions parsing."""
+        self.assertEqual(parse_resolution("30s"), 30)
+        self.assertEqual(parse_resolution("1h"), 3600)
+        self.assertRaises(STException, parse_resolution, "1y")
+        self.assertRaises(STException, parse_resolution, "0m")
+
+    def test_buckets(self):
+        """Test buckets are merged across flushes."""
+        svc = RollupService(self._conf)
+        for i in range(120):
+            svc.add("A", 3600.0 + i, str(i))
+        svc.add("A", 3600.0, "not-a-number")
+        svc.flush()
+        for i in range(120, 180):
+            svc.add("A", 3600.0 + i, str(i))
+
+        res = svc.query("A", "1m")
+        self.assertEqual(
+            res,
+            [
+                (3600, 0.0, 59.0, sum(range(60)), 60),
+                (3660, 60.0, 119.0, sum(range(60, 120)), 60),
+                (3720, 120.0, 179.0, sum(range(120, 180)), 60),
+            ]
+        )
+        svc.flush()
+        self.assertEqual(svc.query("A", "1h"), [(3600, 0.0, 179.0, sum(range(180)), 180)])
+        self.assertEqual(len(svc.query("A", "1m", 3660, 3700)), 1)
+        self.assertRaises(STException, svc.query, "A", "1d")
+
+        svc.delete("A", 3720)
+        self.assertEqual(len(svc.query("A", "1m")), 1)
+
+    def test_non_finite(self):
+        """Test NaN and infinite values are ignored."""
+        svc = RollupService(self._conf)
+        for value in ("1", "nan", "inf", float("-inf"), "3"):
+            svc.add("A", 3600.0, value)
+        self.assertEqual(svc.query("A", "1m"), [(3600, 1.0, 3.0, 4.0, 2)])
+
+    def test_query_during_flush(self):
+        """Test buckets being flushed are still seen by queries."""
+        svc = RollupService(self._conf)
+        for i in range(10):
+            svc.add("A", 3600.0 + i, str(i))
+        results = []
+        queries = []
+        merge = RollupDAO.merge
+
+        def slow_merge(dao, buckets):
+            query = threading.Thread(target=lambda: results.append(svc.query("A", "1m")))
+            query.start()
+            queries.append(query)
+            query.join(0.1)
+            merge(dao, buckets)
+
+        with patch.object(RollupDAO, "merge", autospec=True, side_effect=slow_merge):
+            svc.flush()
+        queries[0].join()
+        self.assertEqual(results, [[(3600, 0.0, 9.0, 45.0, 10)]])
+
+    def test_delete_during_flush(self):
+        """Test buckets deleted while being flushed are not stored."""
+        svc = RollupService(self._conf)
+        svc.add("A", 3600.0, "1")
+        svc.add("B", 3600.0, "2")
+        deletes = []
+        merge = RollupDAO.merge
+
+        def slow_merge(dao, buckets):
+            delete = threading.Thread(target=svc.delete, args=("A",))
+            delete.start()
+            deletes.append(delete)
+            delete.join(0.1)
+            merge(dao, buckets)
+
+        with patch.object(RollupDAO, "merge", autospec=True, side_effect=slow_merge):
+            svc.flush()
+        deletes[0].join()
+        self.assertEqual(svc.query("A", "1m"), [])
+        self.assertEqual(len(svc.query("B", "1m")), 1)
+
+        # Delete of buckets left by a failed flush
+        svc.add("A", 3600.0, "1")
+        RollupService._flushing.update(RollupService._pending)  # pylint: disable=protected-access
+        RollupService._pending.clear()  # pylint: disable=protected-access
+        svc.delete("A")
+        self.assertEqual(RollupService._flushing, {})  # pylint: disable=protected-access
+
+    def test_flush_error(self):
+        """Test deltas are kept when storage merge fails."""
+        svc = RollupService(self._conf)
+        svc.add("A", 3600.0, "1")
+        with patch.object(RollupDAO, "merge", side_effect=OSError):
+            svc.flush()
+        svc.add("A", 3601.0, "2")
+        self.assertEqual(svc.query("A", "1m"), [(3600, 1.0, 2.0, 3.0, 2)])
+        svc.flush()
+        self.assertEqual(svc.query("A", "1m"), [(3600, 1.0, 2.0, 3.0, 2)])
@@ -163,3 +163,14 @@ class TestSerialConnector(unittest.TestCase):
             serial_mock.return_value.write.call_args[0][0],
             b'COMMAND/:/SENSOR/:/SENSOR1/:/foo\n'
         )
+        connector.on_command("SENSOR1", "")
+        self.assertEqual(
+            serial_mock.return_value.write.call_args[0][0],
+            b'COMMAND/:/SENSOR/:/SENSOR1\n'
+        )
+
+        serial_mock.return_value.write.reset_mock()
+        connector.on_commands([("SENSOR1", "foo"), ("SENSOR2", "bar")])
+        serial_mock.return_value.write.assert_called_once_with(
+            b'COMMAND/:/SENSOR/:/SENSOR1/:/foo\nCOMMAND/:/SENSOR/:/SENSOR2/:/bar\n'
+        )
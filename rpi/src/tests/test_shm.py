@@ -0,0 +1,169 @@
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+import unittest
+
+import mock
+
+from sensotrack.dao import SensorDAO, render_sensor
+from sensotrack.dao import shm
+from sensotrack.dao.cache import reset_cache
+from sensotrack.dao.shm import (
+    SharedLastValues, create_shared_table, get_shared_table, reset_shared_table
+)
+
+
+def _name():
+    return f"sensotrack-test-{os.getpid()}"
+
+
+def _writer(name, count):
+    """Write values which JSON holds timestamp (run in a child process)."""
+    table = SharedLastValues.attach(name)
+    table.writable = True
+    for i in range(count):
+        table.put("s", float(i), json.dumps({"value": str(i) * (i % 50 + 1)}).encode())
+    table.close()
+
+
+class TestSharedLastValues(unittest.TestCase):
+    """Test shared memory table."""
+
+    def setUp(self) -> None:
+        self._table = SharedLastValues.create(_name(), 8, 16, 64)
+
+    def tearDown(self) -> None:
+        self._table.close(unlink=True)
+
+    def test_put_lookup(self):
+        """Test readers of another mapping see writer values."""
+        reader = SharedLastValues.attach(_name())
+        self.assertIsNone(reader.lookup("a"))
+        self.assertTrue(self._table.put("a", 1.5, b'{"value": "1"}'))
+        self.assertTrue(self._table.put("a", 2.5, b'{"value": "2"}'))
+        self.assertEqual(reader.lookup("a"), (2.5, b'{"value": "2"}'))
+        self.assertEqual(reader.get("a")[0], {"value": "2"})
+
+        # Too large value removes previous one
+        self.assertFalse(self._table.put("a", 3, b"x" * 65))
+        self.assertIsNone(reader.lookup("a"))
+        self.assertFalse(self._table.put("x" * 17, 3, b"{}"))
+
+        self._table.put("b", 1, b"{}")
+        self._table.remove("b")
+        self.assertIsNone(reader.lookup("b"))
+        reader.close()
+
+    def test_full(self):
+        """Test table full."""
+        for i in range(8):
+            self.assertTrue(self._table.put(f"s{i}", i, b"{}"))
+        self.assertFalse(self._table.put("s8", 8, b"{}"))
+        for i in range(8):
+            self.assertEqual(self._table.lookup(f"s{i}"), (i, b"{}"))
+
+    def test_churn(self):
+        """Test slots of removed sensors are reused."""
+        reader = SharedLastValues.attach(_name())
+        self.assertTrue(self._table.put("live", 0, b"{}"))
+        for i in range(100):
+            self.assertTrue(self._table.put(f"s{i}", i, b"{}"))
+            if i % 3:
+                self._table.remove(f"s{i}")
+            else:
+                # Too large values are removed too
+                self.assertFalse(self._table.put(f"s{i}", i, b"x" * 65))
+            self.assertEqual(reader.lookup("live"), (0, b"{}"))
+        for i in range(7):
+            self.assertTrue(self._table.put(f"n{i}", i, b"{}"))
+        self.assertIsNone(reader.lookup("s99"))
+        self.assertEqual(reader.lookup("n6"), (6, b"{}"))
+        reader.close()
+
+    def test_torn_slot(self):
+        """Test readers reject a slot whose data don't match its CRC."""
+        self._table.put("a", 1, b'{"value": "1"}')
+        # Data store visible before seq ones
+        # pylint: disable=protected-access
+        offset = self._table._offset(self._table._index["a"]) + shm._SLOT.size + 16
+        self._table._buf[offset + 11] = ord("2")
+        self.assertIsNone(self._table.lookup("a"))
+
+    def test_concurrent_reads(self):
+        """Test readers never get a torn value."""
+        writer = multiprocessing.get_context("spawn").Process(
+            target=_writer, args=(_name(), 50000)
+        )
+        writer.start()
+        reads = 0
+        while writer.is_alive() and self._table.lookup("s") is None:
+            time.sleep(0.001)
+        while writer.is_alive():
+            res = self._table.lookup("s")
+            if res is not None:
+                i = int(res[0])
+                self.assertEqual(json.loads(res[1]), {"value": str(i) * (i % 50 + 1)})
+                reads += 1
+        writer.join()
+        self.assertGreater(reads, 0)
+
+
+class TestSharedTableDAO(unittest.TestCase):
+    """Test DAO reads and writes through the shared table."""
+
+    def setUp(self) -> None:
+        reset_cache()
+        reset_shared_table()
+        self._tmp = tempfile.TemporaryDirectory()
+        self._conf = {
+            "datadir": self._tmp.name,
+            "dao": {
+                "cache": {"size": 0},
+                "shm": {"enabled": True, "name": _name(), "slots": 16}
+            }
+        }
+
+    def tearDown(self) -> None:
+        SensorDAO.close_storages()
+        reset_shared_table()
+        reset_cache()
+        self._tmp.cleanup()
+
+    def test_upsert_get(self):
+        """Test API process reads values written by ingest process."""
+        sensor = {
+            "sensorId": "s1",
+            "value": "42",
+            "measurementDate": "2023-10-03T05:27:40.464057+00:00"
+        }
+        # Not created by ingest yet
+        self.assertIsNone(get_shared_table(self._conf))
+
+        create_shared_table(self._conf)
+        SensorDAO(self._conf).upsert(sensor)
+
+        # Reader with no access to storage
+        with mock.patch.object(SensorDAO, "_get_storage"):
+            reader = SensorDAO(self._conf)
+            reader._storage.get.return_value = None  # pylint: disable=protected-access
+            self.assertEqual(reader.get_rendered("s1"), render_sensor(sensor))
+            self.assertEqual(reader.get("s1"), sensor)
+            self.assertEqual(reader.get_dates(["s1"]), {"s1": sensor["measurementDate"]})
+
+        SensorDAO(self._conf).delete("s1")
+        self.assertIsNone(get_shared_table(self._conf).lookup("s1"))
+
+    def test_writer_restart(self):
+        """Test readers attach to the new table of a restarted writer."""
+        old = SharedLastValues.create(_name(), 4, 16, 64)
+        with mock.patch.object(shm, "ATTACH_PERIOD_S", 0):
+            reader = get_shared_table(self._conf)
+            self.assertFalse(reader.writable)
+            new = SharedLastValues.create(_name(), 4, 16, 64)
+            new.put("s1", 1, b"{}")
+            self.assertTrue(reader.closed)
+            self.assertEqual(get_shared_table(self._conf).lookup("s1"), (1, b"{}"))
+        old.close()
+        new.close(unlink=True)
@@ -0,0 +1,141 @@
+import os
+import tempfile
+import unittest
+
+from sensotrack.dao.spool import Spool
+from sensotrack.utils.metrics import REGISTRY
+
+
+class TestSpool(unittest.TestCase):
+    """Test disk backed readings FIFO."""
+
+    def setUp(self) -> None:
+        self._tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self._tmp.cleanup()
+
+    def _spool(self, name, segment_bytes=1024, max_bytes=1024 * 1024, drain_rate=1000):
+        return Spool(self._tmp.name, segment_bytes, max_bytes, drain_rate, f"test.spool.{name}")
+
+    @staticmethod
+    def _drain(spool, accept=lambda *_: True):
+        sent = []
+
+        def send(sid, ts, value):
+            if not accept(sid, ts, value):
+                return False
+            sent.append((sid, ts, value))
+            return True
+
+        # Drain rate tokens are refilled from first call
+        spool.drain(send)
+        while len(spool):
+            spool._last_drain -= 1  # pylint: disable=protected-access
+            if not spool.drain(send):
+                break
+        return sent
+
+    def test_fifo(self):
+        """Test readings are drained in order across segments."""
+        spool = self._spool("fifo", segment_bytes=64)
+        readings = [(f"s{i % 3}", 1000.0 + i, str(i)) for i in range(20)]
+        for reading in readings:
+            self.assertTrue(spool.append(*reading))
+        self.assertEqual(len(spool), 20)
+        self.assertEqual(REGISTRY.gauge("test.spool.fifo.buffered").value, 20)
+        self.assertGreater(len(os.listdir(self._tmp.name)), 2)
+        self.assertEqual(self._drain(spool), readings)
+        self.assertEqual(REGISTRY.gauge("test.spool.fifo.bytes").value, 0)
+        self.assertEqual(REGISTRY.counter("test.spool.fifo.replayed").value, 20)
+        # Read segments are removed
+        self.assertLessEqual(len([
+            name for name in os.listdir(self._tmp.name) if name.endswith(".seg")
+        ]), 1)
+        spool.close()
+
+    def test_reopen(self):
+        """Test cursor and torn records survive a restart."""
+        spool = self._spool("reopen")
+        for i in range(5):
+            spool.append("s", float(i), str(i))
+        sent = self._drain(spool, lambda sid, ts, value: ts < 2)
+        self.assertEqual([reading[2] for reading in sent], ["0", "1"])
+        spool.close()
+        # Torn write at the end
+        segment = [name for name in os.listdir(self._tmp.name) if name.endswith(".seg")][0]
+        with open(os.path.join(self._tmp.name, segment), "ab") as data:
+            data.write(b"\x01\x02\x03")
+
+        spool = self._spool("reopen")
+        self.assertEqual(len(spool), 3)
+        spool.append("s", 5.0, "5")
+        self.assertEqual([reading[2] for reading in self._drain(spool)], ["2", "3", "4", "5"])
+        spool.close()
+
+    def test_reopen_segments(self):
+        """Test cursor is kept on restart with several segments."""
+        spool = self._spool("segments", segment_bytes=200)
+        readings = [("s", float(i), str(i)) for i in range(20)]
+        for reading in readings:
+            spool.append(*reading)
+        self.assertGreater(len([
+            name for name in os.listdir(self._tmp.name) if name.endswith(".seg")
+        ]), 1)
+        sent = self._drain(spool, lambda sid, ts, value: ts < 3)
+        self.assertEqual(sent, readings[:3])
+        spool.close()
+
+        spool = self._spool("segments", segment_bytes=200)
+        self.assertEqual(len(spool), 17)
+        self.assertEqual(self._drain(spool), readings[3:])
+        spool.close()
+
+    def test_cursor_period(self):
+        """Test cursor is not saved on each drain within a segment."""
+        spool = self._spool("cursor")
+        for i in range(5):
+            spool.append("s", float(i), str(i))
+
+        def cursor():
+            with open(os.path.join(self._tmp.name, "cursor"), encoding="utf-8") as data:
+                return data.read()
+
+        self._drain(spool, lambda sid, ts, value: ts < 1)
+        saved = cursor()
+        self._drain(spool, lambda sid, ts, value: ts < 3)
+        self.assertEqual(cursor(), saved)
+        spool._cursor_saved_at -= Spool.CURSOR_PERIOD_S  # pylint: disable=protected-access
+        self._drain(spool, lambda sid, ts, value: ts < 4)
+        self.assertNotEqual(cursor(), saved)
+        spool.close()
+
+        spool = self._spool("cursor")
+        self.assertEqual([reading[2] for reading in self._drain(spool)], ["4"])
+        spool.close()
+
+    def test_bounded(self):
+        """Test oldest segment is dropped when spool is full."""
+        spool = self._spool("bounded", segment_bytes=100, max_bytes=250)
+        for i in range(20):
+            spool.append("s", float(i), str(i))
+        self.assertLessEqual(REGISTRY.gauge("test.spool.bounded.bytes").value, 250)
+        dropped = REGISTRY.counter("test.spool.bounded.dropped").value
+        self.assertGreater(dropped, 0)
+        sent = self._drain(spool)
+        self.assertEqual(len(sent) + dropped, 20)
+        self.assertEqual(sent[-1][2], "19")
+        spool.close()
+
+    def test_drain_rate(self):
+        """Test drain is rate limited."""
+        spool = self._spool("rate", drain_rate=10)
+        for i in range(50):
+            spool.append("s", float(i), str(i))
+        sent = []
+        spool.drain(lambda *reading: sent.append(reading) or True)
+        spool._last_drain -= 0.5  # pylint: disable=protected-access
+        spool.drain(lambda *reading: sent.append(reading) or True)
+        self.assertEqual(len(sent), 5)
+        self.assertEqual(len(spool), 45)
+        spool.close()
@@ -0,0 +1,69 @@
+import unittest
+
+from sensotrack.services.stream import HEARTBEAT, StreamHub
+
+
+class TestStreamHub(unittest.TestCase):
+    """Test sensors values stream."""
+
+    def setUp(self) -> None:
+        StreamHub.reset()
+        self._conf = {
+            "stream": {
+                "buffer_size": 2,
+                "policy": "drop_oldest",
+                "heartbeat_s": 0.01,
+                "replay_size": 10
+            }
+        }
+
+    def tearDown(self) -> None:
+        StreamHub.reset()
+
+    def test_filters(self):
+        """Test subscriptions get matching events, serialized once."""
+        hub = StreamHub(self._conf)
+        by_id = hub.subscribe(ids={"A"})
+        by_prefix = hub.subscribe(prefix="room.")
+        every = hub.subscribe()
+        hub.publish("A", {"sensorId": "A", "value": "1"})
+        hub.publish("room.t", {"sensorId": "room.t", "value": "2"})
+
+        events = by_id.next_events(0)
+        self.assertEqual(len(events), 1)
+        self.assertTrue(events[0].startswith(b"id: 1\nevent: value\ndata: "))
+        self.assertEqual(len(by_prefix.next_events(0)), 1)
+        all_events = every.next_events(0)
+        self.assertEqual(len(all_events), 2)
+        self.assertIs(all_events[0], events[0])
+
+    def test_slow_consumer(self):
+        """Test drop oldest and disconnect policies."""
+        hub = StreamHub(self._conf)
+        sub = hub.subscribe()
+        for i in range(3):
+            hub.publish("A", {"value": str(i)})
+        events = sub.next_events(0)
+        self.assertEqual(sub.dropped, 1)
+        self.assertTrue(events[0].startswith(b"id: 2\n"))
+
+        self._conf["stream"]["policy"] = "disconnect"
+        sub = StreamHub(self._conf).subscribe()
+        for i in range(3):
+            hub.publish("A", {"value": str(i)})
+        self.assertIsNone(sub.next_events(0))
+
+    def test_resume_and_heartbeat(self):
+        """Test Last-Event-ID resume and heartbeats."""
+        hub = StreamHub(self._conf)
+        for i in range(5):
+            hub.publish("A", {"value": str(i)})
+        sub = hub.subscribe(ids={"A"}, last_event_id=3)
+        stream = hub.events(sub)
+        self.assertEqual(next(stream), HEARTBEAT)
+        chunk = next(stream)
+        self.assertTrue(chunk.startswith(b"id: 4\n"))
+        self.assertIn(b"id: 5\n", chunk)
+        self.assertEqual(next(stream), HEARTBEAT)
+        stream.close()
+        self.assertTrue(sub.closed)
@@ -1,20 +1,26 @@
 import threading
+import time
 import unittest
 import json
 
 import mock
+import paho.mqtt.client as mqtt
 import requests
 from werkzeug.serving import make_server
 
 from sensotrack.app import APP, load_config
 from sensotrack import settings
+from sensotrack.dao.cache import reset_cache
+from sensotrack.services.notifier import ValueNotifier
+from sensotrack.services.publisher import MQTTPublisher
+from sensotrack.services.stream import StreamHub
 
 class ServerThread(threading.Thread):
     """Mock Flask server."""
 
     def __init__(self, app):
         threading.Thread.__init__(self)
-        self.server = make_server('127.0.0.1', 8080, app)
+        self.server = make_server('127.0.0.1', 8080, app, threaded=True)
         self.ctx = app.app_context()
         self.ctx.push()
 
@@ -42,6 +48,11 @@ class TestFlaskAPI(unittest.TestCase):
         cls._server.start()
         return super().setUpClass()
 
+    def setUp(self) -> None:
+        # Do not serve values cached by previous tests
+        reset_cache()
+        MQTTPublisher.reset()
+
     @classmethod
     def tearDownClass(cls) -> None:
         cls._server.shutdown()
@@ -124,6 +135,9 @@ class TestFlaskAPI(unittest.TestCase):
     def test_send_command(self, mqtt_mock):
         """Test POST /v1/sensors/{sid} (cend command)."""
 
+        mqtt_mock.return_value.publish.return_value.rc = 0
+        mqtt_mock.return_value.publish.return_value.mid = 1
+
         resp = requests.post(
             "http://localhost:8080/v1/sensors/random-sensor",
             headers={
@@ -145,6 +159,87 @@ class TestFlaskAPI(unittest.TestCase):
             mqtt_mock.return_value.publish.call_args[0][1],
             'random-command'
         )
+        self.assertTrue(mqtt_mock.return_value.loop_start.called)
+
+        # Connection is reused
+        resp = requests.post(
+            "http://localhost:8080/v1/sensors/random-sensor",
+            headers={
+                "Accept": "application/json",
+                "Content-Type": "application/json",
+            },
+            json={
+                "command": "random-command"
+            },
+            timeout=10
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(mqtt_mock.call_count, 1)
+        self.assertEqual(mqtt_mock.return_value.publish.call_count, 2)
+
+    @mock.patch(
+        "sensotrack.services.sensors.SensorService.select_sensors",
+        mock.Mock(return_value=["room.t1", "room.t2"])
+    )
+    @mock.patch(
+        "sensotrack.services.catalog.SensorCatalog.get",
+        mock.Mock(side_effect=lambda sid: None if sid == "X" else {"sensorId": sid})
+    )
+    @mock.patch("paho.mqtt.client.Client")
+    def test_send_commands(self, mqtt_mock):
+        """Test POST /v1/sensors/commands."""
+
+        mqtt_mock.return_value.publish.return_value.rc = 0
+        mqtt_mock.return_value.publish.return_value.mid = 1
+        url = "http://localhost:8080/v1/sensors/commands"
+        resp = requests.post(
+            url,
+            json={
+                "commands": [
+                    {"sid": "A", "command": "foo"},
+                    {"sid": "X", "command": "foo"},
+                    {"sid": "B", "command": "bar"}
+                ]
+            },
+            timeout=10
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+            [(res["sensorId"], res["status"]) for res in resp.json()["results"]],
+            [("A", "dispatched"), ("X", "not_found"), ("B", "dispatched")]
+        )
+        self.assertEqual(mqtt_mock.return_value.publish.call_args[0][0], "sensors/commands")
+        self.assertEqual(
+            json.loads(mqtt_mock.return_value.publish.call_args[0][1]),
+            [{"sid": "A", "command": "foo"}, {"sid": "B", "command": "bar"}]
+        )
+
+        resp = requests.post(
+            url,
+            json={"selector": {"prefix": "room."}, "command": "reset"},
+            timeout=10
+        )
+        self.assertEqual(
+            [res["sensorId"] for res in resp.json()["results"]],
+            ["room.t1", "room.t2"]
+        )
+        self.assertEqual(mqtt_mock.return_value.publish.call_count, 2)
+
+        mqtt_mock.return_value.publish.return_value.rc = mqtt.MQTT_ERR_NO_CONN
+        resp = requests.post(url, json={"commands": [{"sid": "A", "command": "foo"}]}, timeout=10)
+        self.assertEqual(resp.json()["results"][0]["status"], "failed")
+        # Nothing published for unknown sensors only
+        resp = requests.post(url, json={"commands": [{"sid": "X", "command": "foo"}]}, timeout=10)
+        self.assertEqual(resp.json()["results"][0]["status"], "not_found")
+
+        resp = requests.post(url, json={"command": "reset"}, timeout=10)
+        self._assert_error_structure(resp, 400)
+        for selector in ({}, {"prefix": ""}, {"prefix": "", "connector": None}):
+            resp = requests.post(
+                url, json={"selector": selector, "command": "reset"}, timeout=10
+            )
+            self._assert_error_structure(resp, 400)
+        self.assertEqual(mqtt_mock.return_value.publish.call_count, 3)
 
     @mock.patch("sensotrack.dao.os.path.exists", mock.Mock(return_value=False))
     def test_get_last_not_found(self):
@@ -183,32 +278,93 @@ class TestFlaskAPI(unittest.TestCase):
         self.assertEqual(resp.json()["value"], "42")
     
     @mock.patch(
-        "sensotrack.services.sensors.SensorDAO"
+        "sensotrack.dao.SensorDAO.get_dates",
+        mock.Mock(return_value={"random-sensor": "2023-10-03T05:27:40.464057+00:00"})
     )
-    @mock.patch("sensotrack.services.sensors.time.sleep", mock.MagicMock())
-    def test_post_last(self, doa_mock):
+    @mock.patch("sensotrack.dao.SensorDAO.get")
+    def test_get_last_conditional(self, get_mock):
+        "Test GET /v1/sensors/{sid}/last with conditional headers"
+
+        get_mock.return_value = {
+            "sensorId": "random-sensor",
+            "value": "42",
+            "measurementDate": "2023-10-03T05:27:40.464057+00:00"
+        }
+        url = "http://localhost:8080/v1/sensors/random-sensor/last"
+        resp = requests.get(url, timeout=10)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers["Last-Modified"], "Tue, 03 Oct 2023 05:27:40 GMT")
+        self.assertEqual(resp.headers["Cache-Control"], "no-cache")
+        etag = resp.headers["ETag"]
+
+        get_mock.reset_mock()
+        resp = requests.get(url, headers={"If-None-Match": etag}, timeout=10)
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.headers["ETag"], etag)
+        resp = requests.get(
+            url, headers={"If-Modified-Since": "Tue, 03 Oct 2023 05:27:41 GMT"}, timeout=10
+        )
+        self.assertEqual(resp.status_code, 304)
+        get_mock.assert_not_called()
+
+        # A later value in the same second would have the same Last-Modified
+        resp = requests.get(
+            url, headers={"If-Modified-Since": "Tue, 03 Oct 2023 05:27:40 GMT"}, timeout=10
+        )
+        self.assertEqual(resp.status_code, 200)
+
+        resp = requests.get(url, headers={"If-None-Match": '"other"'}, timeout=10)
+        self.assertEqual(resp.status_code, 200)
+        resp = requests.get(
+            url, headers={"If-Modified-Since": "Tue, 03 Oct 2023 05:27:39 GMT"}, timeout=10
+        )
+        self.assertEqual(resp.status_code, 200)
+
+    @mock.patch("sensotrack.services.sensors.SensorService.send_command")
+    def test_post_last(self, send_command_mock):
         "Test POST /v1/sensors/{sid}/last (get new)"
 
-        class SensorDOAMock():
-            call_count = 0
-
-            def get(self, sid):
-                if SensorDOAMock.call_count == 0:
-                    SensorDOAMock.call_count +=1
-                    return {
-                        "sensorId": "random-sensor",
-                        "value": "42",
-                        "measurementDate": "2023-10-03T05:27:40.464057+00:00"
-                    }
-                else:
-                    SensorDOAMock.call_count +=1
-                    return {
-                        "sensorId": "random-sensor",
-                        "value": "69",
-                        "measurementDate": "2123-10-03T05:27:40.464057+00:00"
-                    }
-
-        doa_mock.return_value = SensorDOAMock()
+        notifier = ValueNotifier()
+        responses = []
+
+        def request():
+            responses.append(
+                requests.post(
+                    "http://localhost:8080/v1/sensors/random-sensor/last",
+                    headers={
+                        "Accept": "application/json",
+                    },
+                    timeout=10
+                )
+            )
+
+        clients = [threading.Thread(target=request) for _ in range(2)]
+        for client in clients:
+            client.start()
+        # Wait for both requests to subscribe then publish a new value
+        while notifier.waiters("random-sensor") < 2:
+            time.sleep(0.01)
+        notifier.notify(
+            "random-sensor",
+            {
+                "sensorId": "random-sensor",
+                "value": "69",
+                "measurementDate": "2123-10-03T05:27:40.464057+00:00"
+            }
+        )
+        for client in clients:
+            client.join()
+        for resp in responses:
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json()["value"], "69")
+        # Measurement was requested once for both requests
+        send_command_mock.assert_called_once_with("random-sensor", "")
+
+    @mock.patch("sensotrack.services.sensors.SensorService.send_command", mock.MagicMock())
+    @mock.patch.dict(settings.conf, {"notifications": {"timeout_s": 0.1}})
+    def test_post_last_timeout(self):
+        "Test POST /v1/sensors/{sid}/last without new value"
+
         resp = requests.post(
             "http://localhost:8080/v1/sensors/random-sensor/last",
             headers={
@@ -216,6 +372,165 @@ class TestFlaskAPI(unittest.TestCase):
             },
             timeout=10
         )
+        self._assert_error_structure(resp, 404)
+
+    @mock.patch(
+        "sensotrack.services.sensors.SensorService.get_history",
+        mock.Mock(
+            return_value=[{
+                "sensorId": "random-sensor",
+                "value": "42",
+                "measurementDate": "2023-10-03T05:27:40.464057+00:00"
+            }]
+        )
+    )
+    def test_get_history(self):
+        "Test GET /v1/sensors/{sid}/history"
+
+        resp = requests.get(
+            "http://localhost:8080/v1/sensors/random-sensor/history",
+            params={
+                "from": "2023-10-03T00:00:00+00:00",
+                "to": "2023-10-04T00:00:00",
+                "limit": 10
+            },
+            headers={
+                "Accept": "application/json",
+            },
+            timeout=10
+        )
         self.assertEqual(resp.status_code, 200)
-        self.assertEqual(resp.json()["value"], "69")
-        self.assertGreater(SensorDOAMock.call_count, 1)
+        self.assertEqual(resp.json()["values"][0]["value"], "42")
+
+    def test_get_history_invalid_range(self):
+        "Test GET /v1/sensors/{sid}/history with invalid dates"
+
+        resp = requests.get(
+            "http://localhost:8080/v1/sensors/random-sensor/history",
+            params={"from": "not-a-date"},
+            headers={
+                "Accept": "application/json",
+            },
+            timeout=10
+        )
+        self.assertEqual(resp.status_code, 400)
+
+    @mock.patch(
+        "sensotrack.dao.SensorDAO.get_many",
+        mock.Mock(
+            return_value={
+                "A": {
+                    "sensorId": "A",
+                    "value": "42",
+                    "measurementDate": "2023-10-03T05:27:40.464057+00:00"
+                }
+            }
+        )
+    )
+    def test_get_bulk_last(self):
+        "Test GET and POST /v1/sensors/last"
+
+        resp = requests.get(
+            "http://localhost:8080/v1/sensors/last",
+            params={"ids": "A,B"},
+            headers={
+                "Accept": "application/json",
+            },
+            timeout=10
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()["values"][0]["value"], "42")
+        self.assertEqual(resp.json()["missing"], ["B"])
+
+        resp = requests.post(
+            "http://localhost:8080/v1/sensors/last",
+            json={"ids": ["A", "B", "C"]},
+            headers={
+                "Accept": "application/json",
+            },
+            timeout=10
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()["missing"], ["B", "C"])
+
+        resp = requests.get(
+            "http://localhost:8080/v1/sensors/last",
+            headers={
+                "Accept": "application/json",
+            },
+            timeout=10
+        )
+        self.assertEqual(resp.status_code, 400)
+
+    @mock.patch("sensotrack.dao.SensorDAO.list_ids")
+    @mock.patch("sensotrack.dao.SensorDAO.get_many")
+    @mock.patch("sensotrack.dao.SensorDAO.get_dates")
+    def test_get_bulk_last_all(self, get_dates_mock, get_many_mock, list_ids_mock):
+        "Test GET /v1/sensors/last?all=true lists sensors once"
+
+        list_ids_mock.return_value = ["A", "B"]
+        get_dates_mock.return_value = {
+            "A": "2023-10-03T05:27:40.464057+00:00",
+            "B": "2023-10-03T05:27:41.464057+00:00"
+        }
+        get_many_mock.return_value = {
+            sid: {"sensorId": sid, "value": "42", "measurementDate": date}
+            for sid, date in get_dates_mock.return_value.items()
+        }
+        resp = requests.get(
+            "http://localhost:8080/v1/sensors/last", params={"all": "true"}, timeout=10
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(resp.json()["values"]), 2)
+        self.assertIn("ETag", resp.headers)
+        list_ids_mock.assert_called_once_with()
+        get_many_mock.assert_called_once_with(["A", "B"])
+
+    @mock.patch(
+        "sensotrack.services.catalog.SensorCatalog.search",
+        mock.Mock(
+            return_value=(1, [{
+                "sensorId": "A",
+                "connector": None,
+                "device": None,
+                "firstSeen": 1696310860.0,
+                "lastSeen": None,
+                "readings": 0,
+                "valueType": None
+            }])
+        )
+    )
+    def test_list_sensors(self):
+        "Test GET /v1/sensors"
+
+        resp = requests.get(
+            "http://localhost:8080/v1/sensors",
+            params={"prefix": "A", "limit": 10},
+            headers={
+                "Accept": "application/json",
+            },
+            timeout=10
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()["total"], 1)
+        self.assertEqual(resp.json()["sensors"][0]["sensorId"], "A")
+
+    def test_stream(self):
+        "Test GET /v1/sensors/stream"
+
+        with requests.get(
+            "http://localhost:8080/v1/sensors/stream?ids=random-sensor",
+            headers={"Accept": "text/event-stream"},
+            stream=True,
+            timeout=10
+        ) as resp:
+            self.assertEqual(resp.status_code, 200)
+            self.assertTrue(resp.headers["Content-Type"].startswith("text/event-stream"))
+            chunks = resp.iter_content(chunk_size=None)
+            self.assertEqual(next(chunks), b": heartbeat\n\n")
+            hub = StreamHub(settings.conf)
+            hub.publish("other-sensor", {"sensorId": "other-sensor", "value": "1"})
+            hub.publish("random-sensor", {"sensorId": "random-sensor", "value": "42"})
+            event = next(chunks).decode("utf-8")
+        self.assertIn("event: value\n", event)
+        self.assertIn('"value": "42"', event)